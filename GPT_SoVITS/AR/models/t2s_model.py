@@ -1,6 +1,7 @@
 # modified from https://github.com/yangdongchao/SoundStorm/blob/master/soundstorm/s1/AR/models/t2s_model.py
 # reference: https://github.com/lifeiteng/vall-e
 import math
+import time
 from typing import List, Optional
 import torch
 from tqdm import tqdm
@@ -340,6 +341,20 @@ class Text2SemanticDecoder(nn.Module):
             blocks.append(block)
         
         self.t2s_transformer = T2STransformer(self.num_layers, blocks)
+        # 最近一次推理的 prefill/逐 token 解码耗时, 供推理端统计
+        self.decode_stats = self._empty_decode_stats()
+
+    @staticmethod
+    def _empty_decode_stats():
+        return {"prefill_time": 0.0, "decode_time": 0.0, "decode_steps": 0}
+
+    def _record_decode_stats(self, t_start:float, prefill_time:Optional[float], steps:int):
+        total = time.perf_counter() - t_start
+        # 第一步就结束时全部计入 prefill
+        prefill_time = total if prefill_time is None else prefill_time
+        self.decode_stats["prefill_time"] += prefill_time
+        self.decode_stats["decode_time"] += total - prefill_time
+        self.decode_stats["decode_steps"] += steps
 
     def make_input_data(self, x, x_lens, y, y_lens, bert_feature):
         x = self.ar_text_embedding(x)
@@ -586,6 +601,7 @@ class Text2SemanticDecoder(nn.Module):
         repetition_penalty: float = 1.35,
         **kwargs,
     ):
+        self.decode_stats = self._empty_decode_stats()
         if prompts is None:
             print("Warning: Prompt free is not supported batch_infer! switch to naive_infer")
             return self.infer_panel_naive_batched(x, x_lens, prompts, bert_feature, top_k=top_k, top_p=top_p, early_stop_num=early_stop_num, temperature=temperature, **kwargs)
@@ -668,7 +684,12 @@ class Text2SemanticDecoder(nn.Module):
         y_list = [None]*y.shape[0]
         batch_idx_map = list(range(y.shape[0]))
         idx_list = [None]*y.shape[0]
+        t_start = time.perf_counter()
+        prefill_time = None
         for idx in tqdm(range(1500)):
+            if idx == 1:
+                # 第一步的 EOS 判断已同步设备, 到这里即 prefill 耗时
+                prefill_time = time.perf_counter() - t_start
             if idx == 0:
                 xy_dec, k_cache, v_cache = self.t2s_transformer.process_prompt(xy_pos, xy_attn_mask, xy_padding_mask, False)
             else:
@@ -740,6 +761,7 @@ class Text2SemanticDecoder(nn.Module):
             y_emb = self.ar_audio_embedding(y[:, -1:])
             xy_pos = y_emb * self.ar_audio_position.x_scale + self.ar_audio_position.alpha * self.ar_audio_position.pe[:, y_len + idx].to( dtype= y_emb.dtype,device=y_emb.device)            
 
+        self._record_decode_stats(t_start, prefill_time, idx)
         if (None in idx_list):
             for i in range(x.shape[0]):
                 if idx_list[i] is None:
@@ -762,6 +784,7 @@ class Text2SemanticDecoder(nn.Module):
         repetition_penalty: float = 1.35,
         **kwargs
         ):
+        self.decode_stats = self._empty_decode_stats()
         y_list = []
         idx_list = []
         for i in range(len(x)):
@@ -842,7 +865,11 @@ class Text2SemanticDecoder(nn.Module):
                                                 .view(bsz, self.num_head, src_len, src_len)\
                                                 .to(device=x.device, dtype=torch.bool)
 
+        t_start = time.perf_counter()
+        prefill_time = None
         for idx in tqdm(range(1500)):
+            if idx == 1:
+                prefill_time = time.perf_counter() - t_start
             if xy_attn_mask is not None:
                 xy_dec, k_cache, v_cache = self.t2s_transformer.process_prompt(xy_pos, xy_attn_mask, None)
             else:
@@ -880,6 +907,7 @@ class Text2SemanticDecoder(nn.Module):
             y_emb = self.ar_audio_embedding(y[:, -1:])
             xy_pos = y_emb * self.ar_audio_position.x_scale + self.ar_audio_position.alpha * self.ar_audio_position.pe[:, y_len + idx].to(dtype=y_emb.dtype,device=y_emb.device)
 
+        self._record_decode_stats(t_start, prefill_time, idx)
         if ref_free:
             return y[:, :-1], 0
         return y[:, :-1], idx - 1
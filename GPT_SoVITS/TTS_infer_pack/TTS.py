@@ -1,7 +1,14 @@
+from collections import OrderedDict
 from copy import deepcopy
+import hashlib
+import io
+import json
 import math
 import os, sys, gc
 import random
+import tempfile
+import threading
+import time
 import traceback
 
 from tqdm import tqdm
@@ -13,6 +20,8 @@ from typing import Generator, List, Tuple, Union
 import numpy as np
 import torch
 import torch.nn.functional as F
+from torch.profiler import record_function
+import torchaudio
 import yaml
 from transformers import AutoModelForMaskedLM, AutoTokenizer
 
@@ -22,14 +31,27 @@ from module.models import SynthesizerTrn
 import librosa
 from time import time as ttime
 from tools.i18n.i18n import I18nAuto, scan_language_list
-from tools.my_utils import load_audio
 from module.mel_processing import spectrogram_torch
 from TTS_infer_pack.text_segmentation_method import splits
 from TTS_infer_pack.TextPreprocessor import TextPreprocessor
+from TTS_infer_pack.model_residency import SHARED_MODELS, ResidentModel, ResidencyManager
+from TTS_infer_pack.prompt_cache import PromptCache
+from TTS_infer_pack import metrics, tracing
+from TTS_infer_pack.profiler_capture import profiled
+from TTS_infer_pack.warmup import default_languages, warmup_texts, write_synthetic_reference
 language=os.environ.get("language","Auto")
 language=sys.argv[-1] if sys.argv[-1] in scan_language_list() else language
 i18n = I18nAuto(language=language)
 
+# 每个音素平均对应的语义token数(25hz), 分桶时用来估计T2S的解码长度, 推理过程中按实际解码长度滑动更新
+TOKENS_PER_PHONE = {"zh": 2.6, "yue": 2.6, "ja": 1.9, "en": 2.0, "ko": 2.0}
+DEFAULT_TOKENS_PER_PHONE = 2.3
+TOKENS_PER_PHONE_MOMENTUM = 0.9
+# 分桶代价模型(以解码步为单位): 一个批次的代价 = 最长预测token数 * (1 + BATCH_ROW_COST * 行数) + BATCH_OVERHEAD_TOKENS
+# 即每个解码步有固定开销, 每多一行(包括已EOS仍在占位的行)再增加一部分; 每个批次另有prefill/VITS的固定开销
+BATCH_ROW_COST = 0.05
+BATCH_OVERHEAD_TOKENS = 20
+
 # configs/tts_infer.yaml
 """
 custom:
@@ -102,6 +124,12 @@ class TTS_Config:
             },
     }
     configs:dict = None
+    # 为 False 时不写配置文件, 多个实例共用同一配置文件时(如 api_v2 --devices)只由其中一个写入
+    persist:bool = True
+    # 运行时指定的设备只对本实例生效, 写配置文件时保留此设备
+    persisted_device:str = None
+    # 不同实例(各自的推理线程)可能同时写同一配置文件
+    _save_lock = threading.Lock()
     v1_languages:list = ["auto", "en", "zh", "ja",  "all_zh", "all_ja"]
     v2_languages:list = ["auto", "auto_yue", "en", "zh", "ja", "yue", "ko", "all_zh", "all_ja", "all_yue", "all_ko"]
     languages:list = v2_languages
@@ -151,6 +179,31 @@ class TTS_Config:
         self.vits_weights_path = self.configs.get("vits_weights_path", None)
         self.bert_base_path = self.configs.get("bert_base_path", None)
         self.cnhuhbert_base_path = self.configs.get("cnhuhbert_base_path", None)
+        self.frontend_workers = int(self.configs.get("frontend_workers", 1))
+        self.frontend_prefetch = int(self.configs.get("frontend_prefetch", 2))
+        # BERT/CNHuBERT的驻留策略: keep | lazy | offload | free, 见 model_residency.py
+        self.bert_residency = self.configs.get("bert_residency", "keep")
+        self.bert_idle_timeout = float(self.configs.get("bert_idle_timeout", 300))
+        self.cnhuhbert_residency = self.configs.get("cnhuhbert_residency", "keep")
+        self.cnhuhbert_idle_timeout = float(self.configs.get("cnhuhbert_idle_timeout", 300))
+        # 按内容哈希缓存的已解码/重采样参考音频条数
+        self.ref_audio_cache_size = int(self.configs.get("ref_audio_cache_size", 16))
+        # 按参考音频内容缓存的音色向量(ge)条数
+        self.speaker_embedding_cache_size = int(self.configs.get("speaker_embedding_cache_size", 16))
+        # 多条参考(参考音频+参考文本)的特征缓存, 见 prompt_cache.PromptCache
+        self.prompt_cache_size = int(self.configs.get("prompt_cache_size", 32))
+        self.prompt_cache_device_mb = float(self.configs.get("prompt_cache_device_mb", 256))
+        self.prompt_cache_host_mb = float(self.configs.get("prompt_cache_host_mb", 1024))
+        # 固定 seed 时按句缓存的 T2S 输出(语义token)条数, 只改语速/辅助参考音色/输出格式时跳过 T2S
+        self.semantic_cache_size = int(self.configs.get("semantic_cache_size", 256))
+        # 启动预热, 见 TTS.warmup; warmup 为 true 时 api_v2/api_v3 创建推理线程后先预热再标记就绪
+        self.warmup = bool(self.configs.get("warmup", False))
+        self.warmup_languages = list(self.configs.get("warmup_languages", None) or [])
+        self.warmup_batch_sizes = [int(size) for size in (self.configs.get("warmup_batch_sizes", None) or [1, 4])]
+        self.warmup_max_sec = float(self.configs.get("warmup_max_sec", 10))
+        self.warmup_ref_audio_path = self.configs.get("warmup_ref_audio_path", "") or ""
+        self.warmup_prompt_text = self.configs.get("warmup_prompt_text", "") or ""
+        self.warmup_prompt_lang = self.configs.get("warmup_prompt_lang", "") or ""
         self.languages = self.v2_languages if self.version=="v2" else self.v1_languages
 
         
@@ -193,14 +246,19 @@ class TTS_Config:
         return configs
 
     def save_configs(self, configs_path:str=None)->None:
+        if not self.persist:
+            return
         configs=deepcopy(self.default_configs)
         if self.configs is not None:
-            configs["custom"] = self.update_configs()
+            configs["custom"] = dict(self.update_configs())
+            if self.persisted_device is not None:
+                configs["custom"]["device"] = self.persisted_device
             
         if configs_path is None:
             configs_path = self.configs_path
-        with open(configs_path, 'w') as f:
-            yaml.dump(configs, f)
+        with self._save_lock:
+            with open(configs_path, 'w') as f:
+                yaml.dump(configs, f)
 
     def update_configs(self):
         self.config = {
@@ -211,6 +269,25 @@ class TTS_Config:
             "vits_weights_path"  : self.vits_weights_path,
             "bert_base_path"     : self.bert_base_path,
             "cnhuhbert_base_path": self.cnhuhbert_base_path,
+            "frontend_workers"   : self.frontend_workers,
+            "frontend_prefetch"  : self.frontend_prefetch,
+            "bert_residency"     : self.bert_residency,
+            "bert_idle_timeout"  : self.bert_idle_timeout,
+            "cnhuhbert_residency": self.cnhuhbert_residency,
+            "cnhuhbert_idle_timeout": self.cnhuhbert_idle_timeout,
+            "ref_audio_cache_size": self.ref_audio_cache_size,
+            "speaker_embedding_cache_size": self.speaker_embedding_cache_size,
+            "prompt_cache_size"  : self.prompt_cache_size,
+            "prompt_cache_device_mb": self.prompt_cache_device_mb,
+            "prompt_cache_host_mb": self.prompt_cache_host_mb,
+            "semantic_cache_size": self.semantic_cache_size,
+            "warmup"             : self.warmup,
+            "warmup_languages"   : self.warmup_languages,
+            "warmup_batch_sizes" : self.warmup_batch_sizes,
+            "warmup_max_sec"     : self.warmup_max_sec,
+            "warmup_ref_audio_path": self.warmup_ref_audio_path,
+            "warmup_prompt_text" : self.warmup_prompt_text,
+            "warmup_prompt_lang" : self.warmup_prompt_lang,
         }
         return self.config
 
@@ -246,21 +323,25 @@ class TTS:
         self.t2s_model:Text2SemanticLightningModule = None
         self.vits_model:SynthesizerTrn = None
         self.bert_tokenizer:AutoTokenizer = None
-        self.bert_model:AutoModelForMaskedLM = None
-        self.cnhuhbert_model:CNHubert = None
+        self.bert_resident:ResidentModel = None
+        self.cnhuhbert_resident:ResidentModel = None
+        self.residency = ResidencyManager()
         
         self._init_models()
         
         self.text_preprocessor:TextPreprocessor = \
-                            TextPreprocessor(self.bert_model, 
+                            TextPreprocessor(self.bert_resident, 
                                             self.bert_tokenizer, 
                                             self.configs.device)
         
         
+        # 最近一次使用的参考, run() 未指定 ref_audio_path 时沿用其参考音频
         self.prompt_cache:dict = {
+            "key"            : None,
             "ref_audio_path" : None,
             "prompt_semantic": None,
             "refer_spec"     : [],
+            "refer_hashes"   : [],
             "prompt_text"    : None,
             "prompt_lang"    : None,
             "phones"         : None,
@@ -268,8 +349,29 @@ class TTS:
             "norm_text"      : None,
             "aux_ref_audio_paths": [],
         }
+        # (参考音频哈希, 辅助参考音频哈希, 参考文本, 参考语言, 模型版本, vits权重哈希) -> 参考条目
+        self.prompt_cache_lru = PromptCache(self.configs.prompt_cache_size,
+                                            self.configs.prompt_cache_device_mb,
+                                            self.configs.prompt_cache_host_mb)
         
         
+        self.tokens_per_phone:dict = deepcopy(TOKENS_PER_PHONE)
+        # (sha1, sampling_rate) -> {"wav16k", "audio"}, 见 _load_ref_audio
+        self.ref_audio_cache:OrderedDict = OrderedDict()
+        # path -> (mtime, size, sha1), 见 _file_hash
+        self._file_hashes:dict = {}
+        # (参考音频哈希, vits权重哈希, 精度, 设备) -> ge, 见 _get_speaker_embedding
+        self.speaker_embedding_cache:OrderedDict = OrderedDict()
+        # (句子phones, 参考, 采样参数, seed, 模型) -> 语义token, 见 _semantic_cache_keys
+        self.semantic_cache:OrderedDict = OrderedDict()
+        self.semantic_cache_hits:int = 0
+        self.semantic_cache_misses:int = 0
+        self._resamplers:dict = {}
+        # 最近一次 warmup() 的报告, 预热进行中时逐阶段更新
+        self.warmup_report:dict = None
+        # warmup() 进行中, 其 run() 不计入请求级指标
+        self.warming_up:bool = False
+
         self.stop_flag:bool = False
         self.precision:torch.dtype = torch.float16 if self.configs.is_half else torch.float32
 
@@ -282,24 +384,72 @@ class TTS:
         
         
         
+    @property
+    def bert_model(self)->AutoModelForMaskedLM:
+        # 当前已加载的BERT模型, 按驻留策略可能为None(未加载)或在CPU上(已卸载)
+        return self.bert_resident.model if self.bert_resident is not None else None
+
+    @property
+    def cnhuhbert_model(self)->CNHubert:
+        return self.cnhuhbert_resident.model if self.cnhuhbert_resident is not None else None
+
+    # BERT/CNHuBERT 在进程内按 (路径, 设备, 精度) 共享, 多个 TTS 实例(多个音色)只各自持有 GPT/SoVITS 权重
     def init_cnhuhbert_weights(self, base_path: str):
-        print(f"Loading CNHuBERT weights from {base_path}")
-        self.cnhuhbert_model = CNHubert(base_path)
-        self.cnhuhbert_model=self.cnhuhbert_model.eval()
-        self.cnhuhbert_model = self.cnhuhbert_model.to(self.configs.device)
-        if self.configs.is_half and str(self.configs.device)!="cpu":
-            self.cnhuhbert_model = self.cnhuhbert_model.half()
-        
-        
+        print(f"CNHuBERT weights: {base_path}, residency: {self.configs.cnhuhbert_residency}")
+        if self.cnhuhbert_resident is not None:
+            SHARED_MODELS.release(self.cnhuhbert_resident)
+        self.cnhuhbert_resident = self.residency.register(SHARED_MODELS.acquire(
+            "cnhubert",
+            base_path,
+            lambda: CNHubert(base_path),
+            self.configs.device,
+            self.configs.is_half,
+            self.configs.cnhuhbert_residency,
+            self.configs.cnhuhbert_idle_timeout,
+        ))
         
     def init_bert_weights(self, base_path: str):
-        print(f"Loading BERT weights from {base_path}")
-        self.bert_tokenizer = AutoTokenizer.from_pretrained(base_path)
-        self.bert_model = AutoModelForMaskedLM.from_pretrained(base_path)
-        self.bert_model=self.bert_model.eval()
-        self.bert_model = self.bert_model.to(self.configs.device)
-        if self.configs.is_half and str(self.configs.device)!="cpu":
-            self.bert_model = self.bert_model.half()
+        print(f"BERT weights: {base_path}, residency: {self.configs.bert_residency}")
+        self.bert_tokenizer = SHARED_MODELS.tokenizer(base_path, lambda: AutoTokenizer.from_pretrained(base_path))
+        if self.bert_resident is not None:
+            SHARED_MODELS.release(self.bert_resident)
+        self.bert_resident = self.residency.register(SHARED_MODELS.acquire(
+            "bert",
+            base_path,
+            lambda: AutoModelForMaskedLM.from_pretrained(base_path),
+            self.configs.device,
+            self.configs.is_half,
+            self.configs.bert_residency,
+            self.configs.bert_idle_timeout,
+        ))
+        if getattr(self, "text_preprocessor", None) is not None:
+            self.text_preprocessor.bert_model = self.bert_resident
+            self.text_preprocessor.tokenizer = self.bert_tokenizer
+
+    def _move_shared_models(self, device: torch.device = None, is_half: bool = None):
+        # 共享模型不能原地移动(其它实例仍在使用), 换成目标设备/精度上的那一份
+        if self.bert_resident is not None:
+            self.bert_resident = self.residency.register(SHARED_MODELS.move(self.bert_resident, device, is_half))
+            if getattr(self, "text_preprocessor", None) is not None:
+                self.text_preprocessor.bert_model = self.bert_resident
+        if self.cnhuhbert_resident is not None:
+            self.cnhuhbert_resident = self.residency.register(SHARED_MODELS.move(self.cnhuhbert_resident, device, is_half))
+
+    def release_shared_models(self):
+        '''
+        Drop this instance's references to the shared auxiliary models, a model is released when no instance holds it.
+        '''
+        for resident in (self.bert_resident, self.cnhuhbert_resident):
+            if resident is not None:
+                SHARED_MODELS.release(resident)
+        self.bert_resident = None
+        self.cnhuhbert_resident = None
+
+    def get_residency_report(self)->List[dict]:
+        '''
+        Residency state of the auxiliary models (BERT, CNHuBERT), see model_residency.ResidentModel.report.
+        '''
+        return self.residency.report()
         
     def init_vits_weights(self, weights_path: str):
         print(f"Loading VITS weights from {weights_path}")
@@ -375,19 +525,12 @@ class TTS:
                 self.t2s_model =self.t2s_model.half()
             if self.vits_model is not None:
                 self.vits_model = self.vits_model.half()
-            if self.bert_model is not None:
-                self.bert_model =self.bert_model.half()
-            if self.cnhuhbert_model is not None:
-                self.cnhuhbert_model = self.cnhuhbert_model.half()
         else:
             if self.t2s_model is not None:
                 self.t2s_model = self.t2s_model.float()
             if self.vits_model is not None:
                 self.vits_model = self.vits_model.float()
-            if self.bert_model is not None:
-                self.bert_model = self.bert_model.float()
-            if self.cnhuhbert_model is not None:
-                self.cnhuhbert_model = self.cnhuhbert_model.float()
+        self._move_shared_models(is_half=enable)
                 
     def set_device(self, device: torch.device, save: bool = True):
         '''
@@ -402,10 +545,8 @@ class TTS:
             self.t2s_model = self.t2s_model.to(device)
         if self.vits_model is not None:
             self.vits_model = self.vits_model.to(device)
-        if self.bert_model is not None:
-            self.bert_model = self.bert_model.to(device)
-        if self.cnhuhbert_model is not None:
-            self.cnhuhbert_model = self.cnhuhbert_model.to(device)
+        self._move_shared_models(device=device)
+        self.text_preprocessor.device = device
         
     def set_ref_audio(self, ref_audio_path:str):
         '''
@@ -414,23 +555,241 @@ class TTS:
             Args:
                 ref_audio_path: str, the path of the reference audio.
         '''
-        self._set_prompt_semantic(ref_audio_path)
-        self._set_ref_spec(ref_audio_path)
-        self._set_ref_audio_path(ref_audio_path)
-        
-    def _set_ref_audio_path(self, ref_audio_path):
-        self.prompt_cache["ref_audio_path"] = ref_audio_path 
+        self.prompt_cache = self.get_prompt_entry(ref_audio_path)
+
+    @profiled("TTS.get_prompt_entry")
+    def get_prompt_entry(self, ref_audio_path:str=None, aux_ref_audio_paths:list=None,
+                         prompt_text:str=None, prompt_lang:str=None)->dict:
+        '''
+        Get the prompt entry (reference audio features and prompt text features) from the prompt cache,
+        computing only the missing parts: the reference part and the prompt text part of a new entry
+        are reused from other cached entries when possible.
+        Args:
+            ref_audio_path: str, the path of the reference audio, None to use the reference of the last request.
+            aux_ref_audio_paths: list, auxiliary reference audio paths, missing files are skipped.
+            prompt_text: str, the normalized prompt text, None for no prompt text.
+            prompt_lang: str, the language of the prompt text.
+        Returns:
+            dict: same fields as self.prompt_cache.
+        '''
+        t_start = time.perf_counter()
+        if ref_audio_path in [None, ""]:
+            ref_audio_path = self.prompt_cache["ref_audio_path"]
+            ref_hash = self.prompt_cache["refer_hashes"][0]
+        else:
+            ref_hash = self._file_hash(ref_audio_path)
+        aux_paths = []
+        for path in (aux_ref_audio_paths or []):
+            if path in [None, ""]:
+                continue
+            if not os.path.exists(path):
+                print(i18n("音频文件不存在，跳过：{}").format(path))
+                continue
+            aux_paths.append(path)
+        aux_hashes = tuple(self._file_hash(path) for path in aux_paths)
+
+        device = self.configs.device
+        key = self._prompt_key(ref_hash, aux_hashes, prompt_text, prompt_lang)
+        prompt_lang = key[3]
+        entry = self.prompt_cache_lru.get(key, device)
+        if entry is not None:
+            metrics.observe_stage("reference", time.perf_counter() - t_start)
+            return entry
 
-    def _set_ref_spec(self, ref_audio_path):
-        spec = self._get_ref_spec(ref_audio_path)
-        if self.prompt_cache["refer_spec"] in [[],None]:
-            self.prompt_cache["refer_spec"]=[spec]
+        entry = {"key": key, "ref_audio_path": ref_audio_path, "aux_ref_audio_paths": aux_paths}
+        # 参考音频部分: 同一参考音频(且同一vits权重)的条目可直接复用
+        same_ref = self.prompt_cache_lru.find(lambda k: k[0] == ref_hash and k[4:] == key[4:], device)
+        if same_ref is None and self.prompt_cache["key"] is not None and \
+            self.prompt_cache["key"][0] == ref_hash and self.prompt_cache["key"][4:] == key[4:]:
+            same_ref = self.prompt_cache
+        if same_ref is not None:
+            entry["prompt_semantic"] = same_ref["prompt_semantic"]
+            primary_spec = same_ref["refer_spec"][0]
+            if same_ref["key"][1] == aux_hashes:
+                entry["refer_spec"] = same_ref["refer_spec"]
         else:
-            self.prompt_cache["refer_spec"][0] = spec
+            entry["prompt_semantic"] = self._get_prompt_semantic(ref_audio_path)
+            primary_spec, _ = self._get_ref_spec(ref_audio_path)
+        if "refer_spec" not in entry:
+            entry["refer_spec"] = [primary_spec] + [self._get_ref_spec(path)[0] for path in aux_paths]
+        entry["refer_hashes"] = [ref_hash] + list(aux_hashes)
+
+        # 参考文本部分: 同一参考文本、语言与模型版本的条目可直接复用
+        entry.update({"prompt_text": prompt_text, "prompt_lang": prompt_lang,
+                      "phones": None, "bert_features": None, "norm_text": None})
+        if prompt_text is not None:
+            same_text = self.prompt_cache_lru.find(lambda k: k[2:5] == key[2:5], device)
+            if same_text is not None:
+                entry["phones"] = same_text["phones"]
+                entry["bert_features"] = same_text["bert_features"]
+                entry["norm_text"] = same_text["norm_text"]
+            else:
+                phones, bert_features, norm_text = \
+                    self.text_preprocessor.segment_and_extract_feature_for_text(
+                                                                        prompt_text, 
+                                                                        prompt_lang,
+                                                                        self.configs.version)
+                entry["phones"] = phones
+                entry["bert_features"] = bert_features
+                entry["norm_text"] = norm_text
+
+        entry = self.prompt_cache_lru.put(key, entry, device)
+        metrics.observe_stage("reference", time.perf_counter() - t_start)
+        return entry
+
+    def _prompt_key(self, ref_hash:str, aux_hashes:tuple, prompt_text:str, prompt_lang:str)->tuple:
+        if prompt_text is None:
+            prompt_lang = None
+        # 按 SoVITS 权重的内容哈希区分, 同一路径被覆盖后重新加载时不会取到旧权重的 prompt_semantic/refer_spec
+        return (ref_hash, tuple(aux_hashes), prompt_text, prompt_lang, self.configs.version,
+                self._file_hash(self.configs.vits_weights_path))
+
+    def has_prompt_entry(self, ref_audio_path:str, prompt_text:str=None, prompt_lang:str=None)->bool:
+        '''
+        Whether the prompt entry of (ref_audio_path, prompt_text, prompt_lang) is in the prompt cache.
+        '''
+        return self._prompt_key(self._file_hash(ref_audio_path), (), prompt_text, prompt_lang) in self.prompt_cache_lru
+
+    def get_prompt_cache_report(self)->dict:
+        '''
+        Size, memory usage and hit rate of the prompt cache, see prompt_cache.PromptCache.report.
+        '''
+        return self.prompt_cache_lru.report()
+
+    def normalize_prompt_text(self, prompt_text:str, prompt_lang:str)->str:
+        prompt_text = prompt_text.strip("\n")
+        if (prompt_text[-1] not in splits): prompt_text += "。" if prompt_lang != "en" else "."
+        return prompt_text
+
+    def get_prompt_artifact_version(self)->str:
+        '''
+        Fingerprint of the models the prompt entries depend on: the content of the sovits weights
+        (prompt_semantic, speaker embedding), the model version (phones) and the BERT model (bert_features).
+        Prompt artifacts saved under another fingerprint are stale.
+        '''
+        parts = [self._file_hash(self.configs.vits_weights_path), self.configs.version,
+                 os.path.normpath(self.configs.bert_base_path), str(self.configs.sampling_rate)]
+        return hashlib.sha1("|".join(parts).encode("utf-8")).hexdigest()[:16]
+
+    def save_prompt_artifact(self, entry:dict, path:str)->None:
+        '''
+        Persist a prompt entry (from get_prompt_entry) together with its speaker embedding,
+        so that it can be loaded by load_prompt_artifact without running HuBERT, BERT or the style encoder.
+        '''
+        ge = self._get_speaker_embedding(
+            [item.to(dtype=self.precision, device=self.configs.device) for item in entry["refer_spec"]],
+            entry["refer_hashes"])
+        artifact = {
+            "version"        : self.get_prompt_artifact_version(),
+            "key"            : entry["key"][:4],
+            "prompt_semantic": entry["prompt_semantic"].cpu(),
+            "refer_spec"     : [item.float().cpu() for item in entry["refer_spec"]],
+            "refer_hashes"   : list(entry["refer_hashes"]),
+            "prompt_text"    : entry["prompt_text"],
+            "prompt_lang"    : entry["prompt_lang"],
+            "phones"         : entry["phones"],
+            "bert_features"  : entry["bert_features"].float().cpu() if entry["bert_features"] is not None else None,
+            "norm_text"      : entry["norm_text"],
+            "ge"             : ge.float().cpu(),
+        }
+        tmp_path = path + ".tmp"
+        torch.save(artifact, tmp_path)
+        os.replace(tmp_path, path)
+
+    def load_prompt_artifact(self, path:str, ref_audio_path:str, prompt_text:str=None, prompt_lang:str=None)->dict:
+        '''
+        Load a prompt artifact saved by save_prompt_artifact into the prompt cache.
+        Returns:
+            dict: the prompt entry, or None if the artifact does not exist or is stale
+                  (other model weights, or the reference audio or prompt text has changed).
+        '''
+        if not os.path.exists(path):
+            return None
+        artifact = torch.load(path, map_location="cpu")
+        key = self._prompt_key(self._file_hash(ref_audio_path), (), prompt_text, prompt_lang)
+        if artifact.get("version") != self.get_prompt_artifact_version() or tuple(artifact["key"]) != key[:4]:
+            return None
+
+        device = self.configs.device
+        spec_dtype = torch.float16 if self.configs.is_half else torch.float32
+        entry = {
+            "key"            : key,
+            "ref_audio_path" : ref_audio_path,
+            "aux_ref_audio_paths": [],
+            "prompt_semantic": artifact["prompt_semantic"].to(device),
+            "refer_spec"     : [item.to(dtype=spec_dtype, device=device) for item in artifact["refer_spec"]],
+            "refer_hashes"   : artifact["refer_hashes"],
+            "prompt_text"    : artifact["prompt_text"],
+            "prompt_lang"    : artifact["prompt_lang"],
+            "phones"         : artifact["phones"],
+            "bert_features"  : artifact["bert_features"].to(device) if artifact["bert_features"] is not None else None,
+            "norm_text"      : artifact["norm_text"],
+        }
+        ge_key = (tuple(entry["refer_hashes"]), self._file_hash(self.configs.vits_weights_path),
+                  str(self.precision), str(device))
+        self.speaker_embedding_cache[ge_key] = artifact["ge"].to(dtype=self.precision, device=device)
+        while len(self.speaker_embedding_cache) > max(0, self.configs.speaker_embedding_cache_size):
+            self.speaker_embedding_cache.popitem(last=False)
+        return self.prompt_cache_lru.put(key, entry, device)
+
+    def _file_hash(self, path:str)->str:
+        # 文件未修改时不重复读取计算哈希
+        stat = os.stat(path)
+        cached = self._file_hashes.get(path)
+        if cached is not None and cached[:2] == (stat.st_mtime_ns, stat.st_size):
+            return cached[2]
+        sha1 = hashlib.sha1()
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                sha1.update(chunk)
+        self._file_hashes[path] = (stat.st_mtime_ns, stat.st_size, sha1.hexdigest())
+        return sha1.hexdigest()
+
+    def _resample(self, audio:torch.Tensor, orig_sr:int, target_sr:int)->torch.Tensor:
+        if orig_sr == target_sr:
+            return audio
+        key = (orig_sr, target_sr, str(audio.device))
+        if key not in self._resamplers:
+            self._resamplers[key] = torchaudio.transforms.Resample(orig_sr, target_sr).to(audio.device)
+        return self._resamplers[key](audio)
+
+    def _load_ref_audio(self, ref_audio_path:str)->dict:
+        '''
+        Decode the reference audio once and resample it on the inference device
+        to 16k (CNHuBERT) and to the model sampling rate (reference spectrogram).
+        Results are cached by the sha1 of the file content.
+
+        Returns:
+            dict: {"wav16k": torch.FloatTensor, "audio": torch.FloatTensor, "hash": str}, tensors on cpu.
+        '''
+        sampling_rate = int(self.configs.sampling_rate)
+        key = (self._file_hash(ref_audio_path), sampling_rate)
+        if key in self.ref_audio_cache:
+            self.ref_audio_cache.move_to_end(key)
+            return self.ref_audio_cache[key]
+
+        with open(ref_audio_path, "rb") as f:
+            data = f.read()
+        try:
+            audio, sr = librosa.load(io.BytesIO(data), sr=None, mono=True)
+        except Exception:
+            # soundfile 不支持的格式(如部分mp3/m4a)交给 audioread
+            audio, sr = librosa.load(ref_audio_path, sr=None, mono=True)
+        audio = torch.from_numpy(audio).float().to(self.configs.device)
+        ref_audio = {
+            "wav16k": self._resample(audio, sr, 16000).cpu(),
+            "audio": self._resample(audio, sr, sampling_rate).cpu(),
+            "hash": key[0],
+        }
+
+        self.ref_audio_cache[key] = ref_audio
+        while len(self.ref_audio_cache) > max(0, self.configs.ref_audio_cache_size):
+            self.ref_audio_cache.popitem(last=False)
+        return ref_audio
 
     def _get_ref_spec(self, ref_audio_path):
-        audio = load_audio(ref_audio_path, int(self.configs.sampling_rate))
-        audio = torch.FloatTensor(audio)
+        ref_audio = self._load_ref_audio(ref_audio_path)
+        audio = ref_audio["audio"].clone()
         maxx=audio.abs().max()
         if(maxx>1):audio/=min(2,maxx)
         audio_norm = audio
@@ -446,18 +805,42 @@ class TTS:
         spec = spec.to(self.configs.device)
         if self.configs.is_half:
             spec = spec.half()
-        return spec
+        return spec, ref_audio["hash"]
+
+    def _get_speaker_embedding(self, refer_audio_spec:list, refer_hashes:list)->torch.Tensor:
+        '''
+        The speaker embedding (ge) of the current reference audios.
+        All reference spectrograms go through the style encoder in one padded batch,
+        and the result is cached by the content hashes of the reference audios and of the SoVITS weights,
+        so it is computed once per set of references instead of once per vits decode.
+
+        Args:
+            refer_audio_spec: list of torch.Tensor, the spectrograms in prompt_cache["refer_spec"].
+            refer_hashes: list of str, the content hashes of the reference audios in prompt_cache["refer_hashes"].
+        Returns:
+            torch.Tensor: [1, gin_channels, 1]
+        '''
+        key = (tuple(refer_hashes), self._file_hash(self.configs.vits_weights_path),
+               str(self.precision), str(self.configs.device))
+        if key in self.speaker_embedding_cache:
+            self.speaker_embedding_cache.move_to_end(key)
+            return self.speaker_embedding_cache[key]
+
+        ge = self.vits_model.extract_ge(refer_audio_spec)
+        self.speaker_embedding_cache[key] = ge
+        while len(self.speaker_embedding_cache) > max(0, self.configs.speaker_embedding_cache_size):
+            self.speaker_embedding_cache.popitem(last=False)
+        return ge
 
-    def _set_prompt_semantic(self, ref_wav_path:str):
+    def _get_prompt_semantic(self, ref_wav_path:str)->torch.Tensor:
         zero_wav = np.zeros(
             int(self.configs.sampling_rate * 0.3),
             dtype=np.float16 if self.configs.is_half else np.float32,
         )
         with torch.no_grad():
-            wav16k, sr = librosa.load(ref_wav_path, sr=16000)
+            wav16k = self._load_ref_audio(ref_wav_path)["wav16k"]
             if (wav16k.shape[0] > 160000 or wav16k.shape[0] < 48000):
                 raise OSError(i18n("参考音频在3~10秒范围外，请更换！"))
-            wav16k = torch.from_numpy(wav16k)
             zero_wav_torch = torch.from_numpy(zero_wav)
             wav16k = wav16k.to(self.configs.device)
             zero_wav_torch = zero_wav_torch.to(self.configs.device)
@@ -466,15 +849,16 @@ class TTS:
                 zero_wav_torch = zero_wav_torch.half()
 
             wav16k = torch.cat([wav16k, zero_wav_torch])
-            hubert_feature = self.cnhuhbert_model.model(wav16k.unsqueeze(0))[
-                "last_hidden_state"
-            ].transpose(
-                1, 2
-            )  # .float()
+            with self.cnhuhbert_resident.use() as cnhuhbert_model:
+                hubert_feature = cnhuhbert_model.model(wav16k.unsqueeze(0))[
+                    "last_hidden_state"
+                ].transpose(
+                    1, 2
+                )  # .float()
             codes = self.vits_model.extract_latent(hubert_feature)
     
             prompt_semantic = codes[0, 0].to(self.configs.device)
-            self.prompt_cache["prompt_semantic"] = prompt_semantic
+            return prompt_semantic
     
     def batch_sequences(self, sequences: List[torch.Tensor], axis: int = 0, pad_value: int = 0, max_length:int=None):
         seq = sequences[0]
@@ -497,6 +881,7 @@ class TTS:
         batch = torch.stack(padded_sequences)
         return batch
     
+    @profiled("TTS.to_batch")
     def to_batch(self, data:list, 
                  prompt_data:dict=None, 
                  batch_size:int=5, 
@@ -506,41 +891,20 @@ class TTS:
                  precision:torch.dtype=torch.float32,
                  ):
         _data:list = []
-        index_and_len_list = []
-        for idx, item in enumerate(data):
-            norm_text_len = len(item["norm_text"])
-            index_and_len_list.append([idx, norm_text_len])
+        predicted_tokens = [self.estimate_decode_tokens(item) for item in data]
 
         batch_index_list = []
         if split_bucket:
-            index_and_len_list.sort(key=lambda x: x[1])
-            index_and_len_list = np.array(index_and_len_list, dtype=np.int64)            
-            
-            batch_index_list_len = 0
-            pos = 0
-            while pos <index_and_len_list.shape[0]:
-                # batch_index_list.append(index_and_len_list[pos:min(pos+batch_size,len(index_and_len_list))])
-                pos_end = min(pos+batch_size,index_and_len_list.shape[0])
-                while pos < pos_end:
-                    batch=index_and_len_list[pos:pos_end, 1].astype(np.float32)
-                    score=batch[(pos_end-pos)//2]/(batch.mean()+1e-8)
-                    if (score>=threshold) or (pos_end-pos==1):
-                        batch_index=index_and_len_list[pos:pos_end, 0].tolist()
-                        batch_index_list_len += len(batch_index)
-                        batch_index_list.append(batch_index)
-                        pos = pos_end
-                        break
-                    pos_end=pos_end-1
-            
-            assert batch_index_list_len == len(data)
-            
+            batch_index_list = self.plan_batches(predicted_tokens, batch_size, threshold)
+            assert sum(len(index_list) for index_list in batch_index_list) == len(data)
         else:
             for i in range(len(data)):
                 if i%batch_size == 0:
                     batch_index_list.append([])
                 batch_index_list[-1].append(i)
 
-                
+        self.report_batches(batch_index_list, predicted_tokens, "predicted")
+
         for batch_idx, index_list in enumerate(batch_index_list):
             item_list = [data[idx] for idx in index_list]
             phones_list = []
@@ -550,11 +914,12 @@ class TTS:
             all_phones_len_list = []
             all_bert_features_list = []
             norm_text_batch = []
+            lang_batch = []
             all_bert_max_len = 0
             all_phones_max_len = 0
             for item in item_list:
                 if prompt_data is not None:
-                    all_bert_features = torch.cat([prompt_data["bert_features"], item["bert_features"]], 1)\
+                    all_bert_features = torch.cat([prompt_data["bert_features"].to(item["bert_features"].device), item["bert_features"]], 1)\
                                                 .to(dtype=precision, device=device)
                     all_phones = torch.LongTensor(prompt_data["phones"]+item["phones"]).to(device)
                     phones = torch.LongTensor(item["phones"]).to(device)
@@ -575,6 +940,7 @@ class TTS:
                 all_phones_len_list.append(all_phones.shape[-1])
                 all_bert_features_list.append(all_bert_features)
                 norm_text_batch.append(item["norm_text"])
+                lang_batch.append(item.get("lang"))
                 
             phones_batch = phones_list
             all_phones_batch = all_phones_list
@@ -606,12 +972,106 @@ class TTS:
                 "all_phones_len": torch.LongTensor(all_phones_len_list).to(device),
                 "all_bert_features": all_bert_features_batch,
                 "norm_text": norm_text_batch,
+                "lang": lang_batch,
                 "max_len": max_len,
             }
             _data.append(batch)
         
         return _data, batch_index_list
-    
+
+    def estimate_decode_tokens(self, item:dict)->float:
+        '''
+        Estimate the number of semantic tokens the T2S model will decode for a text item.
+
+        Args:
+            item (dict): a text item with "phones" and optionally "lang".
+        Returns:
+            float: phoneme count times the tokens-per-phone ratio of the item's language.
+        '''
+        lang = (item.get("lang") or "").replace("all_", "")
+        return len(item["phones"]) * self.tokens_per_phone.get(lang, DEFAULT_TOKENS_PER_PHONE)
+
+    def update_tokens_per_phone(self, langs:list, phones_len:list, decoded_len:list, max_tokens:int=None):
+        '''
+        Update the tokens-per-phone ratios with the decode lengths observed for a batch.
+        Rows stopped by early_stop_num are skipped, their length is not a natural EOS.
+        '''
+        for lang, n_phones, n_tokens in zip(langs, phones_len, decoded_len):
+            lang = (lang or "").replace("all_", "")
+            n_phones, n_tokens = int(n_phones), int(n_tokens)
+            if lang not in self.tokens_per_phone or n_phones <= 0 or n_tokens <= 0:
+                continue
+            if max_tokens is not None and n_tokens >= max_tokens:
+                continue
+            self.tokens_per_phone[lang] = TOKENS_PER_PHONE_MOMENTUM*self.tokens_per_phone[lang] + \
+                                            (1-TOKENS_PER_PHONE_MOMENTUM)*n_tokens/n_phones
+
+    @staticmethod
+    def plan_batches(predicted_tokens:list, batch_size:int, min_efficiency:float=0.75)->List[list]:
+        '''
+        Group items into batches by predicted decode length.
+
+        Items are sorted by predicted token count and split into contiguous groups with dynamic programming,
+        minimizing the total cost of the cost model (BATCH_ROW_COST, BATCH_OVERHEAD_TOKENS).
+        A group of more than one item must keep its padding efficiency (sum of tokens / (rows * max tokens))
+        at or above min_efficiency, so that the rows of a batch reach EOS at roughly the same step.
+
+        Args:
+            predicted_tokens (list): predicted decode length of each item.
+            batch_size (int): max number of items in a batch.
+            min_efficiency (float): min padding efficiency of a batch.
+        Returns:
+            List[list]: item indices of each batch.
+        '''
+        n = len(predicted_tokens)
+        batch_size = max(1, int(batch_size))
+        order = sorted(range(n), key=lambda i: predicted_tokens[i])
+        tokens = [max(float(predicted_tokens[i]), 1.0) for i in order]
+        prefix = [0.0]
+        for t in tokens:
+            prefix.append(prefix[-1] + t)
+
+        cost = [0.0] + [float("inf")]*n
+        start_of = [0]*(n+1)
+        for end in range(1, n+1):
+            max_tokens = tokens[end-1]
+            for start in range(end-1, max(0, end-batch_size)-1, -1):
+                rows = end-start
+                # 排序后向前扩展只会加入更短的句子, 效率单调下降
+                if rows > 1 and (prefix[end]-prefix[start])/(rows*max_tokens) < min_efficiency:
+                    break
+                c = cost[start] + max_tokens*(1+BATCH_ROW_COST*rows) + BATCH_OVERHEAD_TOKENS
+                if c < cost[end]:
+                    cost[end] = c
+                    start_of[end] = start
+
+        batch_index_list = []
+        end = n
+        while end > 0:
+            start = start_of[end]
+            batch_index_list.append(order[start:end])
+            end = start
+        batch_index_list.reverse()
+        return batch_index_list
+
+    @staticmethod
+    def report_batches(batch_index_list:List[list], tokens:list, name:str="predicted"):
+        '''
+        Print the padded decode steps and padding efficiency of each batch.
+        '''
+        total_tokens = 0
+        total_padded = 0
+        for batch_idx, index_list in enumerate(batch_index_list):
+            batch_tokens = [tokens[i] for i in index_list]
+            padded = max(batch_tokens)*len(batch_tokens)
+            total_tokens += sum(batch_tokens)
+            total_padded += padded
+            print(f"batch {batch_idx}: {len(batch_tokens)} items, {name} tokens {sum(batch_tokens):.0f}/{padded:.0f} padded, "
+                  f"padding efficiency {sum(batch_tokens)/max(padded, 1e-8):.1%}")
+        if len(batch_index_list) > 1:
+            print(f"all batches: {name} tokens {total_tokens:.0f}/{total_padded:.0f} padded, "
+                  f"padding efficiency {total_tokens/max(total_padded, 1e-8):.1%}")
+
     def recovery_order(self, data:list, batch_index_list:list)->list:
         '''
         Recovery the order of the audio according to the batch_index_list.
@@ -655,18 +1115,38 @@ class TTS:
                     "temperature": 1,             # float. temperature for sampling
                     "text_split_method": "cut0",  # str. text split method, see text_segmentation_method.py for details.
                     "batch_size": 1,              # int. batch size for inference
-                    "batch_threshold": 0.75,      # float. threshold for batch splitting.
+                    "batch_threshold": 0.75,      # float. threshold for batch splitting, the min padding efficiency of a bucket.
                     "split_bucket: True,          # bool. whether to split the batch into multiple buckets.
                     "return_fragment": False,     # bool. step by step return the audio fragment.
                     "speed_factor":1.0,           # float. control the speed of the synthesized audio.
                     "fragment_interval":0.3,      # float. to control the interval of the audio fragment.
                     "seed": -1,                   # int. random seed for reproducibility.
                     "parallel_infer": True,       # bool. whether to use parallel inference.
-                    "repetition_penalty": 1.35    # float. repetition penalty for T2S model.
+                    "repetition_penalty": 1.35,   # float. repetition penalty for T2S model.
+                    "request_id": None,           # str.(optional) id of the request, attached to its tracing spans.
+                    "trace_context": None,        # tuple.(optional) tracing.current_context() of the caller, parent of the request's spans.
                 }
         returns:
             Tuple[int, np.ndarray]: sampling rate and audio data.
         """
+        # 整个请求一个 span, 各阶段的 span 挂在它下面
+        yield from tracing.trace_generator("tts.run", self._run(inputs),
+                                           parent=inputs.get("trace_context"), scope=self._trace_scope(inputs))
+
+    @staticmethod
+    def _trace_scope(inputs:dict)->dict:
+        # 请求级别的属性, 该请求的每个 span 都带上
+        return {
+            "request_id": inputs.get("request_id"),
+            "text_lang": inputs.get("text_lang", ""),
+            "text_chars": len(inputs.get("text", "") or ""),
+            "streaming": bool(inputs.get("return_fragment", False)),
+            "batch_size": inputs.get("batch_size", 1),
+            "seed": inputs.get("seed", -1),
+            "parallel_infer": inputs.get("parallel_infer", True),
+        }
+
+    def _run(self, inputs:dict):
         ########## variables initialization ###########
         self.stop_flag:bool = False
         text:str = inputs.get("text", "")
@@ -725,53 +1205,50 @@ class TTS:
             assert prompt_lang in self.configs.languages
 
         if ref_audio_path in [None, ""] and \
-            ((self.prompt_cache["prompt_semantic"] is None) or (self.prompt_cache["refer_spec"] in [None, []])):
+            ((self.prompt_cache["ref_audio_path"] is None) or (self.prompt_cache["refer_spec"] in [None, []])):
             raise ValueError("ref_audio_path cannot be empty, when the reference audio is not set using set_ref_audio()")
 
-        ###### setting reference audio and prompt text preprocessing ########
+        ###### text segmentation ########
+        # 前端(G2P + BERT)在后台线程中提前进行, 与参考音频处理及T2S/VITS推理重叠
         t0 = ttime()
-        if (ref_audio_path is not None) and (ref_audio_path != self.prompt_cache["ref_audio_path"]):
-            if not os.path.exists(ref_audio_path):
-                raise ValueError(f"{ref_audio_path} not exists")
-            self.set_ref_audio(ref_audio_path)
-            
-        aux_ref_audio_paths = aux_ref_audio_paths if aux_ref_audio_paths is not None else []
-        paths = set(aux_ref_audio_paths)&set(self.prompt_cache["aux_ref_audio_paths"])
-        if not (len(list(paths)) == len(aux_ref_audio_paths) == len(self.prompt_cache["aux_ref_audio_paths"])):
-            self.prompt_cache["aux_ref_audio_paths"] = aux_ref_audio_paths
-            self.prompt_cache["refer_spec"] = [self.prompt_cache["refer_spec"][0]]
-            for path in aux_ref_audio_paths:
-                if path in [None, ""]:
-                    continue
-                if not os.path.exists(path):
-                    print(i18n("音频文件不存在，跳过：{}").format(path))
-                    continue
-                self.prompt_cache["refer_spec"].append(self._get_ref_spec(path))
-                
-        if not no_prompt_text:
-            prompt_text = prompt_text.strip("\n")
-            if (prompt_text[-1] not in splits): prompt_text += "。" if prompt_lang != "en" else "."
-            print(i18n("实际输入的参考文本:"), prompt_text)
-            if self.prompt_cache["prompt_text"] != prompt_text:
-                self.prompt_cache["prompt_text"] = prompt_text
-                self.prompt_cache["prompt_lang"] = prompt_lang
-                phones, bert_features, norm_text = \
-                    self.text_preprocessor.segment_and_extract_feature_for_text(
-                                                                        prompt_text, 
-                                                                        prompt_lang,
-                                                                        self.configs.version)
-                self.prompt_cache["phones"] = phones
-                self.prompt_cache["bert_features"] = bert_features
-                self.prompt_cache["norm_text"] = norm_text
-
+        print(i18n("############ 切分文本 ############"))
+        if not return_fragment:
+            text = self.text_preprocessor.replace_consecutive_punctuation(text)
+        texts = self.text_preprocessor.pre_seg_text(text, text_lang, text_split_method, streaming=return_fragment)
+        tracing.record("tts.segment", t0, sentences=len(texts), text_split_method=text_split_method)
+        feature_pipeline = self.text_preprocessor.extract_features(
+                                texts, 
+                                text_lang, 
+                                self.configs.version,
+                                num_workers=self.configs.frontend_workers,
+                                max_pending=max(1, self.configs.frontend_prefetch)*batch_size,
+                                )
 
+        try:
+            ###### setting reference audio and prompt text preprocessing ########
+            # 每个请求从参考缓存中取各自的条目, 不修改其他请求正在使用的条目
+            if (ref_audio_path not in [None, ""]) and (not os.path.exists(ref_audio_path)):
+                raise ValueError(f"{ref_audio_path} not exists")
 
+            if not no_prompt_text:
+                prompt_text = self.normalize_prompt_text(prompt_text, prompt_lang)
+                print(i18n("实际输入的参考文本:"), prompt_text)
+            t_ref = ttime()
+            prompt_cache = self.get_prompt_entry(ref_audio_path, aux_ref_audio_paths,
+                                                 None if no_prompt_text else prompt_text, prompt_lang)
+            tracing.record("tts.reference", t_ref, aux_refs=len(prompt_cache["refer_hashes"]) - 1)
+            self.prompt_cache = prompt_cache
+        except BaseException:
+            feature_pipeline.close()
+            raise
 
         ###### text preprocessing ########
         t1 = ttime()
         data:list = None
         if not return_fragment:
-            data = self.text_preprocessor.preprocess(text, text_lang, text_split_method, self.configs.version)
+            print(i18n("############ 提取文本Bert特征 ############"))
+            data = [res for res in tqdm(feature_pipeline, total=len(texts)) if res is not None]
+            tracing.record("tts.frontend", t1, sentences=len(data))
             if len(data) == 0:
                 yield self.configs.sampling_rate, np.zeros(int(self.configs.sampling_rate),
                                                             dtype=np.int16)
@@ -779,7 +1256,7 @@ class TTS:
 
             batch_index_list:list = None
             data, batch_index_list = self.to_batch(data, 
-                                prompt_data=self.prompt_cache if not no_prompt_text else None, 
+                                prompt_data=prompt_cache if not no_prompt_text else None, 
                                 batch_size=batch_size, 
                                 threshold=batch_threshold,
                                 split_bucket=split_bucket,
@@ -787,8 +1264,6 @@ class TTS:
                                 precision=self.precision
                                 )
         else:
-            print(i18n("############ 切分文本 ############"))
-            texts = self.text_preprocessor.pre_seg_text(text, text_lang, text_split_method)
             data = []
             for i in range(len(texts)):
                 if i%batch_size == 0:
@@ -796,22 +1271,15 @@ class TTS:
                 data[-1].append(texts[i])
             
             def make_batch(batch_texts):
-                batch_data = []
                 print(i18n("############ 提取文本Bert特征 ############"))
-                for text in tqdm(batch_texts):
-                    phones, bert_features, norm_text = self.text_preprocessor.segment_and_extract_feature_for_text(text, text_lang, self.configs.version)
-                    if phones is None:
-                        continue
-                    res={
-                        "phones": phones,
-                        "bert_features": bert_features,
-                        "norm_text": norm_text,
-                    }
-                    batch_data.append(res)
+                # 流水线已在推理上一批次时提前处理了这一批次的文本
+                t_frontend = ttime()
+                batch_data = [res for res in feature_pipeline.take(len(batch_texts)) if res is not None]
+                tracing.record("tts.frontend", t_frontend, sentences=len(batch_data))
                 if len(batch_data) == 0:
                     return None
                 batch, _ = self.to_batch(batch_data, 
-                            prompt_data=self.prompt_cache if not no_prompt_text else None, 
+                            prompt_data=prompt_cache if not no_prompt_text else None, 
                             batch_size=batch_size, 
                             threshold=batch_threshold,
                             split_bucket=False,
@@ -830,6 +1298,11 @@ class TTS:
             t_34 = 0.0
             t_45 = 0.0
             audio = []
+            audio_seconds = 0.0
+            fragments = 0
+            record_metrics = not self.warming_up
+            if record_metrics:
+                metrics.REQUESTS.inc(mode="stream" if return_fragment else "full")
             for item in data:
                 t3 = ttime()
                 if return_fragment:
@@ -837,92 +1310,32 @@ class TTS:
                     if item is None:
                         continue
 
-                batch_phones:List[torch.LongTensor] = item["phones"]
-                # batch_phones:torch.LongTensor = item["phones"]
-                batch_phones_len:torch.LongTensor = item["phones_len"]
-                all_phoneme_ids:torch.LongTensor = item["all_phones"]
-                all_phoneme_lens:torch.LongTensor  = item["all_phones_len"]
-                all_bert_features:torch.LongTensor = item["all_bert_features"]
-                norm_text:str = item["norm_text"]
-                max_len = item["max_len"]
-
-                print(i18n("前端处理后的文本(每句):"), norm_text)
-                if no_prompt_text :
-                    prompt = None
-                else:
-                    prompt = self.prompt_cache["prompt_semantic"].expand(len(all_phoneme_ids), -1).to(self.configs.device)
-
-
-                pred_semantic_list, idx_list = self.t2s_model.model.infer_panel(
-                    all_phoneme_ids,
-                    all_phoneme_lens,
-                    prompt,
-                    all_bert_features,
-                    # prompt_phone_len=ph_offset,
-                    top_k=top_k,
-                    top_p=top_p,
-                    temperature=temperature,
-                    early_stop_num=self.configs.hz * self.configs.max_sec,
-                    max_len=max_len,
-                    repetition_penalty=repetition_penalty,
-                )
-                t4 = ttime()
-                t_34 += t4 - t3
-
-                refer_audio_spec:torch.Tensor = [item.to(dtype=self.precision, device=self.configs.device) for item in self.prompt_cache["refer_spec"]]
-                                                    
-
-                batch_audio_fragment = []
-            
-                # ## vits并行推理 method 1
-                # pred_semantic_list = [item[-idx:] for item, idx in zip(pred_semantic_list, idx_list)]
-                # pred_semantic_len = torch.LongTensor([item.shape[0] for item in pred_semantic_list]).to(self.configs.device)
-                # pred_semantic = self.batch_sequences(pred_semantic_list, axis=0, pad_value=0).unsqueeze(0)
-                # max_len = 0
-                # for i in range(0, len(batch_phones)):
-                #     max_len = max(max_len, batch_phones[i].shape[-1])
-                # batch_phones = self.batch_sequences(batch_phones, axis=0, pad_value=0, max_length=max_len)
-                # batch_phones = batch_phones.to(self.configs.device)
-                # batch_audio_fragment = (self.vits_model.batched_decode(
-                #         pred_semantic, pred_semantic_len, batch_phones, batch_phones_len,refer_audio_spec
-                #     ))
-
-                if speed_factor == 1.0:
-                    # ## vits并行推理 method 2
-                    pred_semantic_list = [item[-idx:] for item, idx in zip(pred_semantic_list, idx_list)]
-                    upsample_rate = math.prod(self.vits_model.upsample_rates)
-                    audio_frag_idx = [pred_semantic_list[i].shape[0]*2*upsample_rate for i in range(0, len(pred_semantic_list))]
-                    audio_frag_end_idx = [ sum(audio_frag_idx[:i+1]) for i in range(0, len(audio_frag_idx))]
-                    all_pred_semantic = torch.cat(pred_semantic_list).unsqueeze(0).unsqueeze(0).to(self.configs.device)
-                    _batch_phones = torch.cat(batch_phones).unsqueeze(0).to(self.configs.device)
-                    _batch_audio_fragment = (self.vits_model.decode(
-                            all_pred_semantic, _batch_phones, refer_audio_spec, speed=speed_factor
-                        ).detach()[0, 0, :])
-                    audio_frag_end_idx.insert(0, 0)
-                    batch_audio_fragment= [_batch_audio_fragment[audio_frag_end_idx[i-1]:audio_frag_end_idx[i]] for i in range(1, len(audio_frag_end_idx))]
-                else:
-                # ## vits串行推理
-                    for i, idx in enumerate(idx_list):
-                        phones = batch_phones[i].unsqueeze(0).to(self.configs.device)
-                        _pred_semantic = (pred_semantic_list[i][-idx:].unsqueeze(0).unsqueeze(0))   # .unsqueeze(0)#mq要多unsqueeze一次
-                        audio_fragment =(self.vits_model.decode(
-                                _pred_semantic, phones, refer_audio_spec, speed=speed_factor
-                            ).detach()[0, 0, :])
-                        batch_audio_fragment.append(
-                            audio_fragment
-                        )  ###试试重建不带上prompt部分
-
+                batch_audio_fragment, _, t_vits = self._infer_batch(item, prompt_cache, no_prompt_text,
+                                                                        top_k=top_k,
+                                                                        top_p=top_p,
+                                                                        temperature=temperature,
+                                                                        repetition_penalty=repetition_penalty,
+                                                                        speed_factor=speed_factor,
+                                                                        seed=seed)
                 t5 = ttime()
+                t4 = t5 - t_vits
+                t_34 += t4 - t3
                 t_45 += t5 - t4
                 if return_fragment:
                     print("%.3f\t%.3f\t%.3f\t%.3f" % (t1 - t0, t2 - t1, t4 - t3, t5 - t4))
-                    yield self.audio_postprocess([batch_audio_fragment], 
+                    fragment = self.audio_postprocess([batch_audio_fragment], 
                                                     self.configs.sampling_rate, 
                                                     None, 
                                                     speed_factor, 
                                                     False,
                                                     fragment_interval
                                                     )
+                    tracing.record("tts.postprocess", t5, samples=len(fragment[1]))
+                    if fragments == 0 and record_metrics:
+                        metrics.FIRST_FRAGMENT_SECONDS.observe(ttime() - t0)
+                    fragments += 1
+                    audio_seconds += len(fragment[1]) / fragment[0]
+                    yield fragment
                 else:
                     audio.append(batch_audio_fragment)
 
@@ -937,15 +1350,30 @@ class TTS:
                     yield self.configs.sampling_rate, np.zeros(int(self.configs.sampling_rate),
                                                                 dtype=np.int16)
                     return
-                yield self.audio_postprocess(audio, 
+                t_post = ttime()
+                result = self.audio_postprocess(audio, 
                                                 self.configs.sampling_rate, 
                                                 batch_index_list, 
                                                 speed_factor, 
                                                 split_bucket,
                                                 fragment_interval
                                                 )
+                tracing.record("tts.postprocess", t_post, samples=len(result[1]))
+                # 非流式请求的第一个(也是唯一一个)分段就是整段音频
+                if record_metrics:
+                    metrics.FIRST_FRAGMENT_SECONDS.observe(ttime() - t0)
+                    metrics.REAL_TIME_FACTOR.observe((ttime() - t0) / max(len(result[1]) / result[0], 1e-3))
+                tracing.set_attributes(sentences=len(texts), actual_seed=actual_seed,
+                                       audio_seconds=round(len(result[1]) / result[0], 3))
+                yield result
+            elif audio_seconds > 0:
+                if record_metrics:
+                    metrics.REAL_TIME_FACTOR.observe((ttime() - t0) / audio_seconds)
+                tracing.set_attributes(sentences=len(texts), actual_seed=actual_seed, fragments=fragments,
+                                       audio_seconds=round(audio_seconds, 3))
 
         except Exception as e:
+            feature_pipeline.close()
             traceback.print_exc()
             # 必须返回一个空音频, 否则会导致显存不释放。
             yield self.configs.sampling_rate, np.zeros(int(self.configs.sampling_rate),
@@ -959,8 +1387,403 @@ class TTS:
             self.init_vits_weights(self.configs.vits_weights_path)
             raise e
         finally:
+            feature_pipeline.close()
+            self.empty_cache()
+    
+    @staticmethod
+    def batch_key(inputs:dict)->tuple:
+        '''
+        Requests with the same batch key can be synthesized together by run_batch.
+        Returns None for requests that have to run alone (streaming, or a fixed seed).
+        '''
+        seed = inputs.get("seed", -1)
+        if inputs.get("return_fragment", False) or seed not in [-1, "", None]:
+            return None
+        return (
+            inputs.get("ref_audio_path", "") or "",
+            tuple(inputs.get("aux_ref_audio_paths", []) or []),
+            inputs.get("prompt_text", "") or "",
+            inputs.get("prompt_lang", ""),
+            inputs.get("text_lang", ""),
+            inputs.get("top_k", 5),
+            inputs.get("top_p", 1),
+            inputs.get("temperature", 1),
+            inputs.get("repetition_penalty", 1.35),
+            inputs.get("speed_factor", 1.0),
+            inputs.get("parallel_infer", True),
+            inputs.get("batch_threshold", 0.75),
+        )
+
+    def get_model_fingerprint(self)->str:
+        '''
+        Fingerprint of everything besides the request that decides the synthesized audio:
+        the content of the GPT and SoVITS weights, the frontend models, the precision and the device type.
+        '''
+        parts = [self._file_hash(self.configs.t2s_weights_path), self.get_prompt_artifact_version(),
+                 os.path.normpath(self.configs.cnhuhbert_base_path), str(self.configs.is_half),
+                 torch.device(self.configs.device).type]
+        return hashlib.sha1("|".join(parts).encode("utf-8")).hexdigest()[:16]
+
+    def response_fingerprint(self, inputs:dict)->str:
+        '''
+        Content hash of a request whose audio is reproducible (a fixed seed, not returned in fragments),
+        None for any other request. Requests with the same fingerprint synthesize the same audio
+        with the current models, see get_model_fingerprint.
+        '''
+        seed = inputs.get("seed", -1)
+        ref_audio_path = inputs.get("ref_audio_path", "")
+        if inputs.get("return_fragment", False) or seed in [-1, "", None] or ref_audio_path in [None, ""]:
+            return None
+        try:
+            ref_hashes = [self._file_hash(path) for path in [ref_audio_path] + list(inputs.get("aux_ref_audio_paths", []) or [])]
+            model = self.get_model_fingerprint()
+        except OSError:
+            # 参考音频或权重文件不存在, 交给推理报错
+            return None
+        canonical = {
+            "text": inputs.get("text", ""),
+            "text_lang": inputs.get("text_lang", "").lower(),
+            "ref_audio": ref_hashes,
+            "prompt_text": inputs.get("prompt_text", "") or "",
+            "prompt_lang": (inputs.get("prompt_lang", "") or "").lower(),
+            "top_k": int(inputs.get("top_k", 5)),
+            "top_p": float(inputs.get("top_p", 1)),
+            "temperature": float(inputs.get("temperature", 1)),
+            "text_split_method": inputs.get("text_split_method", "cut0"),
+            "batch_size": int(inputs.get("batch_size", 1)),
+            "batch_threshold": float(inputs.get("batch_threshold", 0.75)),
+            "speed_factor": float(inputs.get("speed_factor", 1.0)),
+            "split_bucket": bool(inputs.get("split_bucket", True)),
+            "fragment_interval": float(inputs.get("fragment_interval", 0.3)),
+            "seed": int(seed),
+            "parallel_infer": bool(inputs.get("parallel_infer", True)),
+            "repetition_penalty": float(inputs.get("repetition_penalty", 1.35)),
+            "model": model,
+        }
+        return hashlib.sha256(json.dumps(canonical, sort_keys=True, ensure_ascii=False).encode("utf-8")).hexdigest()
+
+    def run_batch(self, inputs_list:List[dict])->List[Tuple[int, np.ndarray]]:
+        '''
+        Non-streaming inference of several requests at once. The sentences of all requests
+        are bucketed together into shared T2S and VITS batches, and the audio of each request
+        is assembled from its own sentences.
+
+        All requests must have the same batch_key (reference, prompt text, text language and
+        sampling parameters); text, text_split_method, batch_size and fragment_interval may differ.
+
+        Args:
+            inputs_list: list of dict, same fields as run().
+        Returns:
+            list: (sampling rate, audio data) of each request, in order.
+        '''
+        # 合并的请求共用一个 span, 以 request_ids 对应到各个请求
+        scope = self._trace_scope(inputs_list[0])
+        scope.update({"request_id": None, "text_chars": sum(len(item.get("text", "") or "") for item in inputs_list),
+                      "request_ids": [str(item.get("request_id")) for item in inputs_list], "requests": len(inputs_list)})
+        with tracing.span("tts.run_batch", scope=scope):
+            return self._run_batch(inputs_list)
+
+    def _run_batch(self, inputs_list:List[dict])->List[Tuple[int, np.ndarray]]:
+        self.stop_flag:bool = False
+        t0 = ttime()
+        inputs:dict = inputs_list[0]
+        text_lang:str = inputs.get("text_lang", "")
+        ref_audio_path:str = inputs.get("ref_audio_path", "")
+        aux_ref_audio_paths:list = inputs.get("aux_ref_audio_paths", [])
+        prompt_text:str = inputs.get("prompt_text", "")
+        prompt_lang:str = inputs.get("prompt_lang", "")
+        top_k:int = inputs.get("top_k", 5)
+        top_p:float = inputs.get("top_p", 1)
+        temperature:float = inputs.get("temperature", 1)
+        batch_threshold = inputs.get("batch_threshold", 0.75)
+        speed_factor = inputs.get("speed_factor", 1.0)
+        parallel_infer = inputs.get("parallel_infer", True)
+        repetition_penalty = inputs.get("repetition_penalty", 1.35)
+        # 每个请求单独推理时各自最多 batch_size 句一批, 合并后按总和组批
+        batch_size = sum(int(item.get("batch_size", 1)) for item in inputs_list)
+        set_seed(-1)
+
+        if parallel_infer:
+            self.t2s_model.model.infer_panel = self.t2s_model.model.infer_panel_batch_infer
+        else:
+            self.t2s_model.model.infer_panel = self.t2s_model.model.infer_panel_naive_batched
+
+        no_prompt_text = prompt_text in [None, ""]
+        assert text_lang in self.configs.languages
+        if not no_prompt_text:
+            assert prompt_lang in self.configs.languages
+        if ref_audio_path in [None, ""] and \
+            ((self.prompt_cache["ref_audio_path"] is None) or (self.prompt_cache["refer_spec"] in [None, []])):
+            raise ValueError("ref_audio_path cannot be empty, when the reference audio is not set using set_ref_audio()")
+
+        # 切分各请求的文本, 记下每句属于哪个请求
+        texts, owners = [], []
+        for i, item in enumerate(inputs_list):
+            text = self.text_preprocessor.replace_consecutive_punctuation(item.get("text", ""))
+            for sentence in self.text_preprocessor.pre_seg_text(text, text_lang, item.get("text_split_method", "cut0")):
+                texts.append(sentence)
+                owners.append(i)
+        tracing.record("tts.segment", t0, sentences=len(texts))
+        feature_pipeline = self.text_preprocessor.extract_features(
+                                texts, 
+                                text_lang, 
+                                self.configs.version,
+                                num_workers=self.configs.frontend_workers,
+                                max_pending=max(1, self.configs.frontend_prefetch)*batch_size,
+                                )
+        try:
+            if (ref_audio_path not in [None, ""]) and (not os.path.exists(ref_audio_path)):
+                raise ValueError(f"{ref_audio_path} not exists")
+            if not no_prompt_text:
+                prompt_text = self.normalize_prompt_text(prompt_text, prompt_lang)
+            t_ref = ttime()
+            prompt_cache = self.get_prompt_entry(ref_audio_path, aux_ref_audio_paths,
+                                                 None if no_prompt_text else prompt_text, prompt_lang)
+            tracing.record("tts.reference", t_ref, aux_refs=len(prompt_cache["refer_hashes"]) - 1)
+            self.prompt_cache = prompt_cache
+
+            data, data_owners = [], []
+            for owner, res in zip(owners, feature_pipeline):
+                if res is not None:
+                    data.append(res)
+                    data_owners.append(owner)
+
+            sentence_audio = [None] * len(data)
+            if len(data) > 0:
+                batches, batch_index_list = self.to_batch(data, 
+                                    prompt_data=prompt_cache if not no_prompt_text else None, 
+                                    batch_size=batch_size, 
+                                    threshold=batch_threshold,
+                                    split_bucket=speed_factor == 1.0,
+                                    device=self.configs.device,
+                                    precision=self.precision
+                                    )
+                print(f"############ 推理 {len(inputs_list)} 个请求, {len(data)} 句, {len(batches)} 批 ############")
+                for item, index_list in zip(batches, batch_index_list):
+                    batch_audio_fragment, _, _ = self._infer_batch(item, prompt_cache, no_prompt_text,
+                                                                  top_k=top_k,
+                                                                  top_p=top_p,
+                                                                  temperature=temperature,
+                                                                  repetition_penalty=repetition_penalty,
+                                                                  speed_factor=speed_factor)
+                    for index, audio_fragment in zip(index_list, batch_audio_fragment):
+                        sentence_audio[index] = audio_fragment
+                    if self.stop_flag:
+                        break
+
+            results = []
+            for i, item in enumerate(inputs_list):
+                audio = [sentence_audio[j] for j in range(len(data)) if data_owners[j] == i]
+                if len(audio) == 0 or any(fragment is None for fragment in audio):
+                    results.append((self.configs.sampling_rate, np.zeros(int(self.configs.sampling_rate), dtype=np.int16)))
+                    continue
+                results.append(self.audio_postprocess([audio], 
+                                                      self.configs.sampling_rate, 
+                                                      None, 
+                                                      speed_factor, 
+                                                      False,
+                                                      max(0.01, item.get("fragment_interval", 0.3))
+                                                      ))
+            elapsed = ttime() - t0
+            audio_seconds = sum(len(audio) / sr for sr, audio in results)
+            metrics.REQUESTS.inc(len(inputs_list), mode="batched")
+            # 合并的请求同时完成, 各自的首段延迟都是整批的耗时
+            for _ in inputs_list:
+                metrics.FIRST_FRAGMENT_SECONDS.observe(elapsed)
+            metrics.REAL_TIME_FACTOR.observe(elapsed / max(audio_seconds, 1e-3))
+            return results
+        finally:
+            feature_pipeline.close()
             self.empty_cache()
+
+    def _semantic_cache_keys(self, item:dict, prompt_cache:dict, no_prompt_text:bool, sampling:tuple, seed)->list:
+        '''
+        Keys of the T2S output of each sentence in a batch, None if it is not reproducible (random seed).
+        The tokens depend on the phones and text of the sentence (which include the prompt text), the
+        prompt semantic (main reference audio and SoVITS weights), the sampling parameters, the seed and
+        the GPT weights; not on speed_factor, fragment_interval, the media type or the auxiliary
+        reference audios, which only change the VITS decode and the postprocessing.
+        '''
+        if seed in [-1, "", None]:
+            return [None] * len(item["all_phones"])
+        ref_key = prompt_cache.get("key")
+        prompt = None if no_prompt_text or ref_key is None else \
+            (ref_key[0], ref_key[2], ref_key[3], self._file_hash(self.configs.vits_weights_path))
+        model = (self._file_hash(self.configs.t2s_weights_path), self.configs.version,
+                 os.path.normpath(self.configs.bert_base_path), str(self.precision))
+        keys = []
+        for phones, norm_text in zip(item["all_phones"], item["norm_text"]):
+            phones_hash = hashlib.sha1(phones.cpu().numpy().tobytes()).hexdigest()
+            keys.append((phones_hash, norm_text, prompt, sampling, int(seed), model))
+        return keys
+
+    def get_semantic_cache_report(self)->dict:
+        lookups = self.semantic_cache_hits + self.semantic_cache_misses
+        return {
+            "entries": len(self.semantic_cache),
+            "max_entries": self.configs.semantic_cache_size,
+            "hits": self.semantic_cache_hits,
+            "misses": self.semantic_cache_misses,
+            "hit_rate": round(self.semantic_cache_hits / lookups, 4) if lookups else 0.0,
+        }
+
+    @profiled("TTS._infer_batch")
+    def _infer_batch(self, item:dict, prompt_cache:dict, no_prompt_text:bool,
+                     top_k:int=5, top_p:float=1, temperature:float=1,
+                     repetition_penalty:float=1.35, speed_factor:float=1.0, seed:int=-1)->Tuple[list, float, float]:
+        '''
+        T2S and VITS inference of one batch made by to_batch.
+        With a fixed seed the T2S output of each sentence is cached (see _semantic_cache_keys) and
+        the batch is only decoded when one of its sentences is not in the cache. The sampling is then
+        seeded from the keys of the whole batch, so the tokens of a batch do not depend on whether
+        the batches before it were decoded or read from the cache.
+        Returns:
+            tuple: (audio fragments of the batch items, t2s time, vits time)
+        '''
+        t3 = ttime()
+        batch_phones:List[torch.LongTensor] = item["phones"]
+        # batch_phones:torch.LongTensor = item["phones"]
+        batch_phones_len:torch.LongTensor = item["phones_len"]
+        all_phoneme_ids:torch.LongTensor = item["all_phones"]
+        all_phoneme_lens:torch.LongTensor  = item["all_phones_len"]
+        all_bert_features:torch.LongTensor = item["all_bert_features"]
+        norm_text:str = item["norm_text"]
+        max_len = item["max_len"]
+
+        print(i18n("前端处理后的文本(每句):"), norm_text)
+        metrics.BATCH_SIZE.observe(len(all_phoneme_ids), kind="sentences")
+        cache_keys = self._semantic_cache_keys(item, prompt_cache, no_prompt_text,
+                                               (top_k, float(top_p), float(temperature), float(repetition_penalty)), seed)
+        pred_semantic_list = [None] * len(all_phoneme_ids)
+        # 整批都命中才复用, 部分命中时整批重新解码, 与未缓存时的批次组成相同
+        if cache_keys[0] is not None and all(key in self.semantic_cache for key in cache_keys):
+            for i, key in enumerate(cache_keys):
+                self.semantic_cache.move_to_end(key)
+                pred_semantic_list[i] = self.semantic_cache[key].to(self.configs.device)
+            print(f"T2S 语义token缓存命中 {len(cache_keys)} 句")
+        todo = [i for i, pred in enumerate(pred_semantic_list) if pred is None]
+        t2s_stats = {"tokens": 0}
+        if cache_keys[0] is not None and self.configs.semantic_cache_size > 0:
+            self.semantic_cache_hits += len(cache_keys) - len(todo)
+            self.semantic_cache_misses += len(todo)
+
+        if len(todo) > 0:
+            if no_prompt_text :
+                prompt = None
+            else:
+                prompt = prompt_cache["prompt_semantic"].expand(len(todo), -1).to(self.configs.device)
+
+            if cache_keys[0] is not None:
+                # 采样的随机状态只取决于本批内容, 不受前面的批次是否命中缓存影响
+                torch.manual_seed(int.from_bytes(hashlib.sha1(repr(cache_keys).encode()).digest()[:4], "little"))
+            todo_index = torch.LongTensor(todo).to(all_phoneme_lens.device)
+            with record_function(f"Text2SemanticDecoder.{self.t2s_model.model.infer_panel.__name__}"):
+                _pred_semantic_list, idx_list = self.t2s_model.model.infer_panel(
+                    [all_phoneme_ids[i] for i in todo],
+                    all_phoneme_lens[todo_index],
+                    prompt,
+                    [all_bert_features[i] for i in todo],
+                    # prompt_phone_len=ph_offset,
+                    top_k=top_k,
+                    top_p=top_p,
+                    temperature=temperature,
+                    early_stop_num=self.configs.hz * self.configs.max_sec,
+                    max_len=max_len,
+                    repetition_penalty=repetition_penalty,
+                )
+
+            decoded_len = [int(idx) for idx in idx_list]
+            t2s_stats = self._observe_decode_stats(decoded_len)
+            self.report_batches([list(range(len(decoded_len)))], decoded_len, "decoded")
+            self.update_tokens_per_phone([item["lang"][i] for i in todo],
+                                        batch_phones_len[todo_index.to(batch_phones_len.device)].tolist(), decoded_len,
+                                        max_tokens=self.configs.hz * self.configs.max_sec)
+            for i, pred, idx in zip(todo, _pred_semantic_list, decoded_len):
+                pred_semantic_list[i] = pred[-idx:]
+                if cache_keys[i] is not None and self.configs.semantic_cache_size > 0:
+                    self.semantic_cache[cache_keys[i]] = pred_semantic_list[i].detach().cpu()
+            while len(self.semantic_cache) > max(0, self.configs.semantic_cache_size):
+                self.semantic_cache.popitem(last=False)
+        # 缓存与新算的语义token都已截掉无效部分
+        idx_list = [pred.shape[0] for pred in pred_semantic_list]
+        t4 = ttime()
+        tracing.record("tts.t2s", t3, t4, sentences=len(pred_semantic_list),
+                       cached_sentences=len(pred_semantic_list) - len(todo), **t2s_stats)
+
+        refer_audio_spec:torch.Tensor = [item.to(dtype=self.precision, device=self.configs.device) for item in prompt_cache["refer_spec"]]
+        ge = self._get_speaker_embedding(refer_audio_spec, prompt_cache["refer_hashes"])
+                                            
+
+        batch_audio_fragment = []
     
+        # ## vits并行推理 method 1
+        # pred_semantic_list = [item[-idx:] for item, idx in zip(pred_semantic_list, idx_list)]
+        # pred_semantic_len = torch.LongTensor([item.shape[0] for item in pred_semantic_list]).to(self.configs.device)
+        # pred_semantic = self.batch_sequences(pred_semantic_list, axis=0, pad_value=0).unsqueeze(0)
+        # max_len = 0
+        # for i in range(0, len(batch_phones)):
+        #     max_len = max(max_len, batch_phones[i].shape[-1])
+        # batch_phones = self.batch_sequences(batch_phones, axis=0, pad_value=0, max_length=max_len)
+        # batch_phones = batch_phones.to(self.configs.device)
+        # batch_audio_fragment = (self.vits_model.batched_decode(
+        #         pred_semantic, pred_semantic_len, batch_phones, batch_phones_len,refer_audio_spec
+        #     ))
+
+        if speed_factor == 1.0:
+            # ## vits并行推理 method 2
+            pred_semantic_list = [item[-idx:] for item, idx in zip(pred_semantic_list, idx_list)]
+            upsample_rate = math.prod(self.vits_model.upsample_rates)
+            audio_frag_idx = [pred_semantic_list[i].shape[0]*2*upsample_rate for i in range(0, len(pred_semantic_list))]
+            audio_frag_end_idx = [ sum(audio_frag_idx[:i+1]) for i in range(0, len(audio_frag_idx))]
+            all_pred_semantic = torch.cat(pred_semantic_list).unsqueeze(0).unsqueeze(0).to(self.configs.device)
+            _batch_phones = torch.cat(batch_phones).unsqueeze(0).to(self.configs.device)
+            with record_function("SynthesizerTrn.decode"):
+                _batch_audio_fragment = (self.vits_model.decode(
+                        all_pred_semantic, _batch_phones, refer_audio_spec, speed=speed_factor, ge=ge
+                    ).detach()[0, 0, :])
+            audio_frag_end_idx.insert(0, 0)
+            batch_audio_fragment= [_batch_audio_fragment[audio_frag_end_idx[i-1]:audio_frag_end_idx[i]] for i in range(1, len(audio_frag_end_idx))]
+        else:
+        # ## vits串行推理
+            for i, idx in enumerate(idx_list):
+                phones = batch_phones[i].unsqueeze(0).to(self.configs.device)
+                _pred_semantic = (pred_semantic_list[i][-idx:].unsqueeze(0).unsqueeze(0))   # .unsqueeze(0)#mq要多unsqueeze一次
+                with record_function("SynthesizerTrn.decode"):
+                    audio_fragment =(self.vits_model.decode(
+                            _pred_semantic, phones, refer_audio_spec, speed=speed_factor, ge=ge
+                        ).detach()[0, 0, :])
+                batch_audio_fragment.append(
+                    audio_fragment
+                )  ###试试重建不带上prompt部分
+
+        # 后处理本来就要把音频拷回CPU, 在这里同步只是为了让VITS耗时准确
+        if torch.device(self.configs.device).type == "cuda":
+            torch.cuda.synchronize(self.configs.device)
+        t_vits = ttime() - t4
+        metrics.observe_stage("vits", t_vits)
+        tracing.record("tts.vits", t4, t4 + t_vits, sentences=len(batch_audio_fragment),
+                       semantic_tokens=sum(idx_list), speed_factor=speed_factor)
+        return batch_audio_fragment, t4 - t3, t_vits
+
+    def _observe_decode_stats(self, decoded_len:List[int])->dict:
+        '''
+        T2S prefill time, time per decoded token and decoding throughput of the last infer_panel call.
+        Returns the same numbers as tracing attributes.
+        '''
+        tokens = sum(decoded_len)
+        stats = getattr(self.t2s_model.model, "decode_stats", None)
+        if stats is None:
+            return {"tokens": tokens}
+        metrics.observe_stage("t2s_prefill", stats["prefill_time"])
+        if stats["decode_steps"] > 0:
+            metrics.observe_stage("t2s_decode_token", stats["decode_time"] / stats["decode_steps"])
+        metrics.TOKENS_DECODED.inc(tokens)
+        elapsed = stats["prefill_time"] + stats["decode_time"]
+        if elapsed > 0:
+            metrics.TOKENS_PER_SECOND.observe(tokens / elapsed)
+        return {"tokens": tokens, "steps": stats["decode_steps"],
+                "prefill_ms": round(stats["prefill_time"] * 1000, 3), "decode_ms": round(stats["decode_time"] * 1000, 3)}
+
     def empty_cache(self):
         try:
             gc.collect() # 触发gc的垃圾回收。避免内存一直增长。
@@ -969,8 +1792,151 @@ class TTS:
             elif str(self.configs.device) == "mps":
                 torch.mps.empty_cache()
         except:
-            pass 
-        
+            pass
+
+    @torch.no_grad()
+    def warmup(self)->dict:
+        '''
+        Run synthetic inputs through the pipeline before serving traffic, so that the lazy
+        initialization is not paid by the first real requests: the G2P of every warmup language
+        (jieba dictionary, g2pW, pyopenjtalk, ...), the first BERT and CNHuBERT forward, the CUDA
+        context and kernel selection of the T2S and VITS models, and the allocator growth for the
+        KV cache of each warmup batch size.
+
+        Stages, each timed in the report:
+            frontend   : a short and a long sentence of every language in configs.warmup_languages.
+            reference  : configs.warmup_ref_audio_path, or a synthetic 5 s reference audio. Without
+                         configs.warmup_prompt_text the short warmup sentence is the prompt text, so that
+                         T2S takes the batched decoding path of prompted requests.
+            synthesis  : T2S and VITS of one batch per size in configs.warmup_batch_sizes, mixing short
+                         and long sentences, decoding at most configs.warmup_max_sec seconds of audio.
+            end_to_end : one run() of the first language, i.e. the latency of a warm request.
+        A failing stage is recorded in the report and does not stop the others. The synthetic reference,
+        the tokens-per-phone statistics and the last used reference are restored afterwards, and the
+        end_to_end run is not counted in the request metrics (requests, real time factor, first fragment).
+
+        Returns:
+            dict: the warmup report, also kept in self.warmup_report (updated while the warmup runs).
+        '''
+        configs = self.configs
+        languages = [lang for lang in (configs.warmup_languages or default_languages(configs.version))
+                     if lang in configs.languages]
+        if len(languages) == 0:
+            languages = default_languages(configs.version)
+        batch_sizes = sorted(set(max(1, int(size)) for size in configs.warmup_batch_sizes)) or [1]
+        report = {"state": "running", "seconds": 0.0, "reference": None,
+                  "languages": languages, "batch_sizes": batch_sizes, "stages": [], "errors": []}
+        self.warmup_report = report
+        t_start = ttime()
+
+        def run_stage(name:str, fn, **info):
+            t0 = ttime()
+            entry = dict(stage=name, **info)
+            try:
+                entry.update(fn() or {})
+            except Exception as e:
+                traceback.print_exc()
+                entry["error"] = f"{type(e).__name__}: {e}"
+                report["errors"].append(f"{name} {info}: {entry['error']}")
+            entry["seconds"] = round(ttime() - t0, 3)
+            report["stages"].append(entry)
+            print(f"warmup {name} {info}: {entry['seconds']:.3f}s")
+
+        ref_audio_path = configs.warmup_ref_audio_path
+        prompt_text = configs.warmup_prompt_text or None
+        prompt_lang = configs.warmup_prompt_lang
+        synthetic = ref_audio_path in [None, ""] or not os.path.exists(ref_audio_path)
+        if synthetic:
+            if ref_audio_path not in [None, ""]:
+                print(f"warmup: {ref_audio_path} not exists, using a synthetic reference audio")
+            fd, ref_audio_path = tempfile.mkstemp(prefix="tts_warmup_", suffix=".wav")
+            os.close(fd)
+            write_synthetic_reference(ref_audio_path, int(configs.sampling_rate))
+            prompt_text = None
+        if prompt_text is None:
+            # 没有参考文本时 T2S 逐句解码(infer_panel_naive_batched), 用一句预热文本作参考文本, 走真实请求的批量解码路径
+            prompt_lang = prompt_lang if prompt_lang in configs.languages else languages[0]
+            prompt_text = warmup_texts(prompt_lang)[0]
+        prompt_text = self.normalize_prompt_text(prompt_text, prompt_lang)
+        report["reference"] = "synthetic" if synthetic else ref_audio_path
+
+        tokens_per_phone = deepcopy(self.tokens_per_phone)
+        last_prompt = self.prompt_cache
+        max_sec = configs.max_sec
+        if configs.warmup_max_sec > 0:
+            configs.max_sec = min(max_sec, configs.warmup_max_sec)
+        self.warming_up = True
+        try:
+            features = {}
+            for lang in languages:
+                def frontend(lang=lang):
+                    features[lang] = [item for text in warmup_texts(lang) for item in
+                                      self.text_preprocessor.preprocess(text, lang, "cut0", configs.version)]
+                    return {"sentences": len(features[lang]),
+                            "phones": sum(len(item["phones"]) for item in features[lang])}
+                run_stage("frontend", frontend, lang=lang)
+
+            prompt = {}
+            def reference():
+                prompt.update(self.get_prompt_entry(ref_audio_path, [], prompt_text, prompt_lang))
+                return {"prompt_semantic": int(prompt["prompt_semantic"].shape[-1])}
+            run_stage("reference", reference)
+
+            data = next((features[lang] for lang in languages if len(features.get(lang) or []) > 0), [])
+            for batch_size in batch_sizes:
+                def synthesis(batch_size=batch_size):
+                    if len(data) == 0 or len(prompt) == 0:
+                        raise RuntimeError("no frontend features or reference to synthesize from")
+                    self.t2s_model.model.infer_panel = self.t2s_model.model.infer_panel_batch_infer
+                    batch, _ = self.to_batch([data[i % len(data)] for i in range(batch_size)],
+                                             prompt_data=prompt,
+                                             batch_size=batch_size,
+                                             split_bucket=False,
+                                             device=configs.device,
+                                             precision=self.precision)
+                    audio, t_t2s, t_vits = self._infer_batch(batch[0], prompt, False)
+                    t_post = ttime()
+                    sr, audio = self.audio_postprocess([audio], configs.sampling_rate, None, 1.0, False)
+                    return {"t2s": round(t_t2s, 3), "vits": round(t_vits, 3),
+                            "postprocess": round(ttime() - t_post, 3), "audio_seconds": round(len(audio) / sr, 3)}
+                run_stage("synthesis", synthesis, batch_size=batch_size)
+
+            def end_to_end():
+                results = list(self.run({
+                    "text": "\n".join(warmup_texts(languages[0])),
+                    "text_lang": languages[0],
+                    "ref_audio_path": ref_audio_path,
+                    "prompt_text": prompt_text,
+                    "prompt_lang": prompt_lang,
+                    "batch_size": batch_sizes[-1],
+                    "request_id": "warmup",
+                }))
+                return {"audio_seconds": round(sum(len(audio) / sr for sr, audio in results), 3)}
+            run_stage("end_to_end", end_to_end, lang=languages[0])
+            report["state"] = "done"
+        except BaseException as e:
+            report["state"] = "failed"
+            report["errors"].append(f"{type(e).__name__}: {e}")
+            raise
+        finally:
+            configs.max_sec = max_sec
+            self.warming_up = False
+            self.tokens_per_phone = tokens_per_phone
+            self.prompt_cache = last_prompt
+            if synthetic:
+                # 合成的参考音频不会再被请求用到, 不占缓存
+                ref_hash = self._file_hashes.pop(ref_audio_path, (None, None, None))[2]
+                self.prompt_cache_lru.discard(lambda key: key[0] == ref_hash)
+                for key in [key for key in self.ref_audio_cache if key[0] == ref_hash]:
+                    del self.ref_audio_cache[key]
+                for key in [key for key in self.speaker_embedding_cache if ref_hash in key[0]]:
+                    del self.speaker_embedding_cache[key]
+                os.remove(ref_audio_path)
+            report["seconds"] = round(ttime() - t_start, 3)
+            print(f"warmup {report['state']} in {report['seconds']:.3f}s, {len(report['errors'])} errors")
+        return report
+
+    @profiled("TTS.audio_postprocess")
     def audio_postprocess(self, 
                           audio:List[torch.Tensor], 
                           sr:int, 
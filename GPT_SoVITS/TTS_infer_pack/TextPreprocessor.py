@@ -6,14 +6,22 @@ now_dir = os.getcwd()
 sys.path.append(now_dir)
 
 import re
+import threading
+import time
+import traceback
 import torch
 import LangSegment
-from text import chinese
-from typing import Dict, List, Tuple
-from text.cleaner import clean_text
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
+from typing import Dict, Iterable, List, Optional, Tuple, Union
+from text.cleaner import clean_text, prefetch as prefetch_text
 from text import cleaned_text_to_sequence
 from transformers import AutoModelForMaskedLM, AutoTokenizer
 from TTS_infer_pack.text_segmentation_method import split_big_text, splits, get_method as get_seg_method
+from TTS_infer_pack.model_residency import ResidentModel
+from TTS_infer_pack.metrics import observe_stage
+from TTS_infer_pack.profiler_capture import profiled
 
 from tools.i18n.i18n import I18nAuto, scan_language_list
 
@@ -21,6 +29,8 @@ language=os.environ.get("language","Auto")
 language=sys.argv[-1] if sys.argv[-1] in scan_language_list() else language
 i18n = I18nAuto(language=language)
 punctuation = set(['!', '?', '…', ',', '.', '-'," "])
+# LangSegment 的过滤器是全局状态, 前端流水线线程与主线程(参考文本)可能同时调用
+_lang_segment_lock = threading.Lock()
 
 def get_first(text:str) -> str:
     pattern = "[" + "".join(re.escape(sep) for sep in splits) + "]"
@@ -45,35 +55,129 @@ def merge_short_text_in_array(texts:str, threshold:int) -> list:
     return result
 
 
+class FrontendPipeline:
+    '''
+    Runs the text frontend (G2P + BERT) ahead of the model stages.
 
+    Texts are submitted to a thread pool as soon as the pipeline is created,
+    at most ``max_pending`` of them are in flight (or finished but not yet
+    consumed) at any time. Results are yielded in input order; a text that
+    yields no phones is returned as ``None``.
+
+    Args:
+        preprocessor (TextPreprocessor): the preprocessor doing the work.
+        texts (List[str]): the segmented texts.
+        lang (str): language of the texts.
+        version (str): model version.
+        num_workers (int): number of frontend threads.
+        max_pending (int): size of the look-ahead window.
+    '''
+    def __init__(self, preprocessor:"TextPreprocessor", texts:Iterable[str], lang:str, version:str,
+                 num_workers:int=1, max_pending:int=4):
+        self.preprocessor = preprocessor
+        self.lang = lang
+        self.version = version
+        self.max_pending = max(1, max_pending)
+        self._texts = iter(texts)
+        self._pending = deque()
+        self._closed = False
+        self._executor = ThreadPoolExecutor(max_workers=max(1, num_workers),
+                                            thread_name_prefix="tts_frontend")
+        if lang == "en":
+            # 纯英文时先对全部分句做一次未登录词批量预测
+            texts = list(texts)
+            self._texts = iter(texts)
+            self._executor.submit(self._prefetch, texts)
+        self._fill()
+
+    def _prefetch(self, texts:List[str]):
+        try:
+            prefetch_text(texts, self.lang, self.version)
+        except Exception:
+            traceback.print_exc()
+
+    def _extract(self, text:str)->Optional[Dict]:
+        phones, bert_features, norm_text = \
+            self.preprocessor.segment_and_extract_feature_for_text(text, self.lang, self.version)
+        if phones is None or norm_text == "":
+            return None
+        return {
+            "phones": phones,
+            "bert_features": bert_features,
+            "norm_text": norm_text,
+            "lang": self.lang,
+        }
+
+    def _fill(self):
+        while not self._closed and len(self._pending) < self.max_pending:
+            text = next(self._texts, None)
+            if text is None:
+                break
+            self._pending.append(self._executor.submit(self._extract, text))
+
+    def __iter__(self):
+        return self
+
+    def __next__(self)->Optional[Dict]:
+        if self._closed or len(self._pending) == 0:
+            self.close()
+            raise StopIteration
+        future = self._pending.popleft()
+        try:
+            result = future.result()
+        except BaseException:
+            self.close()
+            raise
+        self._fill()
+        return result
+
+    def take(self, n:int)->List[Optional[Dict]]:
+        '''Take up to n results (fewer when the pipeline runs dry).'''
+        results = []
+        for _ in range(n):
+            try:
+                results.append(next(self))
+            except StopIteration:
+                break
+        return results
+
+    def close(self):
+        '''Drop the texts not yet started and release the worker threads.'''
+        if self._closed:
+            return
+        self._closed = True
+        for future in self._pending:
+            future.cancel()
+        self._pending.clear()
+        self._executor.shutdown(wait=False, cancel_futures=True)
 
 
 class TextPreprocessor:
-    def __init__(self, bert_model:AutoModelForMaskedLM, 
+    def __init__(self, bert_model:Union[AutoModelForMaskedLM, ResidentModel], 
                  tokenizer:AutoTokenizer, device:torch.device):
         self.bert_model = bert_model
         self.tokenizer = tokenizer
         self.device = device
         
-    def preprocess(self, text:str, lang:str, text_split_method:str, version:str="v2")->List[Dict]:
+    def preprocess(self, text:str, lang:str, text_split_method:str, version:str="v2",
+                   num_workers:int=1, max_pending:int=4)->List[Dict]:
         print(i18n("############ 切分文本 ############"))
         text = self.replace_consecutive_punctuation(text)
         texts = self.pre_seg_text(text, lang, text_split_method)
-        result = []
         print(i18n("############ 提取文本Bert特征 ############"))
-        for text in tqdm(texts):
-            phones, bert_features, norm_text = self.segment_and_extract_feature_for_text(text, lang, version)
-            if phones is None or norm_text=="":
-                continue
-            res={
-                "phones": phones,
-                "bert_features": bert_features,
-                "norm_text": norm_text,
-            }
-            result.append(res)
-        return result
+        pipeline = self.extract_features(texts, lang, version, num_workers, max_pending)
+        return [res for res in tqdm(pipeline, total=len(texts)) if res is not None]
+
+    def extract_features(self, texts:List[str], lang:str, version:str="v2",
+                         num_workers:int=1, max_pending:int=4)->FrontendPipeline:
+        '''
+        Start extracting phones and bert features for the texts in the background.
+        See FrontendPipeline for details.
+        '''
+        return FrontendPipeline(self, texts, lang, version, num_workers, max_pending)
 
-    def pre_seg_text(self, text:str, lang:str, text_split_method:str):
+    @profiled("TextPreprocessor.pre_seg_text")
+    def pre_seg_text(self, text:str, lang:str, text_split_method:str, streaming:bool=False):
         text = text.strip("\n")
         if len(text) == 0:
             return []
@@ -83,7 +187,11 @@ class TextPreprocessor:
         print(text)
         
         seg_method = get_seg_method(text_split_method)
-        text = seg_method(text)
+        if getattr(seg_method, "supports_streaming", False):
+            # 流式返回时切分方法可以把第一段切短, 以降低首包延迟
+            text = seg_method(text, streaming=streaming)
+        else:
+            text = seg_method(text)
         
         while "\n\n" in text:
             text = text.replace("\n\n", "\n")
@@ -120,8 +228,9 @@ class TextPreprocessor:
         if language in {"en", "all_zh", "all_ja", "all_ko", "all_yue"}:
             language = language.replace("all_","")
             if language == "en":
-                LangSegment.setfilters(["en"])
-                formattext = " ".join(tmp["text"] for tmp in LangSegment.getTexts(text))
+                with _lang_segment_lock:
+                    LangSegment.setfilters(["en"])
+                    formattext = " ".join(tmp["text"] for tmp in LangSegment.getTexts(text))
             else:
                 # 因无法区别中日韩文汉字,以用户输入为准
                 formattext = text
@@ -129,6 +238,7 @@ class TextPreprocessor:
                 formattext = formattext.replace("  ", " ")
             if language == "zh":
                 if re.search(r'[A-Za-z]', formattext):
+                    from text import chinese
                     formattext = re.sub(r'[a-z]', lambda x: x.group(0).upper(), formattext)
                     formattext = chinese.mix_text_normalize(formattext)
                     return self.get_phones_and_bert(formattext,"zh",version)
@@ -136,6 +246,7 @@ class TextPreprocessor:
                     phones, word2ph, norm_text = self.clean_text_inf(formattext, language, version)
                     bert = self.get_bert_feature(norm_text, word2ph).to(self.device)
             elif language == "yue" and re.search(r'[A-Za-z]', formattext):
+                    from text import chinese
                     formattext = re.sub(r'[a-z]', lambda x: x.group(0).upper(), formattext)
                     formattext = chinese.mix_text_normalize(formattext)
                     return self.get_phones_and_bert(formattext,"yue",version)
@@ -148,19 +259,21 @@ class TextPreprocessor:
         elif language in {"zh", "ja", "ko", "yue", "auto", "auto_yue"}:
             textlist=[]
             langlist=[]
-            LangSegment.setfilters(["zh","ja","en","ko"])
+            with _lang_segment_lock:
+                LangSegment.setfilters(["zh","ja","en","ko"])
+                segments = LangSegment.getTexts(text)
             if language == "auto":
-                for tmp in LangSegment.getTexts(text):
+                for tmp in segments:
                     langlist.append(tmp["lang"])
                     textlist.append(tmp["text"])
             elif language == "auto_yue":
-                for tmp in LangSegment.getTexts(text):
+                for tmp in segments:
                     if tmp["lang"] == "zh":
                         tmp["lang"] = "yue"
                     langlist.append(tmp["lang"])
                     textlist.append(tmp["text"])
             else:
-                for tmp in LangSegment.getTexts(text):
+                for tmp in segments:
                     if tmp["lang"] == "en":
                         langlist.append(tmp["lang"])
                     else:
@@ -189,12 +302,16 @@ class TextPreprocessor:
         return phones, bert, norm_text
 
 
+    @profiled("TextPreprocessor.get_bert_feature")
     def get_bert_feature(self, text:str, word2ph:list)->torch.Tensor:
-        with torch.no_grad():
+        t_start = time.perf_counter()
+        # BERT 可能按驻留策略按需加载/卸载, 使用期间不会被卸载
+        bert_context = self.bert_model.use() if isinstance(self.bert_model, ResidentModel) else nullcontext(self.bert_model)
+        with torch.no_grad(), bert_context as bert_model:
             inputs = self.tokenizer(text, return_tensors="pt")
             for i in inputs:
-                inputs[i] = inputs[i].to(self.device)
-            res = self.bert_model(**inputs, output_hidden_states=True)
+                inputs[i] = inputs[i].to(bert_model.device)
+            res = bert_model(**inputs, output_hidden_states=True)
             res = torch.cat(res["hidden_states"][-3:-2], -1)[0].cpu()[1:-1]
         assert len(word2ph) == len(text)
         phone_level_feature = []
@@ -202,11 +319,15 @@ class TextPreprocessor:
             repeat_feature = res[i].repeat(word2ph[i], 1)
             phone_level_feature.append(repeat_feature)
         phone_level_feature = torch.cat(phone_level_feature, dim=0)
+        observe_stage("frontend_bert", time.perf_counter() - t_start)
         return phone_level_feature.T
     
+    @profiled("TextPreprocessor.clean_text_inf")
     def clean_text_inf(self, text:str, language:str, version:str="v2"):
+        t_start = time.perf_counter()
         phones, word2ph, norm_text = clean_text(text, language, version)
         phones = cleaned_text_to_sequence(phones, version)
+        observe_stage("frontend_g2p", time.perf_counter() - t_start)
         return phones, word2ph, norm_text
 
     def get_bert_inf(self, phones:list, word2ph:list, norm_text:str, language:str):
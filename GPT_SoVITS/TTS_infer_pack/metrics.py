@@ -0,0 +1,270 @@
+import bisect
+import math
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, List, Sequence, Tuple
+
+# 秒级耗时的默认分桶, 覆盖单个 token (毫秒级) 到整句合成 (数十秒)
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+def _format_value(value:float)->str:
+    if value == math.inf:
+        return "+Inf"
+    if value == -math.inf:
+        return "-Inf"
+    if isinstance(value, (bool, int)):
+        return str(int(value))
+    if isinstance(value, float) and value.is_integer() and abs(value) < 1e15:
+        return str(int(value))
+    return repr(float(value))
+
+
+def _escape(value:str)->str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names:Sequence[str], values:Sequence[str], extra:Tuple[str, str]=None)->str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra is not None:
+        pairs.append(f'{extra[0]}="{_escape(extra[1])}"')
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class _Metric:
+    kind = "untyped"
+
+    def __init__(self, name:str, documentation:str, labelnames:Sequence[str]=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values:Dict[Tuple[str, ...], object] = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels:Dict[str, str])->Tuple[str, ...]:
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name}: expected labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def _samples(self)->List[str]:
+        raise NotImplementedError
+
+    def render(self)->List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            lines.extend(self._samples())
+        return lines
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount:float=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def _samples(self)->List[str]:
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"
+                for key, value in self._values.items()]
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def set(self, value:float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def _samples(self)->List[str]:
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"
+                for key, value in self._values.items()]
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name:str, documentation:str, labelnames:Sequence[str]=(), buckets:Sequence[float]=LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value:float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                # [各分桶计数..., +Inf 计数], 总和
+                state = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0]
+            state[0][bisect.bisect_left(self.buckets, value)] += 1
+            state[1] += value
+
+    def _samples(self)->List[str]:
+        lines = []
+        for key, (counts, total) in self._values.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + (math.inf,), counts):
+                cumulative += count
+                labels = _format_labels(self.labelnames, key, ("le", _format_value(float(bound))))
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+class MetricsRegistry:
+    '''
+    Process-wide metrics in the Prometheus text exposition format, without depending on
+    prometheus_client. Counters and histograms are updated where the work happens; values
+    that are cheaper to read than to track (queue depth, cache hit rates, device memory)
+    come from collectors that run on every scrape and return (name, help, kind, samples).
+    '''
+    def __init__(self):
+        self._metrics:Dict[str, _Metric] = {}
+        self._collectors:List[Callable] = []
+        self._lock = threading.Lock()
+
+    def _register(self, cls, name:str, *args, **kwargs)->_Metric:
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = cls(name, *args, **kwargs)
+            elif not isinstance(metric, cls):
+                raise ValueError(f"metric {name} is already registered as a {metric.kind}")
+            return metric
+
+    def counter(self, name:str, documentation:str, labelnames:Sequence[str]=())->Counter:
+        return self._register(Counter, name, documentation, labelnames)
+
+    def gauge(self, name:str, documentation:str, labelnames:Sequence[str]=())->Gauge:
+        return self._register(Gauge, name, documentation, labelnames)
+
+    def histogram(self, name:str, documentation:str, labelnames:Sequence[str]=(), buckets:Sequence[float]=LATENCY_BUCKETS)->Histogram:
+        return self._register(Histogram, name, documentation, labelnames, buckets=buckets)
+
+    def add_collector(self, fn:Callable):
+        '''
+        fn() returns a list of (name, help, kind, [(labels dict, value), ...]).
+        '''
+        with self._lock:
+            self._collectors.append(fn)
+
+    def render(self)->str:
+        with self._lock:
+            metrics = list(self._metrics.values())
+            collectors = list(self._collectors)
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        # 不同 collector 可以输出同名指标 (标签不同), 同名的样本要放在同一个 family 下
+        families:Dict[str, list] = {}
+        for fn in collectors:
+            try:
+                collected = fn()
+            except Exception as e:
+                print(f"metrics collector {getattr(fn, '__name__', fn)} failed: {e}")
+                continue
+            for name, documentation, kind, samples in collected:
+                families.setdefault(name, [documentation, kind, []])[2].extend(samples)
+        for name, (documentation, kind, samples) in families.items():
+            lines.append(f"# HELP {name} {documentation}")
+            lines.append(f"# TYPE {name} {kind}")
+            for labels, value in samples:
+                if value is None:
+                    continue
+                lines.append(f"{name}{_format_labels(list(labels), list(labels.values()))} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = MetricsRegistry()
+
+# 推理各阶段耗时: frontend_g2p, frontend_bert, reference, t2s_prefill, t2s_decode_token, vits, pack
+STAGE_SECONDS = REGISTRY.histogram(
+    "tts_stage_seconds", "Latency of one pipeline stage (t2s_decode_token: per decoded token).", ["stage"])
+BATCH_SIZE = REGISTRY.histogram(
+    "tts_batch_size", "Sentences per T2S/VITS batch (kind=sentences) and requests per merged run (kind=requests).",
+    ["kind"], buckets=(1, 2, 4, 8, 16, 32, 64, 128))
+TOKENS_DECODED = REGISTRY.counter(
+    "tts_t2s_tokens_total", "Semantic tokens decoded by the T2S model.")
+TOKENS_PER_SECOND = REGISTRY.histogram(
+    "tts_t2s_tokens_per_second", "Semantic tokens decoded per second by one T2S batch.",
+    buckets=(10, 25, 50, 100, 200, 400, 800, 1600, 3200, 6400))
+REAL_TIME_FACTOR = REGISTRY.histogram(
+    "tts_real_time_factor", "Synthesis time divided by the duration of the produced audio.",
+    buckets=(0.01, 0.025, 0.05, 0.1, 0.2, 0.3, 0.5, 0.75, 1.0, 1.5, 2.0, 5.0))
+FIRST_FRAGMENT_SECONDS = REGISTRY.histogram(
+    "tts_first_fragment_seconds", "Time from the start of a request to its first audio fragment.")
+REQUESTS = REGISTRY.counter(
+    "tts_requests_total", "Synthesis requests handled by the pipeline.", ["mode"])
+
+
+def observe_stage(stage:str, seconds:float):
+    STAGE_SECONDS.observe(seconds, stage=stage)
+
+
+@contextmanager
+def stage_timer(stage:str):
+    t_start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe_stage(stage, time.perf_counter() - t_start)
+
+
+def scheduler_collector(schedulers:Callable[[], List]):
+    '''
+    Queue depth, busy state and rejected requests of every TTSRequestScheduler returned by schedulers().
+    '''
+    def collect():
+        queued, busy, rejected = [], [], []
+        for scheduler in schedulers():
+            labels = {"worker": scheduler.name}
+            queued.append((labels, scheduler.queued()))
+            busy.append((labels, int(scheduler.busy)))
+            rejected.append((labels, scheduler.rejected))
+        return [
+            ("tts_queue_depth", "Jobs waiting for the inference worker.", "gauge", queued),
+            ("tts_worker_busy", "1 while the inference worker is running a job.", "gauge", busy),
+            ("tts_requests_rejected_total", "Requests rejected because the queue was full.", "counter", rejected),
+        ]
+    return collect
+
+
+def device_memory_collector():
+    '''
+    Allocated and reserved memory of every visible CUDA device.
+    '''
+    import torch
+    if not torch.cuda.is_available():
+        return []
+    allocated, reserved = [], []
+    for index in range(torch.cuda.device_count()):
+        labels = {"device": f"cuda:{index}"}
+        allocated.append((labels, torch.cuda.memory_allocated(index)))
+        reserved.append((labels, torch.cuda.memory_reserved(index)))
+    return [
+        ("tts_device_memory_allocated_bytes", "Memory allocated by tensors on the device.", "gauge", allocated),
+        ("tts_device_memory_reserved_bytes", "Memory reserved by the caching allocator on the device.", "gauge", reserved),
+    ]
+
+
+def cache_collector(name:str, reports:Callable[[], List[Dict]]):
+    '''
+    Exposes hits, misses and hit rate of a cache, labelled cache=name. reports() returns the
+    report() dicts (with "hits" and "misses") of every instance of the cache, e.g. one per pipeline.
+    '''
+    def collect():
+        stats = reports()
+        hits = sum(report["hits"] for report in stats)
+        misses = sum(report["misses"] for report in stats)
+        labels = {"cache": name}
+        return [
+            ("tts_cache_hits_total", "Cache hits.", "counter", [(labels, hits)]),
+            ("tts_cache_misses_total", "Cache misses.", "counter", [(labels, misses)]),
+            ("tts_cache_hit_rate", "Cache hits / lookups since start.", "gauge",
+             [(labels, round(hits / (hits + misses), 4) if hits + misses else 0.0)]),
+        ]
+    collect.__name__ = f"{name}_cache_collector"
+    return collect
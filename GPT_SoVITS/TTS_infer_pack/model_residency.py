@@ -0,0 +1,527 @@
+import gc
+import threading
+import weakref
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import contextmanager
+from copy import deepcopy
+from time import time as ttime
+from typing import Callable, Dict, List, Optional, Tuple
+
+import torch
+
+POLICIES = ("keep", "lazy", "offload", "free")
+
+
+def empty_cache(device) -> None:
+    gc.collect()
+    if str(device).startswith("cuda") and torch.cuda.is_available():
+        torch.cuda.empty_cache()
+    elif str(device) == "mps" and hasattr(torch, "mps"):
+        torch.mps.empty_cache()
+
+
+class ResidentModel:
+    '''
+    Residency of an auxiliary model (BERT, CNHuBERT) on the inference device.
+
+    Policies:
+        keep    : load at startup and stay on the device (the default).
+        lazy    : load on first use and stay on the device.
+        offload : load on first use, move to CPU after idle_timeout seconds without use, move back on next use.
+        free    : load on first use, release after idle_timeout seconds without use, reload from disk on next use.
+
+    Use the model through `with resident.use() as model:`, a model in use is never offloaded.
+    '''
+    def __init__(self, name:str, loader:Callable[[], torch.nn.Module], device:torch.device,
+                 is_half:bool=False, policy:str="keep", idle_timeout:float=300.0):
+        if policy not in POLICIES:
+            raise ValueError(f"residency policy {policy} of {name} is not supported, supported: {POLICIES}")
+        self.name = name
+        self.loader = loader
+        self.device = device
+        self.is_half = is_half
+        self.policy = policy
+        self.idle_timeout = float(idle_timeout)
+
+        self.model:torch.nn.Module = None
+        self.state:str = "unloaded"    # unloaded | offloaded | resident
+        self.last_used:float = ttime()
+        self.loads:int = 0
+        self.offloads:int = 0
+        self.load_time:float = 0.0
+        self._in_use:int = 0
+        self._lock = threading.RLock()
+        # (name, path, device, is_half), set by SharedModelRegistry
+        self.shared_key:Tuple = None
+
+        if policy == "keep":
+            self.ensure_resident()
+
+    def _place(self, model:torch.nn.Module)->torch.nn.Module:
+        model = model.to(self.device)
+        if self.is_half and str(self.device) != "cpu":
+            model = model.half()
+        else:
+            model = model.float()
+        return model
+
+    def ensure_resident(self)->torch.nn.Module:
+        with self._lock:
+            if self.state == "resident":
+                return self.model
+            t0 = ttime()
+            if self.state == "unloaded":
+                print(f"Loading {self.name} ({self.policy}) to {self.device}")
+                self.model = self.loader().eval()
+                self.loads += 1
+            else:
+                print(f"Moving {self.name} back to {self.device}")
+            self.model = self._place(self.model)
+            self.state = "resident"
+            self.load_time = ttime() - t0
+            return self.model
+
+    @contextmanager
+    def use(self):
+        with self._lock:
+            model = self.ensure_resident()
+            self._in_use += 1
+        try:
+            yield model
+        finally:
+            with self._lock:
+                self._in_use -= 1
+                self.last_used = ttime()
+
+    def offload(self)->bool:
+        '''
+        Move the model to CPU (policy offload) or release it (policy free). Returns False if the model is in use.
+        '''
+        with self._lock:
+            if self._in_use > 0 or self.state == "unloaded":
+                return False
+            if self.policy == "free":
+                self.model = None
+                self.state = "unloaded"
+            elif self.state == "resident":
+                if str(self.device) == "cpu":
+                    return False
+                self.model = self.model.to("cpu")
+                self.state = "offloaded"
+            else:
+                return False
+            self.offloads += 1
+        print(f"{self.name} idle for {self.idle_seconds():.0f}s, {'released' if self.policy == 'free' else 'offloaded to cpu'}")
+        empty_cache(self.device)
+        return True
+
+    def release_if_idle(self, now:float=None)->bool:
+        if self.policy not in ("offload", "free"):
+            return False
+        now = ttime() if now is None else now
+        with self._lock:
+            if self._in_use > 0 or self.state == "unloaded" or now - self.last_used < self.idle_timeout:
+                return False
+            return self.offload()
+
+    def idle_seconds(self)->float:
+        return 0.0 if self._in_use > 0 else ttime() - self.last_used
+
+    def set_device(self, device:torch.device):
+        with self._lock:
+            self.device = device
+            if self.state == "resident":
+                self.model = self._place(self.model)
+
+    def set_half(self, is_half:bool):
+        with self._lock:
+            self.is_half = is_half
+            if self.state == "resident":
+                self.model = self._place(self.model)
+
+    def report(self)->Dict:
+        return {
+            "name": self.name,
+            "policy": self.policy,
+            "state": self.state,
+            "device": str(self.device) if self.state == "resident" else ("cpu" if self.state == "offloaded" else None),
+            "in_use": self._in_use,
+            "idle_seconds": round(self.idle_seconds(), 1),
+            "idle_timeout": self.idle_timeout,
+            "loads": self.loads,
+            "offloads": self.offloads,
+            "last_load_time": round(self.load_time, 3),
+        }
+
+
+class ResidencyManager:
+    '''
+    Offloads the idle auxiliary models from a background thread.
+    '''
+    def __init__(self):
+        self.models:Dict[str, ResidentModel] = {}
+        self._thread:threading.Thread = None
+        self._stop = threading.Event()
+
+    def register(self, resident:ResidentModel)->ResidentModel:
+        self.models[resident.name] = resident
+        if resident.policy in ("offload", "free"):
+            self._start()
+        return resident
+
+    def _interval(self)->float:
+        timeouts = [m.idle_timeout for m in self.models.values() if m.policy in ("offload", "free")]
+        return min(30.0, max(1.0, min(timeouts, default=30.0) / 4))
+
+    def _start(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="residency-manager", daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while not self._stop.wait(self._interval()):
+            self.release_idle()
+
+    def release_idle(self)->List[str]:
+        released = []
+        for name, resident in list(self.models.items()):
+            try:
+                if resident.release_if_idle():
+                    released.append(name)
+            except Exception as e:
+                print(f"failed to offload {name}: {e}")
+        return released
+
+    def stop(self):
+        self._stop.set()
+
+    def report(self)->List[Dict]:
+        return [resident.report() for resident in self.models.values()]
+
+
+class SharedModelRegistry:
+    '''
+    Process-wide registry of the auxiliary models (BERT, its tokenizer, CNHuBERT), keyed by
+    (name, path, device, half precision) and shared by reference between TTS instances, so
+    that several voices (several TTS_Config) on one card hold one copy of each frontend model.
+    Only the GPT and SoVITS weights stay per instance.
+
+    Every instance holding a model counts as one reference. Moving an instance to another
+    device or precision moves the model in place when the instance is its only holder, and
+    otherwise switches the instance to a copy for the new placement (made from the copy
+    already in memory), leaving the other holders untouched.
+    '''
+    def __init__(self):
+        self.models:Dict[Tuple, ResidentModel] = {}
+        self.refs:Dict[Tuple, int] = {}
+        self.tokenizers:Dict[str, object] = {}
+        self._lock = threading.RLock()
+
+    @staticmethod
+    def key(name:str, path:str, device, is_half:bool)->Tuple:
+        return (name, path, str(device), bool(is_half) and str(device) != "cpu")
+
+    def tokenizer(self, path:str, loader:Callable[[], object]):
+        with self._lock:
+            if path not in self.tokenizers:
+                self.tokenizers[path] = loader()
+            return self.tokenizers[path]
+
+    def acquire(self, name:str, path:str, loader:Callable[[], torch.nn.Module], device:torch.device,
+                is_half:bool=False, policy:str="keep", idle_timeout:float=300.0)->ResidentModel:
+        key = self.key(name, path, device, is_half)
+        with self._lock:
+            resident = self.models.get(key)
+            if resident is None:
+                resident = ResidentModel(name, loader, device, is_half, policy, idle_timeout)
+                resident.shared_key = key
+                self.models[key] = resident
+            elif resident.policy != policy:
+                print(f"{name} ({path}) is shared with residency {resident.policy}, ignoring {policy}")
+            self.refs[key] = self.refs.get(key, 0) + 1
+            return resident
+
+    def release(self, resident:ResidentModel)->None:
+        key = getattr(resident, "shared_key", None)
+        with self._lock:
+            if key not in self.refs:
+                return
+            self.refs[key] -= 1
+            if self.refs[key] > 0:
+                return
+            del self.refs[key]
+            del self.models[key]
+        with resident._lock:
+            resident.model = None
+            resident.state = "unloaded"
+        empty_cache(resident.device)
+
+    def move(self, resident:ResidentModel, device:torch.device=None, is_half:bool=None)->ResidentModel:
+        '''
+        Returns the model of the same name and path for the new device/precision, the caller's
+        reference moves from resident to the returned model.
+        '''
+        name, path, _, _ = resident.shared_key
+        device = resident.device if device is None else device
+        is_half = resident.is_half if is_half is None else is_half
+        key = self.key(name, path, device, is_half)
+        with self._lock:
+            if key == resident.shared_key:
+                # 仅精度不同但在CPU上时 key 相同, 同步保存的设置即可
+                resident.is_half = is_half
+                return resident
+            target = self.models.get(key)
+            if target is None and self.refs.get(resident.shared_key, 0) <= 1:
+                # 唯一持有者, 原地移动
+                self.refs.pop(resident.shared_key, None)
+                self.models.pop(resident.shared_key, None)
+                resident.set_device(device)
+                resident.set_half(is_half)
+                resident.shared_key = key
+                self.models[key] = resident
+                self.refs[key] = 1
+                return resident
+
+            if target is None:
+                def copy_loader():
+                    with resident._lock:
+                        if resident.model is not None:
+                            return deepcopy(resident.model)
+                    return resident.loader()
+                target = ResidentModel(name, copy_loader, device, is_half, resident.policy, resident.idle_timeout)
+                target.loader = resident.loader
+                target.shared_key = key
+                self.models[key] = target
+            self.refs[key] = self.refs.get(key, 0) + 1
+        self.release(resident)
+        return target
+
+    def report(self)->List[Dict]:
+        with self._lock:
+            return [dict(resident.report(), path=key[1], holders=self.refs.get(key, 0))
+                    for key, resident in self.models.items()]
+
+
+SHARED_MODELS = SharedModelRegistry()
+
+
+def _voice_modules(tts)->List[torch.nn.Module]:
+    return [m for m in (tts.t2s_model, tts.vits_model) if m is not None]
+
+
+def _module_tensors(module:torch.nn.Module)->List[torch.Tensor]:
+    return list(module.parameters()) + list(module.buffers())
+
+
+class _Voice:
+    def __init__(self, name:str, tts):
+        self.name = name
+        self.tts = tts
+        self.state:str = "resident"    # resident | host | loading | offloading
+        self.future:Future = None
+        self.in_use:int = 0
+        self.last_used:float = ttime()
+        self.nbytes:int = 0
+        self.loads:int = 0
+        self.offloads:int = 0
+        self.last_transfer_time:float = 0.0
+        self.transfer_time:float = 0.0
+        # id(module) -> (模块的弱引用, host 上的权重副本(pinned)), 权重不变时卸载只需切换引用, 不再拷贝
+        self.host_copies:Dict[int, Tuple[weakref.ref, List[torch.Tensor]]] = {}
+
+    def measure(self)->int:
+        self.nbytes = sum(t.numel() * t.element_size()
+                          for m in _voice_modules(self.tts) for t in _module_tensors(m))
+        return self.nbytes
+
+    def host_copy(self, module:torch.nn.Module)->Optional[List[torch.Tensor]]:
+        # 模块被释放后 id 可能分配给新加载的模块, 必须是同一个对象
+        entry = self.host_copies.get(id(module))
+        if entry is None or entry[0]() is not module:
+            return None
+        return entry[1]
+
+    def set_host_copy(self, module:torch.nn.Module, copies:List[torch.Tensor]):
+        self.host_copies[id(module)] = (weakref.ref(module), copies)
+
+    def prune_host_copies(self):
+        # 丢弃已被替换(init_t2s_weights/init_vits_weights)的模块的副本
+        modules = {id(m): m for m in _voice_modules(self.tts)}
+        self.host_copies = {key: entry for key, entry in self.host_copies.items()
+                            if entry[0]() is not None and entry[0]() is modules.get(key)}
+
+
+class VoiceResidencyManager:
+    '''
+    Keeps the per-voice weights (GPT and SoVITS of each TTS instance) of the most recently
+    used voices on their device within budget_mb, and moves the least recently used idle
+    voices to pinned host memory on a background transfer thread. The shared auxiliary
+    models (see SharedModelRegistry) are not managed here and stay on the device.
+
+    Use a voice through `with manager.use(name, tts):`, which waits for the voice to be
+    resident and protects it from eviction; call prefetch when a request is admitted so the
+    transfer overlaps with the queueing. Voices on CPU are never moved.
+
+    The host copy of a voice is kept while it is resident, so evicting a voice whose weights
+    did not change only swaps tensor references, and loading it back is one pinned,
+    non-blocking host to device copy.
+    '''
+    def __init__(self, budget_mb:float=0):
+        self.budget_mb = float(budget_mb)
+        self.voices:OrderedDict = OrderedDict()
+        self._lock = threading.RLock()
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="voice-transfer")
+
+    @staticmethod
+    def _device(tts)->str:
+        return str(tts.configs.device)
+
+    def _on_cpu(self, tts)->bool:
+        return self._device(tts) == "cpu" or not torch.cuda.is_available()
+
+    def _voice(self, name:str, tts)->_Voice:
+        voice = self.voices.get(name)
+        if voice is None or voice.tts is not tts:
+            voice = _Voice(name, tts)
+            voice.measure()
+            self.voices[name] = voice
+        return voice
+
+    def resident_bytes(self)->int:
+        return sum(v.nbytes for v in self.voices.values() if v.state in ("resident", "loading"))
+
+    def remove(self, name:str, tts):
+        '''
+        Forget the voice (e.g. its TTS instance was closed), unless name now belongs to another instance.
+        '''
+        with self._lock:
+            voice = self.voices.get(name)
+            if voice is not None and voice.tts is tts:
+                self.voices.pop(name)
+
+    def prefetch(self, name:str, tts)->Future:
+        '''
+        Start moving the voice to its device, returns a future resolved when it is resident.
+        '''
+        with self._lock:
+            voice = self._voice(name, tts)
+            self.voices.move_to_end(name)
+            if self._on_cpu(tts) or voice.state == "resident":
+                done = Future()
+                done.set_result(voice)
+                return done
+            if voice.state == "loading":
+                return voice.future
+            # host 或 offloading(排在卸载之后, 传输线程按顺序执行)
+            voice.state = "loading"
+            self._make_room(voice)
+            voice.future = self._executor.submit(self._load, voice)
+            return voice.future
+
+    @contextmanager
+    def use(self, name:str, tts):
+        with self._lock:
+            voice = self._voice(name, tts)
+            voice.in_use += 1
+        try:
+            self.prefetch(name, tts).result()
+            yield tts
+        finally:
+            with self._lock:
+                voice.in_use -= 1
+                voice.last_used = ttime()
+                # 权重可能在使用中被替换(init_t2s_weights/init_vits_weights)
+                if voice.state == "resident":
+                    voice.measure()
+                    voice.prune_host_copies()
+                self._make_room(None)
+
+    def _make_room(self, incoming:_Voice):
+        # 预算内保留最近使用的声音, 从最久未用且空闲的声音开始卸载
+        if self.budget_mb <= 0:
+            return
+        budget = self.budget_mb * 1024 * 1024
+        for voice in list(self.voices.values()):
+            if self.resident_bytes() <= budget:
+                return
+            if voice is incoming or voice.in_use > 0 or voice.state != "resident" or self._on_cpu(voice.tts):
+                continue
+            voice.state = "offloading"
+            voice.future = self._executor.submit(self._offload, voice)
+        if self.resident_bytes() > budget:
+            print(f"voice residency: {self.resident_bytes() / 1024 / 1024:.0f}MB in use exceeds the budget of {self.budget_mb:.0f}MB")
+
+    def _offload(self, voice:_Voice):
+        t0 = ttime()
+        with self._lock:
+            if voice.state != "offloading":
+                return voice
+        try:
+            voice.prune_host_copies()
+            for module in _voice_modules(voice.tts):
+                tensors = _module_tensors(module)
+                copies = voice.host_copy(module)
+                if copies is None or len(copies) != len(tensors) or \
+                    any(c.shape != t.shape or c.dtype != t.dtype for c, t in zip(copies, tensors)):
+                    copies = [t.data.to("cpu").pin_memory() for t in tensors]
+                for t, c in zip(tensors, copies):
+                    t.data = c
+                voice.set_host_copy(module, copies)
+            empty_cache(voice.tts.configs.device)
+        finally:
+            with self._lock:
+                voice.state = "host"
+                voice.offloads += 1
+                voice.last_transfer_time = ttime() - t0
+                voice.transfer_time += voice.last_transfer_time
+        print(f"voice {voice.name} offloaded to host in {voice.last_transfer_time * 1000:.0f}ms")
+        return voice
+
+    def _load(self, voice:_Voice):
+        t0 = ttime()
+        device = voice.tts.configs.device
+        try:
+            stream = torch.cuda.Stream(device=device)
+            with torch.cuda.stream(stream):
+                for module in _voice_modules(voice.tts):
+                    tensors = _module_tensors(module)
+                    if any(t.device.type != "cpu" for t in tensors):
+                        # 卸载尚未执行就被取消, 权重仍在设备上
+                        continue
+                    voice.set_host_copy(module, [t.data for t in tensors])
+                    for t in tensors:
+                        t.data = t.data.to(device, non_blocking=True)
+            stream.synchronize()
+        except BaseException:
+            with self._lock:
+                voice.state = "host"
+            raise
+        with self._lock:
+            voice.state = "resident"
+            voice.loads += 1
+            voice.last_transfer_time = ttime() - t0
+            voice.transfer_time += voice.last_transfer_time
+        print(f"voice {voice.name} loaded to {device} in {voice.last_transfer_time * 1000:.0f}ms")
+        return voice
+
+    def report(self)->Dict:
+        with self._lock:
+            return {
+                "budget_mb": self.budget_mb,
+                "resident_mb": round(self.resident_bytes() / 1024 / 1024, 2),
+                "voices": [{
+                    "name": v.name,
+                    "state": "resident" if self._on_cpu(v.tts) else v.state,
+                    "device": self._device(v.tts) if v.state in ("resident", "offloading") else "cpu",
+                    "mb": round(v.nbytes / 1024 / 1024, 2),
+                    "in_use": v.in_use,
+                    "idle_seconds": round(0.0 if v.in_use else ttime() - v.last_used, 1),
+                    "loads": v.loads,
+                    "offloads": v.offloads,
+                    "last_transfer_ms": round(v.last_transfer_time * 1000, 1),
+                    "transfer_time": round(v.transfer_time, 3),
+                } for v in reversed(self.voices.values())],
+            }
@@ -0,0 +1,157 @@
+import functools
+import os
+import threading
+from time import strftime, time as ttime
+from typing import Dict, Optional
+
+import torch
+from torch.profiler import ProfilerActivity, record_function
+
+
+def profiled(name:str):
+    '''
+    Labels every call of the decorated function as name in torch.profiler traces.
+    (A record_function instance used directly as a decorator is shared by all calls and
+    is not safe with several inference threads.)
+    '''
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with record_function(name):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def _experimental_config():
+    # 新版 torch 可以记录所有线程(包括前端 G2P/BERT 线程), 旧版只记录启动 profiler 的推理线程
+    try:
+        return torch._C._profiler._ExperimentalConfig(profile_all_threads=True)
+    except (AttributeError, TypeError):
+        return None
+
+
+class ProfilerCapture:
+    '''
+    One torch.profiler capture of an inference worker, for the next `requests` jobs or the next
+    `seconds` seconds, whichever comes first (0 to not limit by that). torch.profiler only records
+    the thread it was started on, so start() and stop() are called on the worker thread by
+    TTSRequestScheduler.
+
+    stop() writes to output_dir, prefixed with the worker name and the start time:
+        .trace.json   Chrome trace (chrome://tracing, Perfetto)
+        .ops.txt      operators sorted by self time
+        .stacks.txt   operators grouped by their Python call stack
+        .folded       collapsed stacks for flamegraph.pl / speedscope
+    '''
+    def __init__(self, output_dir:str, name:str, requests:int=0, seconds:float=0,
+                 with_stack:bool=True, record_shapes:bool=False):
+        if requests <= 0 and seconds <= 0:
+            raise ValueError("requests or seconds must be positive")
+        self.output_dir = output_dir
+        self.name = name
+        self.requests = int(requests)
+        self.seconds = float(seconds)
+        self.with_stack = with_stack
+        self.record_shapes = record_shapes
+
+        self.state:str = "armed"  # armed | running | stopping | done | failed
+        self.done_requests:int = 0
+        self.started:float = None
+        self.stopped:float = None
+        self.files:Dict[str, str] = {}
+        self.error:str = None
+        self._profiler = None
+        self._lock = threading.Lock()
+
+    @property
+    def running(self)->bool:
+        return self.state == "running"
+
+    def start(self):
+        activities = [ProfilerActivity.CPU]
+        if torch.cuda.is_available():
+            activities.append(ProfilerActivity.CUDA)
+        kwargs = {}
+        config = _experimental_config()
+        if config is not None:
+            kwargs["experimental_config"] = config
+        try:
+            self._profiler = torch.profiler.profile(activities=activities,
+                                                    record_shapes=self.record_shapes,
+                                                    with_stack=self.with_stack,
+                                                    **kwargs)
+            self._profiler.start()
+        except Exception as e:
+            self.error = str(e)
+            self.state = "failed"
+            self._profiler = None
+            raise
+        self.started = ttime()
+        self.state = "running"
+        print(f"profiler: capturing {self.name} for {self.requests or '-'} requests / {self.seconds or '-'} seconds")
+
+    def job_done(self, requests:int=1):
+        self.done_requests += requests
+
+    def remaining(self)->Optional[float]:
+        '''
+        Seconds until the capture is due by time, None when it is not limited by time.
+        '''
+        if not self.running or self.seconds <= 0:
+            return None
+        return max(0.0, self.started + self.seconds - ttime())
+
+    def due(self)->bool:
+        if not self.running:
+            return False
+        if self.requests > 0 and self.done_requests >= self.requests:
+            return True
+        return self.seconds > 0 and ttime() - self.started >= self.seconds
+
+    def stop(self):
+        with self._lock:
+            if not self.running:
+                return
+            self.state = "stopping"
+        try:
+            self._profiler.stop()
+            self.stopped = ttime()
+            self._export()
+            self.state = "done"
+            print(f"profiler: {self.name} capture written to {self.output_dir}")
+        except Exception as e:
+            self.error = str(e)
+            self.state = "failed"
+            print(f"profiler: {self.name} capture failed: {e}")
+        finally:
+            self._profiler = None
+
+    def _export(self):
+        os.makedirs(self.output_dir, exist_ok=True)
+        prefix = os.path.join(self.output_dir, f"{self.name}-{strftime('%Y%m%d-%H%M%S')}")
+        sort_by = "self_cuda_time_total" if torch.cuda.is_available() else "self_cpu_time_total"
+
+        self.files["trace"] = f"{prefix}.trace.json"
+        self._profiler.export_chrome_trace(self.files["trace"])
+        self.files["ops"] = f"{prefix}.ops.txt"
+        with open(self.files["ops"], "w", encoding="utf-8") as f:
+            f.write(self._profiler.key_averages().table(sort_by=sort_by, row_limit=100))
+        if self.with_stack:
+            self.files["stacks"] = f"{prefix}.stacks.txt"
+            with open(self.files["stacks"], "w", encoding="utf-8") as f:
+                f.write(self._profiler.key_averages(group_by_stack_n=8).table(sort_by=sort_by, row_limit=100))
+            self.files["folded"] = f"{prefix}.folded"
+            self._profiler.export_stacks(self.files["folded"], sort_by)
+
+    def report(self)->Dict:
+        return {
+            "name": self.name,
+            "state": self.state,
+            "requests": self.requests,
+            "seconds": self.seconds,
+            "done_requests": self.done_requests,
+            "elapsed": round((self.stopped or ttime()) - self.started, 3) if self.started else 0.0,
+            "files": self.files,
+            "error": self.error,
+        }
@@ -0,0 +1,173 @@
+import threading
+from collections import OrderedDict
+from typing import Callable, Dict, Hashable, List
+
+import torch
+
+from TTS_infer_pack.model_residency import empty_cache
+
+
+def _tensors(value)->List[torch.Tensor]:
+    if isinstance(value, torch.Tensor):
+        return [value]
+    if isinstance(value, dict):
+        return [t for v in value.values() for t in _tensors(v)]
+    if isinstance(value, (list, tuple)):
+        return [t for v in value for t in _tensors(v)]
+    return []
+
+
+def _move(value, device):
+    if isinstance(value, torch.Tensor):
+        return value.to(device)
+    if isinstance(value, dict):
+        return {k: _move(v, device) for k, v in value.items()}
+    if isinstance(value, list):
+        return [_move(v, device) for v in value]
+    return value
+
+
+def _unique_bytes(entries)->int:
+    # 不同条目可能共享同一参考音频的张量, 按张量去重统计
+    seen = {}
+    for entry in entries:
+        for t in _tensors(entry):
+            seen[id(t)] = t.numel() * t.element_size()
+    return sum(seen.values())
+
+
+class PromptCache:
+    '''
+    LRU of prompt entries: the reference audio features (prompt_semantic, refer_spec)
+    and the prompt text features (phones, bert_features) of one (reference, prompt text) pair.
+
+    The most recently used entries stay on the inference device within device_budget_mb,
+    older ones are moved to host memory within host_budget_mb, beyond that (or beyond
+    max_entries) the least recently used entries are dropped. An entry is moved back to
+    the device when it is used again. On a CPU device every entry counts against host_budget_mb.
+    '''
+    def __init__(self, max_entries:int=32, device_budget_mb:float=256, host_budget_mb:float=1024):
+        self.max_entries = int(max_entries)
+        self.device_budget_mb = float(device_budget_mb)
+        self.host_budget_mb = float(host_budget_mb)
+
+        self.entries:OrderedDict = OrderedDict()
+        self.on_host:set = set()
+        self.hits:int = 0
+        self.partial_hits:int = 0
+        self.misses:int = 0
+        self.evictions:int = 0
+        self.offloads:int = 0
+        self.restores:int = 0
+        self._lock = threading.RLock()
+
+    def _restore(self, key:Hashable, device)->dict:
+        entry = self.entries[key]
+        if key in self.on_host and str(device) != "cpu":
+            entry = _move(entry, device)
+            self.entries[key] = entry
+            self.on_host.discard(key)
+            self.restores += 1
+        self.entries.move_to_end(key)
+        return entry
+
+    def __contains__(self, key:Hashable)->bool:
+        return key in self.entries
+
+    def get(self, key:Hashable, device)->dict:
+        '''
+        Returns the entry of key on device, or None (counted as a miss).
+        '''
+        with self._lock:
+            if key not in self.entries:
+                self.misses += 1
+                return None
+            self.hits += 1
+            return self._restore(key, device)
+
+    def find(self, predicate:Callable[[Hashable], bool], device)->dict:
+        '''
+        The most recently used entry whose key satisfies predicate, used to reuse
+        the reference or the prompt text part of an entry on a miss.
+        '''
+        with self._lock:
+            for key in reversed(self.entries):
+                if predicate(key):
+                    self.partial_hits += 1
+                    return self._restore(key, device)
+            return None
+
+    def put(self, key:Hashable, entry:dict, device)->dict:
+        with self._lock:
+            self.entries[key] = entry
+            self.entries.move_to_end(key)
+            self.on_host.discard(key)
+            if str(device) == "cpu":
+                self.on_host.add(key)
+            self._enforce_budgets(device)
+            return entry
+
+    def _enforce_budgets(self, device):
+        released = False
+        while len(self.entries) > max(1, self.max_entries):
+            self._evict(next(iter(self.entries)))
+            released = True
+
+        # 显存超出预算时, 把最久未用的条目移到内存, 最近使用的条目始终留在显存
+        on_device = [key for key in self.entries if key not in self.on_host]
+        while len(on_device) > 1 and \
+            _unique_bytes(self.entries[key] for key in on_device) > self.device_budget_mb * 1024 * 1024:
+            key = on_device.pop(0)
+            self.entries[key] = _move(self.entries[key], "cpu")
+            self.on_host.add(key)
+            self.offloads += 1
+            released = True
+
+        # 内存超出预算时丢弃最久未用的条目, 刚放入/取出的条目不丢弃
+        last = next(reversed(self.entries))
+        on_host = [key for key in self.entries if key in self.on_host]
+        while len(on_host) > 0 and on_host[0] != last and \
+            _unique_bytes(self.entries[key] for key in on_host) > self.host_budget_mb * 1024 * 1024:
+            self._evict(on_host.pop(0))
+
+        if released and str(device) != "cpu":
+            empty_cache(device)
+
+    def _evict(self, key:Hashable):
+        self.entries.pop(key)
+        self.on_host.discard(key)
+        self.evictions += 1
+
+    def discard(self, predicate:Callable[[Hashable], bool]):
+        '''
+        Drops the entries whose key satisfies predicate, without counting them as evictions.
+        '''
+        with self._lock:
+            for key in [key for key in self.entries if predicate(key)]:
+                self.entries.pop(key)
+                self.on_host.discard(key)
+
+    def clear(self):
+        with self._lock:
+            self.entries.clear()
+            self.on_host.clear()
+
+    def report(self)->Dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self.entries),
+                "entries_on_host": len(self.on_host),
+                "max_entries": self.max_entries,
+                "device_mb": round(_unique_bytes(v for k, v in self.entries.items() if k not in self.on_host) / 1024 / 1024, 2),
+                "device_budget_mb": self.device_budget_mb,
+                "host_mb": round(_unique_bytes(v for k, v in self.entries.items() if k in self.on_host) / 1024 / 1024, 2),
+                "host_budget_mb": self.host_budget_mb,
+                "hits": self.hits,
+                "misses": self.misses,
+                "partial_hits": self.partial_hits,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+                "evictions": self.evictions,
+                "offloads": self.offloads,
+                "restores": self.restores,
+            }
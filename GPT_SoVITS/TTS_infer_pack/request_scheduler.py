@@ -0,0 +1,361 @@
+import asyncio
+import os
+import queue
+import threading
+import traceback
+from collections import deque
+from concurrent.futures import Future
+from time import time as ttime
+from typing import AsyncIterator, Callable, Dict, Iterator, List
+
+from TTS_infer_pack.metrics import BATCH_SIZE
+
+_STREAM_END = object()
+
+
+class QueueFullError(RuntimeError):
+    pass
+
+
+def parse_cpu_list(spec:str)->List[int]:
+    '''
+    "0-3,8,10-11" -> [0, 1, 2, 3, 8, 10, 11]
+    '''
+    cpus = []
+    for part in (spec or "").split(","):
+        part = part.strip()
+        if part == "":
+            continue
+        if "-" in part:
+            start, end = part.split("-", 1)
+            cpus.extend(range(int(start), int(end) + 1))
+        else:
+            cpus.append(int(part))
+    return cpus
+
+
+class _Job:
+    def __init__(self, kind:str, payload, key=None, sink:Callable=None):
+        self.kind = kind          # batch | stream | call
+        self.payload = payload
+        self.key = key
+        self.future = Future()
+        # stream: 每个分段及结束标记/异常都交给 sink, 由调用方所在线程或事件循环接收
+        self.sink = sink
+        self.cancelled = False
+        self.submitted = ttime()
+
+
+class TTSRequestScheduler:
+    '''
+    Owns one TTS pipeline and runs every request on a single worker thread, so that
+    concurrent requests no longer race on the pipeline state (prompt_cache, stop_flag)
+    and the event loop of the server is never blocked by inference.
+
+    Non-streaming requests that wait in the queue together and have the same
+    TTS.batch_key (same reference, prompt, text language and sampling parameters)
+    are merged into one TTS.run_batch call: their sentences share the T2S and VITS
+    batches and each request gets back its own audio. Streaming requests and
+    requests with a fixed seed run alone through TTS.run.
+
+    Args:
+        tts: the TTS pipeline, None for a plain worker that only runs call/stream jobs.
+        max_batch_requests: max number of requests merged into one run_batch call.
+        max_wait_ms: how long the worker waits for more requests to merge with the first one.
+        max_queue: max number of waiting jobs, 0 for unbounded. Submitting to a full queue raises QueueFullError.
+        cpu_affinity: cpu ids the worker thread is pinned to (Linux only), None to leave it unpinned.
+        name: name of the worker thread.
+    '''
+    def __init__(self, tts=None, max_batch_requests:int=8, max_wait_ms:float=20,
+                 max_queue:int=0, cpu_affinity:List[int]=None, name:str="tts-scheduler"):
+        self.tts = tts
+        self.max_batch_requests = max(1, int(max_batch_requests))
+        self.max_wait = max(0.0, float(max_wait_ms)) / 1000
+        self.max_queue = max(0, int(max_queue))
+        self.cpu_affinity = list(cpu_affinity) if cpu_affinity else None
+        self.name = name
+
+        self._queue:queue.Queue = queue.Queue()
+        self._pending:deque = deque()
+        self._stop = threading.Event()
+        self._closed:bool = False
+        self._put_lock = threading.Lock()
+        self.busy:bool = False
+        self.requests:int = 0
+        self.batches:int = 0
+        self.merged_requests:int = 0
+        self.rejected:int = 0
+        # 正在进行或最近一次的 profiler 采集, 只能在工作线程中开始和结束
+        self.capture = None
+        self._thread = threading.Thread(target=self._run, name=name, daemon=True)
+        self._thread.start()
+
+    def queued(self)->int:
+        return self._queue.qsize() + len(self._pending)
+
+    def load(self)->int:
+        return self.queued() + int(self.busy)
+
+    def _put(self, job:_Job)->_Job:
+        with self._put_lock:
+            if self._closed:
+                raise QueueFullError(f"{self.name}: stopped")
+            if self.max_queue > 0 and self.queued() >= self.max_queue:
+                self.rejected += 1
+                raise QueueFullError(f"{self.name}: too many queued requests ({self.max_queue})")
+            self._queue.put(job)
+            return job
+
+    def submit(self, req:dict)->Future:
+        '''
+        Queue a non-streaming request, the future resolves to (sampling rate, audio data).
+        '''
+        return self._put(_Job("batch", req, self.tts.batch_key(req))).future
+
+    def call(self, fn:Callable, *args, **kwargs)->Future:
+        '''
+        Run fn(*args, **kwargs) on the worker thread between requests, e.g. set_ref_audio or init_t2s_weights.
+        '''
+        return self._put(_Job("call", (fn, args, kwargs))).future
+
+    def stream(self, fn:Callable, *args, **kwargs)->Iterator:
+        '''
+        Run the generator fn(*args, **kwargs) on the worker thread, returns an iterator over its items.
+        '''
+        chunks = queue.Queue()
+        job = self._put(_Job("stream", (fn, args, kwargs), sink=chunks.put))
+
+        def items():
+            try:
+                while True:
+                    item = chunks.get()
+                    if item is _STREAM_END:
+                        break
+                    if isinstance(item, BaseException):
+                        raise item
+                    yield item
+            finally:
+                job.cancelled = True
+        return items()
+
+    def submit_stream(self, req:dict)->Iterator:
+        '''
+        Queue a streaming request (return_fragment), returns an iterator over the
+        (sampling rate, audio fragment) chunks produced by TTS.run.
+        '''
+        return self.stream(self.tts.run, req)
+
+    async def run_async(self, req:dict):
+        return await asyncio.wrap_future(self.submit(req))
+
+    async def call_async(self, fn:Callable, *args, **kwargs):
+        return await asyncio.wrap_future(self.call(fn, *args, **kwargs))
+
+    def stream_async(self, fn:Callable, *args, **kwargs)->AsyncIterator:
+        '''
+        Same as stream, the items are handed to the event loop without blocking it.
+        Must be called from the event loop; the job is queued right away, so QueueFullError
+        is raised here rather than on the first iteration. Closing the iterator
+        (e.g. the client disconnected) stops the generator on the worker.
+        '''
+        loop = asyncio.get_running_loop()
+        chunks = asyncio.Queue()
+
+        def sink(item):
+            try:
+                loop.call_soon_threadsafe(chunks.put_nowait, item)
+            except RuntimeError:
+                # 事件循环已关闭
+                job.cancelled = True
+        job = self._put(_Job("stream", (fn, args, kwargs), sink=sink))
+
+        async def items():
+            try:
+                while True:
+                    item = await chunks.get()
+                    if item is _STREAM_END:
+                        break
+                    if isinstance(item, BaseException):
+                        raise item
+                    yield item
+            finally:
+                job.cancelled = True
+        return items()
+
+    def submit_stream_async(self, req:dict)->AsyncIterator:
+        return self.stream_async(self.tts.run, req)
+
+    def start_capture(self, capture)->Future:
+        '''
+        Start a profiler_capture.ProfilerCapture on the worker thread. Every job after it counts as
+        one request; the worker stops the capture and writes its files once it is due.
+        '''
+        if self.capture is not None and self.capture.state in ("armed", "running", "stopping"):
+            raise RuntimeError(f"{self.name}: a profiler capture is already in progress")
+        self.capture = capture
+        return self.call(capture.start)
+
+    def _check_capture(self, jobs:List[_Job]):
+        capture = self.capture
+        if capture is None or not capture.running:
+            return
+        if not (len(jobs) == 1 and jobs[0].kind == "call" and jobs[0].payload[0] == capture.start):
+            capture.job_done(len(jobs))
+        if capture.due():
+            capture.stop()
+
+    def stop(self, on_stopped:Callable=None)->Future:
+        '''
+        Stop accepting jobs (submitting raises QueueFullError). The worker finishes the queued jobs,
+        then runs on_stopped (e.g. releasing the models) and exits; the returned future resolves after on_stopped.
+        '''
+        with self._put_lock:
+            if self._closed:
+                raise RuntimeError(f"{self.name}: already stopped")
+            self._closed = True
+            job = _Job("call", (on_stopped or (lambda: None), (), {}))
+            self._queue.put(job)
+            self._queue.put(None)
+            return job.future
+
+    def report(self)->Dict:
+        return {
+            "name": self.name,
+            "queued": self.queued(),
+            "busy": self.busy,
+            "requests": self.requests,
+            "batches": self.batches,
+            "merged_requests": self.merged_requests,
+            "rejected": self.rejected,
+            "max_batch_requests": self.max_batch_requests,
+            "max_wait_ms": self.max_wait * 1000,
+            "max_queue": self.max_queue,
+            "cpu_affinity": self.cpu_affinity,
+            "capture": self.capture.report() if self.capture is not None else None,
+        }
+
+    def _next_jobs(self)->List[_Job]:
+        # 取最早的请求, 再在等待窗口内收集可与之合并的请求, 其余请求按到达顺序留待下一轮
+        if len(self._pending) == 0:
+            # 按时间结束的 profiler 采集在空闲时也要按时停止
+            timeout = self.capture.remaining() if self.capture is not None else None
+            try:
+                job = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                return []
+            if job is None:
+                self._stop.set()
+                return []
+            self._pending.append(job)
+        first = self._pending[0]
+        if first.kind != "batch" or first.key is None:
+            return self._claim([self._pending.popleft()])
+
+        deadline = first.submitted + self.max_wait
+        while True:
+            group = [job for job in self._pending if job.kind == "batch" and job.key == first.key]
+            if len(group) >= self.max_batch_requests:
+                break
+            timeout = deadline - ttime()
+            try:
+                job = self._queue.get(timeout=timeout) if timeout > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if job is None:
+                self._stop.set()
+                break
+            self._pending.append(job)
+
+        group = group[:self.max_batch_requests]
+        for job in group:
+            self._pending.remove(job)
+        return self._claim(group)
+
+    @staticmethod
+    def _claim(jobs:List[_Job])->List[_Job]:
+        # 调用方已取消(如客户端断开)的请求不再执行; 其余的 future 标记为运行中, 之后不会再被取消
+        return [job for job in jobs if job.future.set_running_or_notify_cancel()]
+
+    def _run(self):
+        if self.cpu_affinity and hasattr(os, "sched_setaffinity"):
+            try:
+                os.sched_setaffinity(threading.get_native_id(), self.cpu_affinity)
+            except OSError as e:
+                print(f"{self.name}: failed to set cpu affinity {self.cpu_affinity}: {e}")
+        # 收到结束标记后仍执行完已取出的任务
+        while not self._stop.is_set() or len(self._pending) > 0:
+            jobs = self._next_jobs()
+            if len(jobs) == 0:
+                self._check_capture(jobs)
+                continue
+            self.busy = True
+            try:
+                self._execute(jobs)
+            except BaseException as e:
+                traceback.print_exc()
+                for job in jobs:
+                    if job.kind == "stream":
+                        job.sink(e)
+                        job.sink(_STREAM_END)
+                    elif not job.future.done() and not job.future.cancelled():
+                        job.future.set_exception(e)
+            finally:
+                self.busy = False
+            self._check_capture(jobs)
+        if self.capture is not None:
+            self.capture.stop()
+
+    def _execute(self, jobs:List[_Job]):
+        job = jobs[0]
+        if job.kind == "call":
+            fn, args, kwargs = job.payload
+            result = fn(*args, **kwargs)
+            if not job.future.cancelled():
+                job.future.set_result(result)
+            return
+
+        self.requests += len(jobs)
+        self.batches += 1
+        BATCH_SIZE.observe(len(jobs), kind="requests")
+        if job.kind == "stream":
+            fn, args, kwargs = job.payload
+            generator = fn(*args, **kwargs)
+            try:
+                for item in generator:
+                    if job.cancelled:
+                        break
+                    job.sink(item)
+            finally:
+                generator.close()
+            job.sink(_STREAM_END)
+        elif len(jobs) == 1:
+            result = next(self.tts.run(job.payload))
+            if not job.future.cancelled():
+                job.future.set_result(result)
+        else:
+            self.merged_requests += len(jobs)
+            results = self.tts.run_batch([job.payload for job in jobs])
+            for job, result in zip(jobs, results):
+                if not job.future.cancelled():
+                    job.future.set_result(result)
+
+
+class SchedulerPool:
+    '''
+    Several schedulers (one per device, each with its own pipeline), a request goes to the least loaded one.
+    '''
+    def __init__(self, schedulers:List[TTSRequestScheduler]):
+        assert len(schedulers) > 0
+        self.schedulers = schedulers
+
+    def pick(self)->TTSRequestScheduler:
+        return min(self.schedulers, key=lambda scheduler: scheduler.load())
+
+    def broadcast(self, fn:Callable[[TTSRequestScheduler], Future])->List[Future]:
+        '''
+        Run a job on every scheduler, e.g. switching weights on all pipelines.
+        '''
+        return [fn(scheduler) for scheduler in self.schedulers]
+
+    def report(self)->List[Dict]:
+        return [scheduler.report() for scheduler in self.schedulers]
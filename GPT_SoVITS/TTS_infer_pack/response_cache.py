@@ -0,0 +1,157 @@
+import os
+import threading
+from collections import OrderedDict
+from typing import Dict
+
+
+class ResponseCache:
+    '''
+    Content-addressed cache of encoded responses, keyed by TTS.response_fingerprint
+    (all synthesis inputs, the reference audio content and the model weights) and the
+    media type, so only reproducible requests (a fixed seed) are cached and swapping the
+    weights can never return audio of the old models.
+
+    The memory tier is an LRU within memory_mb. With disk_dir set, every entry is also
+    written there (atomically) and the disk tier is an LRU within disk_mb that survives
+    restarts; a disk hit is promoted to memory.
+    '''
+    def __init__(self, memory_mb:float=64, disk_dir:str=None, disk_mb:float=1024):
+        self.memory_budget = int(float(memory_mb) * 1024 * 1024)
+        self.disk_dir = disk_dir or None
+        self.disk_budget = int(float(disk_mb) * 1024 * 1024)
+
+        self.memory:OrderedDict = OrderedDict()
+        self.memory_bytes:int = 0
+        # 文件名 -> 大小, 按最近使用排序
+        self.disk:OrderedDict = OrderedDict()
+        self.disk_bytes:int = 0
+        self.hits:int = 0
+        self.disk_hits:int = 0
+        self.misses:int = 0
+        self._lock = threading.Lock()
+        if self.disk_dir is not None:
+            self._scan_disk()
+
+    def _scan_disk(self):
+        os.makedirs(self.disk_dir, exist_ok=True)
+        files = []
+        for name in os.listdir(self.disk_dir):
+            path = os.path.join(self.disk_dir, name)
+            if name.endswith(".tmp"):
+                os.remove(path)
+                continue
+            stat = os.stat(path)
+            files.append((stat.st_mtime, name, stat.st_size))
+        for _, name, size in sorted(files):
+            self.disk[name] = size
+            self.disk_bytes += size
+        self._enforce_disk_budget()
+
+    @staticmethod
+    def _name(key:str, media_type:str)->str:
+        return f"{key}.{media_type}"
+
+    def get(self, key:str, media_type:str)->bytes:
+        if key is None:
+            return None
+        name = self._name(key, media_type)
+        with self._lock:
+            data = self.memory.get(name)
+            if data is not None:
+                self.memory.move_to_end(name)
+                self.hits += 1
+                return data
+            on_disk = name in self.disk
+        if on_disk:
+            try:
+                path = os.path.join(self.disk_dir, name)
+                with open(path, "rb") as f:
+                    data = f.read()
+                os.utime(path)
+            except OSError:
+                data = None
+            with self._lock:
+                if data is None:
+                    self._drop_disk(name)
+                else:
+                    self.disk.move_to_end(name)
+                    self.hits += 1
+                    self.disk_hits += 1
+                    self._put_memory(name, data)
+                    return data
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def put(self, key:str, media_type:str, data:bytes)->None:
+        if key is None:
+            return
+        name = self._name(key, media_type)
+        with self._lock:
+            self._put_memory(name, data)
+            write_disk = self.disk_dir is not None and name not in self.disk and len(data) <= self.disk_budget
+        if write_disk:
+            path = os.path.join(self.disk_dir, name)
+            tmp_path = f"{path}.{threading.get_ident()}.tmp"
+            try:
+                with open(tmp_path, "wb") as f:
+                    f.write(data)
+                os.replace(tmp_path, path)
+            except OSError as e:
+                print(f"response cache: failed to write {path}: {e}")
+                return
+            with self._lock:
+                if name not in self.disk:
+                    self.disk[name] = len(data)
+                    self.disk_bytes += len(data)
+                self._enforce_disk_budget()
+
+    def _put_memory(self, name:str, data:bytes):
+        if len(data) > self.memory_budget:
+            return
+        if name in self.memory:
+            self.memory_bytes -= len(self.memory.pop(name))
+        self.memory[name] = data
+        self.memory_bytes += len(data)
+        while self.memory_bytes > self.memory_budget:
+            _, evicted = self.memory.popitem(last=False)
+            self.memory_bytes -= len(evicted)
+
+    def _drop_disk(self, name:str):
+        size = self.disk.pop(name, None)
+        if size is not None:
+            self.disk_bytes -= size
+        try:
+            os.remove(os.path.join(self.disk_dir, name))
+        except OSError:
+            pass
+
+    def _enforce_disk_budget(self):
+        while self.disk_bytes > self.disk_budget and len(self.disk) > 0:
+            self._drop_disk(next(iter(self.disk)))
+
+    def clear_memory(self)->None:
+        '''
+        Drop the memory tier, e.g. after the weights were swapped: its entries belong to the old
+        models and can no longer be hit. Disk entries stay valid for when the weights are swapped back.
+        '''
+        with self._lock:
+            self.memory.clear()
+            self.memory_bytes = 0
+
+    def report(self)->Dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "memory_entries": len(self.memory),
+                "memory_mb": round(self.memory_bytes / 1024 / 1024, 2),
+                "memory_budget_mb": round(self.memory_budget / 1024 / 1024, 2),
+                "disk_dir": self.disk_dir,
+                "disk_entries": len(self.disk),
+                "disk_mb": round(self.disk_bytes / 1024 / 1024, 2),
+                "disk_budget_mb": round(self.disk_budget / 1024 / 1024, 2),
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            }
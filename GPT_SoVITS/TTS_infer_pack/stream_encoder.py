@@ -0,0 +1,270 @@
+import subprocess
+import threading
+import wave
+from io import BytesIO
+from math import gcd
+from typing import List
+
+import numpy as np
+import soundfile as sf
+
+MEDIA_TYPES = ("wav", "raw", "ogg", "opus", "mp3", "aac")
+
+CONTENT_TYPES = {
+    "wav": "audio/wav",
+    "raw": "audio/raw",
+    "ogg": "audio/ogg",
+    "opus": "audio/ogg",
+    "mp3": "audio/mpeg",
+    "aac": "audio/aac",
+}
+
+# opus 只支持这些采样率
+OPUS_SAMPLE_RATES = (8000, 12000, 16000, 24000, 48000)
+
+
+def content_type(media_type: str) -> str:
+    return CONTENT_TYPES.get(media_type, f"audio/{media_type}")
+
+
+class StreamEncoder:
+    '''
+    Encodes one response: every encode() call takes the next int16 pcm chunk and
+    returns the bytes of the bitstream that are ready, close() flushes the encoder
+    and returns the rest. The concatenation of all returned bytes is one valid file.
+    '''
+    def __init__(self, rate: int):
+        self.rate = rate
+        self.closed = False
+
+    def encode(self, data: np.ndarray) -> bytes:
+        raise NotImplementedError
+
+    def close(self) -> bytes:
+        self.closed = True
+        return b""
+
+    def abort(self):
+        # 客户端断开等情况, 丢弃未输出的数据
+        self.closed = True
+
+
+class RawEncoder(StreamEncoder):
+    def encode(self, data: np.ndarray) -> bytes:
+        return data.tobytes()
+
+
+class WavEncoder(RawEncoder):
+    '''
+    Streaming wav: a header with unknown length followed by raw pcm.
+    '''
+    def __init__(self, rate: int):
+        super().__init__(rate)
+        self.header_sent = False
+
+    def encode(self, data: np.ndarray) -> bytes:
+        chunk = data.tobytes()
+        if not self.header_sent:
+            self.header_sent = True
+            chunk = wave_header(self.rate) + chunk
+        return chunk
+
+
+def wave_header(rate: int, channels: int = 1, sample_width: int = 2) -> bytes:
+    wav_buf = BytesIO()
+    with wave.open(wav_buf, "wb") as vfout:
+        vfout.setnchannels(channels)
+        vfout.setsampwidth(sample_width)
+        vfout.setframerate(rate)
+        vfout.writeframes(b"")
+    return wav_buf.getvalue()
+
+
+class _Sink:
+    '''
+    Write-only file object for libsndfile that hands out the bytes written since the last
+    drain. Writes into bytes already handed out (header rewrites on close) are dropped.
+    '''
+    def __init__(self):
+        self.pending = bytearray()
+        self.drained = 0
+        self.pos = 0
+        self.dropped = 0
+
+    def write(self, data) -> int:
+        data = bytes(data)
+        end = self.drained + len(self.pending)
+        if self.pos < end:
+            self.dropped += len(data)
+        else:
+            self.pending += data
+        self.pos += len(data)
+        return len(data)
+
+    def seek(self, offset: int, whence: int = 0) -> int:
+        end = self.drained + len(self.pending)
+        self.pos = {0: offset, 1: self.pos + offset, 2: end + offset}[whence]
+        return self.pos
+
+    def tell(self) -> int:
+        return self.pos
+
+    def read(self, size: int = -1) -> bytes:
+        return b""
+
+    def drain(self) -> bytes:
+        data = bytes(self.pending)
+        self.drained += len(data)
+        self.pending.clear()
+        return data
+
+
+class SoundFileEncoder(StreamEncoder):
+    '''
+    In-process encoder (libsndfile): ogg/vorbis, ogg/opus and mp3. The ogg muxer emits
+    a page once it is full, so small chunks may only show up in a later encode() call.
+    '''
+    def __init__(self, rate: int, format: str, subtype: str, target_rate: int = None, **kwargs):
+        super().__init__(rate)
+        self.target_rate = target_rate or rate
+        self.sink = _Sink()
+        self.file = sf.SoundFile(self.sink, mode="w", samplerate=self.target_rate, channels=1,
+                                 format=format, subtype=subtype, **kwargs)
+
+    def _resample(self, data: np.ndarray) -> np.ndarray:
+        if self.target_rate == self.rate:
+            return data
+        from scipy.signal import resample_poly
+        g = gcd(self.rate, self.target_rate)
+        audio = resample_poly(data.astype(np.float32), self.target_rate // g, self.rate // g)
+        return np.clip(audio, -32768, 32767).astype(np.int16)
+
+    def encode(self, data: np.ndarray) -> bytes:
+        self.file.write(self._resample(data))
+        return self.sink.drain()
+
+    def close(self) -> bytes:
+        if not self.closed:
+            self.closed = True
+            self.file.close()
+        return self.sink.drain()
+
+    def abort(self):
+        if not self.closed:
+            self.closed = True
+            try:
+                self.file.close()
+            except Exception:
+                pass
+
+
+class FFmpegEncoder(StreamEncoder):
+    '''
+    One ffmpeg process for the whole response, pcm in through stdin, the encoded
+    stream collected from stdout by a reader thread.
+    '''
+    def __init__(self, rate: int, output_args: List[str]):
+        super().__init__(rate)
+        self.process = subprocess.Popen(
+            [
+                "ffmpeg",
+                "-loglevel", "error",
+                "-f", "s16le",  # 输入16位有符号小端整数PCM
+                "-ar", str(rate),
+                "-ac", "1",
+                "-i", "pipe:0",
+                "-vn",
+                *output_args,
+                "-flush_packets", "1",
+                "pipe:1",
+            ],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+        )
+        self._chunks: List[bytes] = []
+        self._lock = threading.Lock()
+        self._reader = threading.Thread(target=self._read, daemon=True)
+        self._reader.start()
+
+    def _read(self):
+        while True:
+            data = self.process.stdout.read1(65536)
+            if not data:
+                break
+            with self._lock:
+                self._chunks.append(data)
+
+    def _take(self) -> bytes:
+        with self._lock:
+            data = b"".join(self._chunks)
+            self._chunks.clear()
+        return data
+
+    def encode(self, data: np.ndarray) -> bytes:
+        self.process.stdin.write(data.tobytes())
+        self.process.stdin.flush()
+        return self._take()
+
+    def close(self) -> bytes:
+        if not self.closed:
+            self.closed = True
+            self.process.stdin.close()
+            self._reader.join()
+            self.process.wait()
+        return self._take()
+
+    def abort(self):
+        if not self.closed:
+            self.closed = True
+            self.process.kill()
+            self.process.wait()
+
+
+def _soundfile_supports(format: str, subtype: str) -> bool:
+    return format in sf.available_formats() and subtype in sf.available_subtypes(format)
+
+
+def open_stream_encoder(media_type: str, rate: int) -> StreamEncoder:
+    '''
+    Stateful encoder of one response, in-process when libsndfile supports the format,
+    otherwise a single ffmpeg process for the whole stream.
+    '''
+    if media_type == "wav":
+        return WavEncoder(rate)
+    if media_type == "raw":
+        return RawEncoder(rate)
+    if media_type == "ogg":
+        return SoundFileEncoder(rate, "OGG", "VORBIS")
+    if media_type == "opus":
+        target_rate = rate if rate in OPUS_SAMPLE_RATES else 48000
+        if _soundfile_supports("OGG", "OPUS"):
+            return SoundFileEncoder(rate, "OGG", "OPUS", target_rate=target_rate)
+        return FFmpegEncoder(rate, ["-c:a", "libopus", "-b:a", "32k", "-ar", str(target_rate), "-f", "ogg"])
+    if media_type == "mp3":
+        if _soundfile_supports("MP3", "MPEG_LAYER_III"):
+            try:
+                # 固定码率, 流式输出无法回写 VBR 的帧数信息
+                return SoundFileEncoder(rate, "MP3", "MPEG_LAYER_III", bitrate_mode="CONSTANT", compression_level=0.9)
+            except TypeError:
+                # soundfile < 0.12 不支持设置码率模式
+                pass
+        return FFmpegEncoder(rate, ["-c:a", "libmp3lame", "-b:a", "64k", "-f", "mp3"])
+    if media_type == "aac":
+        return FFmpegEncoder(rate, ["-c:a", "aac", "-b:a", "192k", "-f", "adts"])
+    raise ValueError(f"media_type: {media_type} is not supported, supported: {MEDIA_TYPES}")
+
+
+def encode_audio(data: np.ndarray, rate: int, media_type: str) -> bytes:
+    '''
+    Encodes a whole (non-streaming) response.
+    '''
+    if media_type == "wav":
+        io_buffer = BytesIO()
+        sf.write(io_buffer, data, rate, format="wav")
+        return io_buffer.getvalue()
+    encoder = open_stream_encoder(media_type, rate)
+    try:
+        return encoder.encode(data) + encoder.close()
+    finally:
+        encoder.abort()
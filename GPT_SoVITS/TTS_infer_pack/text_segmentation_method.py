@@ -166,6 +166,161 @@ def cut5(inp):
     return "\n".join(opt)
 
 
+# 按音素长度切
+# 切分后每段的(估计)音素数落在 [CUT6_MIN_PHONES, CUT6_MAX_PHONES] 区间内, 便于分桶时各批次长度一致;
+# 流式返回时第一段不超过 CUT6_FIRST_MAX_PHONES, 以尽快返回第一段音频
+CUT6_MIN_PHONES = 30
+CUT6_MAX_PHONES = 90
+CUT6_FIRST_MAX_PHONES = 20
+
+# 句末标点、句中标点
+strong_splits = {'。', '？', '！', '.', '?', '!', '…', '~'}
+weak_splits = {'，', ',', '、', ';', '；', ':', '：', '—'}
+# 在连词前切分
+conjunctions_zh = ["但是", "可是", "不过", "然而", "而且", "并且", "所以", "因此", "因为", "于是", "然后",
+                   "如果", "虽然", "或者", "还是", "以及", "同时"]
+conjunctions_en = ["and", "but", "or", "so", "because", "although", "while", "which", "however", "then"]
+RE_CONJUNCTION = re.compile(
+    "(?<=\\S)(?=" + "|".join(conjunctions_zh) + ")" +
+    "|\\s+(?=(?:" + "|".join(conjunctions_en) + ")\\b)", re.IGNORECASE)
+RE_SPACE = re.compile(r"\s+")
+
+# 各类切分点的代价, 合并时优先在代价低的位置断开
+BOUNDARY_COST = {"strong": 0.0, "weak": 1.0, "conjunction": 2.0, "space": 3.0, "hard": 6.0, "end": 0.0}
+
+
+def estimate_phones(text:str)->float:
+    """
+    不做G2P, 按字符类别粗略估计音素数: 汉字约2个(声母+韵母), 假名约1.5个, 谚文音节约2.5个,
+    拉丁字母约0.85个, 数字读出来较长约3个, 标点1个。
+    """
+    n = 0.0
+    for char in text:
+        code = ord(char)
+        if 0x4E00 <= code <= 0x9FFF or 0x3400 <= code <= 0x4DBF:
+            n += 2
+        elif 0x3040 <= code <= 0x30FF:
+            n += 1.5
+        elif 0xAC00 <= code <= 0xD7AF:
+            n += 2.5
+        elif char.isdigit():
+            n += 3
+        elif char.isalpha():
+            n += 0.85
+        elif not char.isspace():
+            n += 1
+    return n
+
+
+def _split_clauses(text:str)->list:
+    # 在标点后切分, 返回 [(片段, 切分点类型)], 数字中的小数点不切
+    clauses = []
+    start = 0
+    for i, char in enumerate(text):
+        if char not in strong_splits and char not in weak_splits:
+            continue
+        if char == '.' and 0 < i < len(text) - 1 and text[i - 1].isdigit() and text[i + 1].isdigit():
+            continue
+        if i + 1 < len(text) and (text[i + 1] in strong_splits or text[i + 1] in weak_splits):
+            continue
+        clauses.append((text[start:i + 1], "strong" if char in strong_splits else "weak"))
+        start = i + 1
+    if start < len(text):
+        clauses.append((text[start:], "end"))
+    return clauses
+
+
+def _split_long_clause(text:str, boundary:str, max_phones:float)->list:
+    # 把超过 max_phones 的片段依次尝试在连词前、空格处、字符间切成两半, 直到每段都不超过 max_phones
+    total = estimate_phones(text)
+    if total <= max_phones or len(text) < 2:
+        return [(text, boundary)]
+    tiers = [
+        ("conjunction", [m.end() for m in RE_CONJUNCTION.finditer(text)]),
+        ("space", [m.end() for m in RE_SPACE.finditer(text)]),
+        ("hard", [i for i in range(1, len(text)) if not (text[i - 1].isalnum() and text[i].isalnum() and ord(text[i]) < 0x3000)]
+                 or list(range(1, len(text)))),
+    ]
+    for kind, positions in tiers:
+        positions = [pos for pos in positions if 0 < pos < len(text)]
+        if len(positions) == 0:
+            continue
+        best = min(positions, key=lambda pos: abs(estimate_phones(text[:pos]) - total / 2))
+        left, right = text[:best], text[best:]
+        if kind != "hard" and min(estimate_phones(left), estimate_phones(right)) < max_phones * 0.2:
+            continue
+        return _split_long_clause(left, kind, max_phones) + _split_long_clause(right, boundary, max_phones)
+    return [(text, boundary)]
+
+
+def cut_by_phones(inp:str, min_phones:float=CUT6_MIN_PHONES, max_phones:float=CUT6_MAX_PHONES,
+                  first_max_phones:float=None)->list:
+    """
+    先在标点处切成小句, 过长的小句再在连词前/空格处/字符间切开, 然后用动态规划合并相邻片段:
+    每段尽量落在 [min_phones, max_phones] 区间内且长度接近, 并优先在句末标点处断开。
+    first_max_phones 不为 None 时(流式), 第一段不超过 first_max_phones。
+    """
+    pieces = []
+    for clause, boundary in _split_clauses(inp):
+        limit = max_phones
+        if first_max_phones is not None and len(pieces) == 0:
+            limit = first_max_phones
+        pieces.extend(_split_long_clause(clause, boundary, limit))
+    if len(pieces) == 0:
+        return []
+
+    lengths = [estimate_phones(text) for text, _ in pieces]
+    prefix = [0.0]
+    for length in lengths:
+        prefix.append(prefix[-1] + length)
+    target = (min_phones + max_phones) / 2
+
+    def segment_cost(start, end):
+        length = prefix[end] - prefix[start]
+        seg_max, seg_min = max_phones, min_phones
+        if start == 0 and first_max_phones is not None:
+            seg_max, seg_min = first_max_phones, min(min_phones, first_max_phones / 2)
+        if length > seg_max and end - start > 1:
+            return None
+        cost = BOUNDARY_COST[pieces[end - 1][1]] if end < len(pieces) else 0.0
+        if length < seg_min:
+            cost += 10.0 * (seg_min - length) / seg_min
+        if start > 0 or first_max_phones is None:
+            cost += ((length - target) / target) ** 2
+        return cost
+
+    n = len(pieces)
+    cost = [0.0] + [float("inf")] * n
+    start_of = [0] * (n + 1)
+    for end in range(1, n + 1):
+        for start in range(end - 1, -1, -1):
+            c = segment_cost(start, end)
+            if c is None:
+                break
+            if cost[start] + c < cost[end]:
+                cost[end] = cost[start] + c
+                start_of[end] = start
+
+    segments = []
+    end = n
+    while end > 0:
+        start = start_of[end]
+        segments.append("".join(text for text, _ in pieces[start:end]))
+        end = start
+    segments.reverse()
+    return [segment.strip() for segment in segments if segment.strip()]
+
+
+@register_method("cut6")
+def cut6(inp, streaming=False):
+    inp = inp.strip("\n")
+    opts = cut_by_phones(inp, first_max_phones=CUT6_FIRST_MAX_PHONES if streaming else None)
+    opts = [item for item in opts if not set(item).issubset(punctuation)]
+    return "\n".join(opts)
+
+cut6.supports_streaming = True
+
+
 
 if __name__ == '__main__':
     method = get_method("cut5")
@@ -0,0 +1,297 @@
+import json
+import os
+import threading
+from contextvars import ContextVar
+from time import time as ttime
+from typing import Dict, Generator, List, Optional, Tuple
+
+# 当前线程/任务中正在进行的 span, 新 span 默认挂在它下面
+_current_span:ContextVar = ContextVar("tts_current_span", default=None)
+
+
+def _attribute_value(value):
+    # OpenTelemetry 只接受 str/bool/int/float 及其列表
+    if isinstance(value, (str, bool, int, float)):
+        return value
+    if isinstance(value, (list, tuple)) and all(isinstance(v, (str, bool, int, float)) for v in value):
+        return list(value)
+    return str(value)
+
+
+class Span:
+    '''
+    One timed operation of a request. scope holds the request-scoped attributes (request id,
+    language, streaming, ...) that every child span inherits; attributes are its own.
+    Used as a context manager it becomes the parent of the spans started inside it.
+    '''
+    def __init__(self, tracer:"Tracer", name:str, trace_id:str, parent_id:Optional[str],
+                 scope:Dict, attributes:Dict, start_time:float=None):
+        self.tracer = tracer
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = os.urandom(8).hex()
+        self.parent_id = parent_id
+        self.scope = scope
+        self.attributes = attributes
+        self.start_time = ttime() if start_time is None else start_time
+        self.end_time:float = None
+        self.error:str = None
+        self._token = None
+
+    def set_attribute(self, key:str, value):
+        self.attributes[key] = value
+
+    def set_attributes(self, attributes:Dict):
+        self.attributes.update(attributes)
+
+    def all_attributes(self)->Dict:
+        return {key: _attribute_value(value) for key, value in {**self.scope, **self.attributes}.items() if value is not None}
+
+    def context(self)->Tuple[str, str]:
+        return self.trace_id, self.span_id
+
+    def end(self, end_time:float=None):
+        if self.end_time is None:
+            self.end_time = ttime() if end_time is None else end_time
+            self.tracer._on_end(self)
+
+    def __enter__(self)->"Span":
+        self._token = _current_span.set(self)
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        if exc_type is not None and exc_type is not GeneratorExit:
+            self.error = f"{exc_type.__name__}: {exc_value}"
+        self.end()
+        _current_span.reset(self._token)
+        return False
+
+    def to_dict(self)->Dict:
+        return {
+            "name": self.name,
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "start_time": self.start_time,
+            "end_time": self.end_time,
+            "duration_ms": round((self.end_time - self.start_time) * 1000, 3),
+            "attributes": self.all_attributes(),
+            "error": self.error,
+        }
+
+
+class _NoopSpan:
+    # 未启用追踪时的占位, 不记录任何东西
+    trace_id = span_id = parent_id = None
+
+    def set_attribute(self, key:str, value):
+        pass
+
+    def set_attributes(self, attributes:Dict):
+        pass
+
+    def context(self):
+        return None
+
+    def end(self, end_time:float=None):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        return False
+
+
+NOOP_SPAN = _NoopSpan()
+
+
+class JSONFileExporter:
+    '''
+    Appends every finished span to path as one JSON object per line.
+    '''
+    def __init__(self, path:str):
+        self.path = path
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        self._file = open(path, "a", encoding="utf-8")
+        self._lock = threading.Lock()
+
+    def on_start(self, span:Span):
+        pass
+
+    def on_end(self, span:Span):
+        line = json.dumps(span.to_dict(), ensure_ascii=False)
+        with self._lock:
+            self._file.write(line + "\n")
+            self._file.flush()
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+
+class OTelExporter:
+    '''
+    Mirrors the spans into OpenTelemetry through the globally configured tracer provider
+    (opentelemetry-sdk with an OTLP exporter, or opentelemetry-instrument), keeping the
+    parent/child structure, the timestamps and the attributes.
+    '''
+    def __init__(self, instrumentation_name:str="GPT_SoVITS.TTS_infer_pack"):
+        try:
+            from opentelemetry import trace
+        except ImportError as e:
+            raise ImportError("OTelExporter requires opentelemetry-api (pip install opentelemetry-api opentelemetry-sdk)") from e
+        self._trace = trace
+        self.tracer = trace.get_tracer(instrumentation_name)
+        # span_id -> 进行中的 OpenTelemetry span
+        self._spans:Dict[str, object] = {}
+        self._lock = threading.Lock()
+
+    def on_start(self, span:Span):
+        with self._lock:
+            parent = self._spans.get(span.parent_id)
+        context = self._trace.set_span_in_context(parent) if parent is not None else None
+        otel_span = self.tracer.start_span(span.name, context=context, start_time=int(span.start_time * 1e9))
+        with self._lock:
+            self._spans[span.span_id] = otel_span
+
+    def on_end(self, span:Span):
+        with self._lock:
+            otel_span = self._spans.pop(span.span_id, None)
+        if otel_span is None:
+            return
+        otel_span.set_attributes(span.all_attributes())
+        if span.error is not None:
+            from opentelemetry.trace import Status, StatusCode
+            otel_span.set_status(Status(StatusCode.ERROR, span.error))
+        otel_span.end(end_time=int(span.end_time * 1e9))
+
+    def close(self):
+        pass
+
+
+class Tracer:
+    '''
+    Optional per-request tracing. Without exporters every call returns a no-op span, so the
+    instrumented code costs next to nothing when tracing is off.
+
+    Spans started in another thread (e.g. the inference worker) are attached to a request with
+    parent=current_context() captured where the request came in.
+    '''
+    def __init__(self):
+        self.exporters:List = []
+
+    @property
+    def enabled(self)->bool:
+        return len(self.exporters) > 0
+
+    def add_exporter(self, exporter):
+        self.exporters.append(exporter)
+
+    def _new_span(self, name:str, parent:Optional[Tuple[str, str]], scope:Optional[Dict],
+                  attributes:Dict, start_time:float=None)->Span:
+        current = _current_span.get()
+        if parent is None and current is not None:
+            trace_id, parent_id = current.context()
+            inherited = current.scope
+        elif parent is not None:
+            trace_id, parent_id = parent
+            inherited = {}
+        else:
+            trace_id, parent_id = os.urandom(16).hex(), None
+            inherited = {}
+        span = Span(self, name, trace_id, parent_id, {**inherited, **(scope or {})}, attributes, start_time)
+        for exporter in self.exporters:
+            exporter.on_start(span)
+        return span
+
+    def _on_end(self, span:Span):
+        for exporter in self.exporters:
+            try:
+                exporter.on_end(span)
+            except Exception as e:
+                print(f"tracing: {type(exporter).__name__} failed to export {span.name}: {e}")
+
+    def span(self, name:str, parent:Tuple[str, str]=None, scope:Dict=None, **attributes):
+        '''
+        with tracer.span("tts.t2s", tokens=...) as span: ... starts a span under the current one
+        (or under parent), scope adds request-scoped attributes for it and its children.
+        '''
+        if not self.enabled:
+            return NOOP_SPAN
+        return self._new_span(name, parent, scope, attributes)
+
+    def record(self, name:str, start_time:float, end_time:float=None, parent:Tuple[str, str]=None,
+               scope:Dict=None, **attributes):
+        '''
+        Records an operation that has already finished (timestamps from time.time()).
+        '''
+        if not self.enabled:
+            return
+        self._new_span(name, parent, scope, attributes, start_time).end(end_time)
+
+    def current_context(self)->Optional[Tuple[str, str]]:
+        '''
+        (trace_id, span_id) of the current span, to be passed as parent to spans started in another thread.
+        '''
+        current = _current_span.get()
+        return current.context() if current is not None else None
+
+
+TRACER = Tracer()
+span = TRACER.span
+record = TRACER.record
+current_context = TRACER.current_context
+
+
+def trace_generator(name:str, generator:Generator, parent:Tuple[str, str]=None, scope:Dict=None, **attributes)->Generator:
+    '''
+    Yields the items of generator inside one span. The span is only current while the generator
+    runs: a suspended generator (a streaming response between fragments, or a caller that only
+    takes the first item) must not leave it as the parent of unrelated spans on the same thread.
+    '''
+    if not TRACER.enabled:
+        yield from generator
+        return
+    current = TRACER._new_span(name, parent, scope, attributes)
+    try:
+        while True:
+            token = _current_span.set(current)
+            try:
+                item = next(generator)
+            except StopIteration:
+                return
+            finally:
+                _current_span.reset(token)
+            yield item
+    except GeneratorExit:
+        raise
+    except BaseException as e:
+        current.error = f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        generator.close()
+        current.end()
+
+
+def set_attributes(**attributes):
+    '''
+    Adds attributes to the current span, if any, e.g. results only known at the end of a request.
+    '''
+    current = _current_span.get()
+    if current is not None:
+        current.set_attributes(attributes)
+
+
+def configure(trace_file:str=None, otel:bool=False):
+    '''
+    Enables tracing for the process: trace_file appends JSON spans to that file, otel exports
+    through OpenTelemetry.
+    '''
+    if trace_file:
+        TRACER.add_exporter(JSONFileExporter(trace_file))
+        print(f"tracing: writing spans to {trace_file}")
+    if otel:
+        TRACER.add_exporter(OTelExporter())
+        print("tracing: exporting spans to OpenTelemetry")
@@ -0,0 +1,53 @@
+import math
+import wave
+from typing import List
+
+import numpy as np
+
+# 每种语言一短一长两句, 预热各语言的 G2P (jieba/g2pW, g2p_en, pyopenjtalk, g2pk2) 与 BERT, 长短句混合组成不同长度的批次
+WARMUP_TEXTS = {
+    "zh": ["你好，欢迎使用语音合成。",
+           "今天天气很好，我们一起去公园散步吧，顺便看看湖边新开的花，听说春天的时候那里总是有很多人来拍照。"],
+    "en": ["Hello, and welcome to speech synthesis.",
+           "The quick brown fox jumps over the lazy dog, while the morning sun slowly rises above the quiet hills and the river."],
+    "ja": ["こんにちは、音声合成へようこそ。",
+           "今日はとても良い天気なので、公園を散歩しながら、湖のそばに新しく咲いた花を見に行きましょう。"],
+    "ko": ["안녕하세요, 음성 합성에 오신 것을 환영합니다.",
+           "오늘은 날씨가 정말 좋아서 공원을 산책하면서 호수 옆에 새로 핀 꽃들을 구경하러 가고 싶어요."],
+    "yue": ["你好，歡迎使用語音合成。",
+            "今日天氣好好，我哋一齊去公園行下啦，順便睇下湖邊啲新開嘅花，聽講春天嗰陣成日都有好多人去影相。"],
+}
+
+
+def default_languages(version:str)->List[str]:
+    return ["zh", "en", "ja"] if version == "v1" else ["zh", "en", "ja", "ko", "yue"]
+
+
+def warmup_texts(lang:str)->List[str]:
+    '''
+    The short and the long warmup sentence of a text language (all_zh, auto, ... use the texts of their base language).
+    '''
+    if lang == "auto":
+        return WARMUP_TEXTS["zh"]
+    if lang == "auto_yue":
+        return WARMUP_TEXTS["yue"]
+    return WARMUP_TEXTS[lang.replace("all_", "")]
+
+
+def write_synthetic_reference(path:str, sampling_rate:int=32000, seconds:float=5.0)->None:
+    '''
+    Writes a speech-like reference audio (harmonics on a gliding pitch, syllable-rate envelope, some noise)
+    as 16 bit mono wav, for warming up without a real reference audio.
+    '''
+    t = np.arange(int(sampling_rate * seconds)) / sampling_rate
+    f0 = 160 + 40 * np.sin(2 * math.pi * 0.5 * t)
+    phase = 2 * math.pi * np.cumsum(f0) / sampling_rate
+    voiced = sum(np.sin(k * phase) / k for k in range(1, 8))
+    envelope = 0.5 * (1 - np.cos(2 * math.pi * 4 * t)) * (t % 1.25 < 1.0)
+    rng = np.random.default_rng(0)
+    audio = 0.3 * envelope * voiced / 2 + 0.01 * rng.standard_normal(len(t))
+    with wave.open(path, "wb") as f:
+        f.setnchannels(1)
+        f.setsampwidth(2)
+        f.setframerate(sampling_rate)
+        f.writeframes((np.clip(audio, -1, 1) * 32767).astype(np.int16).tobytes())
@@ -92,6 +92,7 @@ cut_method = {
     i18n("按中文句号。切"): "cut3",
     i18n("按英文句号.切"): "cut4",
     i18n("按标点符号切"): "cut5",
+    i18n("按音素长度切"): "cut6",
 }
 
 tts_config = TTS_Config("GPT_SoVITS/configs/tts_infer.yaml")
@@ -984,7 +984,25 @@ class SynthesizerTrn(nn.Module):
         return o, y_mask, (z, z_p, m_p, logs_p)
 
     @torch.no_grad()
-    def decode(self, codes, text, refer, noise_scale=0.5,speed=1):
+    def extract_ge(self, refers):
+        """
+        参考音频的音色向量: 多条参考谱补零后一次前向, 结果与逐条计算后取平均一致
+        refers: list of [1, spec_channels, T]
+        """
+        refer_lengths = torch.LongTensor([refer.size(2) for refer in refers]).to(refers[0].device)
+        max_len = int(refer_lengths.max())
+        refer = torch.cat([F.pad(refer, (0, max_len - refer.size(2))) for refer in refers], 0)
+        refer_mask = torch.unsqueeze(
+            commons.sequence_mask(refer_lengths, max_len), 1
+        ).to(refer.dtype)
+        if (self.version == "v1"):
+            ge = self.ref_enc.forward_padded(refer * refer_mask, refer_mask)
+        else:
+            ge = self.ref_enc.forward_padded(refer[:, :704] * refer_mask, refer_mask)
+        return ge.mean(0, keepdim=True)
+
+    @torch.no_grad()
+    def decode(self, codes, text, refer, noise_scale=0.5,speed=1,ge=None):
         def get_ge(refer):
             ge = None
             if refer is not None:
@@ -997,7 +1015,9 @@ class SynthesizerTrn(nn.Module):
                 else:
                     ge = self.ref_enc(refer[:, :704] * refer_mask, refer_mask)
             return ge
-        if(type(refer)==list):
+        if ge is not None:
+            pass
+        elif(type(refer)==list):
             ges=[]
             for _refer in refer:
                 ge=get_ge(_refer)
@@ -762,6 +762,36 @@ class MelStyleEncoder(nn.Module):
 
         return w.unsqueeze(-1)
 
+    def forward_padded(self, x, mask):
+        """
+        Batched forward over right-padded inputs of different lengths.
+        Padded frames are zeroed after the spectral and every temporal layer, so
+        the convolutions see the same zero padding as an unpadded input and each
+        row matches forward() on that input alone.
+        """
+        x = x.transpose(1, 2)
+        mask = (mask.int() == 0).squeeze(1)
+        max_len = x.shape[1]
+        slf_attn_mask = mask.unsqueeze(1).expand(-1, max_len, -1)
+
+        # spectral
+        x = self.spectral(x)
+        x = x.masked_fill(mask.unsqueeze(-1), 0)
+        # temporal
+        x = x.transpose(1, 2)
+        for layer in self.temporal:
+            x = layer(x)
+            x = x.masked_fill(mask.unsqueeze(1), 0)
+        x = x.transpose(1, 2)
+        # self-attention
+        x, _ = self.slf_attn(x, mask=slf_attn_mask)
+        # fc
+        x = self.fc(x)
+        # temoral average pooling
+        w = self.temporal_avg_pool(x, mask=mask)
+
+        return w.unsqueeze(-1)
+
 
 class MelStyleEncoderVAE(nn.Module):
     def __init__(self, spec_channels, z_latent_dim, emb_dim):
@@ -13,11 +13,10 @@ from text.zh_normalization.text_normlization import TextNormalizer
 normalizer = lambda x: cn2an.transform(x, "an2cn")
 
 current_file_path = os.path.dirname(__file__)
-pinyin_to_symbol_map = {
-    line.split("\t")[0]: line.strip().split("\t")[1]
-    for line in open(os.path.join(current_file_path, "opencpop-strict.txt")).readlines()
-}
+# 在 init() 中加载
+pinyin_to_symbol_map = None
 
+import jieba_fast
 import jieba_fast.posseg as psg
 
 # is_g2pw_str = os.environ.get("is_g2pw", "True")##默认开启
@@ -29,7 +28,9 @@ if is_g2pw:
     print("当前使用g2pw进行拼音推理")
     from text.g2pw import G2PWPinyin, correct_pronunciation
     parent_directory = os.path.dirname(current_file_path)
-    g2pw = G2PWPinyin(model_dir="GPT_SoVITS/text/G2PWModel",model_source=os.environ.get("bert_path","GPT_SoVITS/pretrained_models/chinese-roberta-wwm-ext-large"),v_to_u=False, neutral_tone_with_five=True)
+# 在 init() 中加载
+g2pw = None
+G2PW_MODEL_DIR = "GPT_SoVITS/text/G2PWModel"
 
 rep_map = {
     "：": ",",
@@ -52,6 +53,31 @@ rep_map = {
 tone_modifier = ToneSandhi()
 
 
+def init():
+    """
+    加载拼音映射表、jieba 词典和 g2pw 模型。首次推理时自动调用, 重复调用无副作用。
+    """
+    global pinyin_to_symbol_map, g2pw
+    from text import frontend_snapshot
+    if pinyin_to_symbol_map is None:
+        pinyin_to_symbol_map = frontend_snapshot.load_section("opencpop")
+        if pinyin_to_symbol_map is None:
+            pinyin_to_symbol_map = read_pinyin_to_symbol_map()
+    if not frontend_snapshot.restore_jieba():
+        jieba_fast.initialize()
+    if is_g2pw and g2pw is None:
+        g2pw = G2PWPinyin(model_dir=G2PW_MODEL_DIR,model_source=os.environ.get("bert_path","GPT_SoVITS/pretrained_models/chinese-roberta-wwm-ext-large"),v_to_u=False, neutral_tone_with_five=True,
+                          tables=frontend_snapshot.load_section("g2pw_tables"))
+
+
+def read_pinyin_to_symbol_map():
+    with open(os.path.join(current_file_path, "opencpop-strict.txt")) as f:
+        return {
+            line.split("\t")[0]: line.strip().split("\t")[1]
+            for line in f.readlines()
+        }
+
+
 def replace_punctuation(text):
     text = text.replace("嗯", "恩").replace("呣", "母")
     pattern = re.compile("|".join(re.escape(p) for p in rep_map.keys()))
@@ -136,6 +162,8 @@ def _merge_erhua(initials: list[str],
 
 
 def _g2p(segments):
+    if pinyin_to_symbol_map is None or (is_g2pw and g2pw is None):
+        init()
     phones_list = []
     word2ph = []
     for seg in segments:
@@ -1,5 +1,8 @@
 from text import cleaned_text_to_sequence
 import os
+import importlib
+import threading
+from time import perf_counter
 # if os.environ.get("version","v1")=="v1":
 #     from text import chinese
 #     from text.symbols import symbols
@@ -18,7 +21,13 @@ special = [
 ]
 
 
-def clean_text(text, language, version=None):
+# 各语种前端模块按需导入并初始化, 只服务部分语种的进程无需承担其他语种的启动开销
+_language_modules = {}
+_load_report = {}
+_load_lock = threading.RLock()
+
+
+def get_language_module_map(version=None):
     if version is None:version=os.environ.get('version', 'v2')
     if version == "v1":
         symbols = symbols_v1.symbols
@@ -26,6 +35,71 @@ def clean_text(text, language, version=None):
     else:
         symbols = symbols_v2.symbols
         language_module_map = {"zh": "chinese2", "ja": "japanese", "en": "english", "ko": "korean","yue":"cantonese"}
+    return symbols, language_module_map
+
+
+def get_language_module(language, version=None):
+    """
+    导入并初始化语种前端模块(首次调用时), 记录导入与初始化耗时。
+    """
+    _, language_module_map = get_language_module_map(version)
+    module_name = language_module_map[language]
+    language_module = _language_modules.get(module_name)
+    if language_module is not None:
+        return language_module
+    with _load_lock:
+        language_module = _language_modules.get(module_name)
+        if language_module is not None:
+            return language_module
+        t0 = perf_counter()
+        language_module = importlib.import_module("text."+module_name)
+        t1 = perf_counter()
+        if hasattr(language_module, "init"):
+            language_module.init()
+        t2 = perf_counter()
+        _load_report[module_name] = {"import": t1 - t0, "init": t2 - t1}
+        print(f"Loaded text frontend {module_name}: import {t1 - t0:.3f}s, init {t2 - t1:.3f}s")
+        _language_modules[module_name] = language_module
+    return language_module
+
+
+def get_load_report():
+    """
+    返回已加载语种前端的耗时: {module_name: {"import": 秒, "init": 秒}}
+    """
+    return {k: dict(v) for k, v in _load_report.items()}
+
+
+def warmup(languages=None, version=None):
+    """
+    提前加载指定语种的前端, languages 为空时加载该版本支持的全部语种。
+    返回 get_load_report() 的结果。
+    """
+    _, language_module_map = get_language_module_map(version)
+    if languages is None:
+        languages = list(language_module_map.keys())
+    for language in languages:
+        language = language.replace("all_", "")
+        if language in language_module_map:
+            get_language_module(language, version)
+    return get_load_report()
+
+
+def prefetch(texts, language, version=None):
+    """
+    让语种前端对一批文本做批量预处理(如英文未登录词批量预测), 前端不支持时不做任何事。
+    """
+    _, language_module_map = get_language_module_map(version)
+    if language not in language_module_map:
+        return
+    language_module = get_language_module(language, version)
+    if hasattr(language_module, "prefetch"):
+        language_module.prefetch(texts)
+
+
+def clean_text(text, language, version=None):
+    if version is None:version=os.environ.get('version', 'v2')
+    symbols, language_module_map = get_language_module_map(version)
 
     if(language not in language_module_map):
         language="en"
@@ -33,7 +107,7 @@ def clean_text(text, language, version=None):
     for special_s, special_l, target_symbol in special:
         if special_s in text and language == special_l:
             return clean_special(text, language, special_s, target_symbol, version)
-    language_module = __import__("text."+language_module_map[language],fromlist=[language_module_map[language]])
+    language_module = get_language_module(language, version)
     if hasattr(language_module,"text_normalize"):
         norm_text = language_module.text_normalize(text)
     else:
@@ -55,19 +129,13 @@ def clean_text(text, language, version=None):
 
 
 def clean_special(text, language, special_s, target_symbol, version=None):
-    if version is None:version=os.environ.get('version', 'v2')
-    if version == "v1":
-        symbols = symbols_v1.symbols
-        language_module_map = {"zh": "chinese", "ja": "japanese", "en": "english"}
-    else:
-        symbols = symbols_v2.symbols
-        language_module_map = {"zh": "chinese2", "ja": "japanese", "en": "english", "ko": "korean","yue":"cantonese"}
-
     """
     特殊静音段sp符号处理
     """
+    if version is None:version=os.environ.get('version', 'v2')
+    symbols, _ = get_language_module_map(version)
     text = text.replace(special_s, ",")
-    language_module = __import__("text."+language_module_map[language],fromlist=[language_module_map[language]])
+    language_module = get_language_module(language, version)
     norm_text = language_module.text_normalize(text)
     phones = language_module.g2p(norm_text)
     new_ph = []
@@ -1,9 +1,14 @@
 import pickle
 import os
 import re
+import threading
+from collections import OrderedDict
+
+import numpy as np
 import wordsegment
 from g2p_en import G2p
 
+from text import pron_dict
 from text.symbols import punctuation
 
 from text.symbols2 import symbols
@@ -21,6 +26,14 @@ CMU_DICT_FAST_PATH = os.path.join(current_file_path, "cmudict-fast.rep")
 CMU_DICT_HOT_PATH = os.path.join(current_file_path, "engdict-hot.rep")
 CACHE_PATH = os.path.join(current_file_path, "engdict_cache.pickle")
 NAMECACHE_PATH = os.path.join(current_file_path, "namedict_cache.pickle")
+COMPACT_DICT_PATH = os.path.join(current_file_path, "engdict_compact.bin")
+COMPACT_NAMEDICT_PATH = os.path.join(current_file_path, "namedict_compact.bin")
+# 关闭后使用普通 dict 存放字典
+use_compact_dict = os.environ.get("en_compact_dict", "True").lower() == "true"
+# 单词级缓存的容量
+word_cache_size = int(os.environ.get("en_word_cache_size", 20000))
+# 读音错误需要剔除的几个缩写
+CMU_REMOVED_WORDS = ["ae", "ai", "ar", "ios", "hud", "os"]
 
 arpa = {
     "AH0",
@@ -196,6 +209,14 @@ def cache_dict(g2p_dict, file_path):
 
 
 def get_dict():
+    from text import frontend_snapshot
+    g2p_dict = frontend_snapshot.load_section("cmudict")
+    if g2p_dict is None:
+        g2p_dict = _get_dict()
+    return g2p_dict
+
+
+def _get_dict():
     if os.path.exists(CACHE_PATH):
         with open(CACHE_PATH, "rb") as pickle_file:
             g2p_dict = pickle.load(pickle_file)
@@ -208,7 +229,48 @@ def get_dict():
     return g2p_dict
 
 
+def cmudict_sources():
+    if os.path.exists(CACHE_PATH):
+        return [CACHE_PATH, CMU_DICT_HOT_PATH]
+    return [CMU_DICT_PATH, CMU_DICT_FAST_PATH, CMU_DICT_HOT_PATH]
+
+
+def namedict_sources():
+    return [NAMECACHE_PATH] if os.path.exists(NAMECACHE_PATH) else []
+
+
+def get_compact_dict(path, sources, load):
+    """
+    打开 mmap 只读的紧凑字典, 不存在或源文件有变化时用 load() 的结果重新生成。
+    失败(如目录只读)时返回 None。
+    """
+    from text import frontend_snapshot
+    meta = {"sources": [list(item) for item in frontend_snapshot.hash_sources(sources)]}
+    try:
+        if pron_dict.read_meta(path) != meta:
+            pron_dict.write_pron_dict(path, load(), meta)
+        return pron_dict.PronDict(path)
+    except Exception as e:
+        print(f"failed to open compact dictionary {path}: {e}")
+        return None
+
+
+def _get_cmu_without_removed():
+    g2p_dict = get_dict()
+    for word in CMU_REMOVED_WORDS:
+        g2p_dict.pop(word, None)
+    return g2p_dict
+
+
 def get_namedict():
+    from text import frontend_snapshot
+    name_dict = frontend_snapshot.load_section("namedict")
+    if name_dict is None:
+        name_dict = _get_namedict()
+    return name_dict
+
+
+def _get_namedict():
     if os.path.exists(NAMECACHE_PATH):
         with open(NAMECACHE_PATH, "rb") as pickle_file:
             name_dict = pickle.load(pickle_file)
@@ -247,6 +309,35 @@ def text_normalize(text):
     return text
 
 
+class LRUCache:
+    """
+    线程安全的 LRU 缓存, 值以 tuple 保存以免被调用方修改。
+    """
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __contains__(self, key):
+        return key in self._data
+
+    def get(self, key):
+        with self._lock:
+            value = self._data.get(key)
+            if value is not None:
+                self._data.move_to_end(key)
+            return value
+
+    def put(self, key, value):
+        value = tuple(value)
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+        return value
+
+
 class en_G2p(G2p):
     def __init__(self):
         super().__init__()
@@ -254,51 +345,47 @@ class en_G2p(G2p):
         wordsegment.load()
 
         # 扩展过时字典, 添加姓名字典
-        self.cmu = get_dict()
-        self.namedict = get_namedict()
-
-        # 剔除读音错误的几个缩写
-        for word in ["AE", "AI", "AR", "IOS", "HUD", "OS"]:
-            del self.cmu[word.lower()]
+        # 默认使用 mmap 紧凑字典, 多进程共享页缓存; 已剔除读音错误的几个缩写
+        self.cmu = None
+        self.namedict = None
+        if use_compact_dict:
+            self.cmu = get_compact_dict(COMPACT_DICT_PATH, cmudict_sources(), _get_cmu_without_removed)
+            self.namedict = get_compact_dict(COMPACT_NAMEDICT_PATH, namedict_sources(), get_namedict)
+        if self.cmu is None:
+            self.cmu = _get_cmu_without_removed()
+        if self.namedict is None:
+            self.namedict = get_namedict()
 
         # 修正多音字
         self.homograph2features["read"] = (['R', 'IY1', 'D'], ['R', 'EH1', 'D'], 'VBP')
         self.homograph2features["complex"] = (['K', 'AH0', 'M', 'P', 'L', 'EH1', 'K', 'S'], ['K', 'AA1', 'M', 'P', 'L', 'EH0', 'K', 'S'], 'JJ')
 
+        # 单词读音 / 分词 / 神经网络预测结果缓存
+        self.word_cache = LRUCache(word_cache_size)
+        self.segment_cache = LRUCache(word_cache_size)
+        self.predict_cache = LRUCache(word_cache_size)
+
 
     def __call__(self, text):
         # tokenization
         words = word_tokenize(text)
-        tokens = pos_tag(words)  # tuples of (word, tag)
+        # 词性只用于多音词, 句中没有多音词时跳过 pos_tag
+        if any(word.lower() in self.homograph2features for word in words):
+            tokens = pos_tag(words)  # tuples of (word, tag)
+        else:
+            tokens = [(word, None) for word in words]
+
+        # 先收集整句的未登录词, 一次批量预测
+        self.predict_batch(self.collect_oov(words))
 
         # steps
         prons = []
         for o_word, pos in tokens:
-            # 还原 g2p_en 小写操作逻辑
-            word = o_word.lower()
-
-            if re.search("[a-z]", word) is None:
-                pron = [word]
-            # 先把单字母推出去
-            elif len(word) == 1:
-                # 单读 A 发音修正, 这里需要原格式 o_word 判断大写
-                if o_word == "A":
-                    pron = ['EY1']
-                else:
-                    pron = self.cmu[word][0]
-            # g2p_en 原版多音字处理
-            elif word in self.homograph2features:  # Check homograph
-                pron1, pron2, pos1 = self.homograph2features[word]
-                if pos.startswith(pos1):
-                    pron = pron1
-                # pos1比pos长仅出现在read
-                elif len(pos) < len(pos1) and pos == pos1[:len(pos)]:
-                    pron = pron1
-                else:
-                    pron = pron2
-            else:
-                # 递归查找预测
-                pron = self.qryword(o_word)
+            # 多音词的读音取决于词性, 其余只取决于原词
+            key = (o_word, pos if o_word.lower() in self.homograph2features else None)
+            pron = self.word_cache.get(key)
+            if pron is None:
+                pron = self.word_cache.put(key, self._word_pron(o_word, pos))
 
             prons.extend(pron)
             prons.extend([" "])
@@ -306,6 +393,132 @@ class en_G2p(G2p):
         return prons[:-1]
 
 
+    def _word_pron(self, o_word, pos):
+        # 还原 g2p_en 小写操作逻辑
+        word = o_word.lower()
+
+        if re.search("[a-z]", word) is None:
+            pron = [word]
+        # 先把单字母推出去
+        elif len(word) == 1:
+            # 单读 A 发音修正, 这里需要原格式 o_word 判断大写
+            if o_word == "A":
+                pron = ['EY1']
+            else:
+                pron = self.cmu[word][0]
+        # g2p_en 原版多音字处理
+        elif word in self.homograph2features:  # Check homograph
+            pron1, pron2, pos1 = self.homograph2features[word]
+            if pos.startswith(pos1):
+                pron = pron1
+            # pos1比pos长仅出现在read
+            elif len(pos) < len(pos1) and pos == pos1[:len(pos)]:
+                pron = pron1
+            else:
+                pron = pron2
+        else:
+            # 递归查找预测
+            pron = self.qryword(o_word)
+        return pron
+
+
+    def collect_oov(self, words):
+        """
+        返回 words 中需要神经网络预测的未登录词(按 qryword 的查找顺序判断)。
+        """
+        oov = {}
+        for o_word in words:
+            word = o_word.lower()
+            if re.search("[a-z]", word) is None or len(word) == 1 or word in self.homograph2features:
+                continue
+            if (o_word, None) in self.word_cache:
+                continue
+            self._collect_oov(o_word, oov)
+        return list(oov)
+
+
+    def _collect_oov(self, o_word, oov):
+        word = o_word.lower()
+        if len(word) > 1 and word in self.cmu:
+            return
+        if o_word.istitle() and word in self.namedict:
+            return
+        if len(word) <= 3:
+            return
+        if re.match(r"^([a-z]+)('s)$", word):
+            self._collect_oov(word[:-2], oov)
+            return
+        if word in self.predict_cache:
+            return
+        comps = self.segment(word)
+        if len(comps) == 1:
+            oov[word] = None
+            return
+        for comp in comps:
+            self._collect_oov(comp, oov)
+
+
+    def segment(self, word):
+        comps = self.segment_cache.get(word)
+        if comps is None:
+            comps = self.segment_cache.put(word, wordsegment.segment(word))
+        return comps
+
+
+    def predict(self, word):
+        pron = self.predict_cache.get(word)
+        if pron is None:
+            pron = self.predict_cache.put(word, super().predict(word))
+        return list(pron)
+
+
+    def predict_batch(self, words):
+        """
+        批量预测未登录词的读音并写入缓存, 返回与 words 对应的读音列表。
+        """
+        todo = [word for word in dict.fromkeys(words) if word not in self.predict_cache]
+        if len(todo) == 1:
+            self.predict(todo[0])
+        elif len(todo) > 1:
+            for word, pron in zip(todo, self._predict_batch(todo)):
+                self.predict_cache.put(word, pron)
+        return [self.predict(word) for word in words]
+
+
+    def _predict_batch(self, words):
+        # 与 G2p.predict 相同的 GRU 编码器-解码器, 按批计算。
+        # 编码器中已结束的序列保持隐状态不变, 解码器逐行在 </s> 处停止。
+        n = len(words)
+        lens = np.array([len(word) + 1 for word in words])
+        ids = np.zeros((n, lens.max()), dtype=np.int64)
+        for i, word in enumerate(words):
+            ids[i, :lens[i]] = [self.g2idx.get(char, self.g2idx["<unk>"]) for char in list(word) + ["</s>"]]
+        x = np.take(self.enc_emb, ids, axis=0)
+
+        h = np.zeros((n, self.enc_w_hh.shape[-1]), np.float32)
+        for t in range(ids.shape[1]):
+            h_new = self.grucell(x[:, t, :], h, self.enc_w_ih, self.enc_w_hh, self.enc_b_ih, self.enc_b_hh)
+            h = np.where((t < lens)[:, None], h_new, h)
+
+        dec = np.take(self.dec_emb, np.full(n, 2), axis=0)  # 2: <s>
+        preds = [[] for _ in range(n)]
+        done = np.zeros(n, dtype=bool)
+        for _ in range(20):
+            h = self.grucell(dec, h, self.dec_w_ih, self.dec_w_hh, self.dec_b_ih, self.dec_b_hh)
+            logits = np.matmul(h, self.fc_w.T) + self.fc_b
+            pred = logits.argmax(-1)
+            for i in np.flatnonzero(~done):
+                if pred[i] == 3:  # 3: </s>
+                    done[i] = True
+                else:
+                    preds[i].append(int(pred[i]))
+            if done.all():
+                break
+            dec = np.take(self.dec_emb, pred, axis=0)
+
+        return [[self.idx2p.get(idx, "<unk>") for idx in pred] for pred in preds]
+
+
     def qryword(self, o_word):
         word = o_word.lower()
 
@@ -347,7 +560,7 @@ class en_G2p(G2p):
             return phones
 
         # 尝试进行分词，应对复合词
-        comps = wordsegment.segment(word.lower())
+        comps = self.segment(word)
 
         # 无法分词的送回去预测
         if len(comps)==1:
@@ -357,10 +570,34 @@ class en_G2p(G2p):
         return [phone for comp in comps for phone in self.qryword(comp)]
 
 
-_g2p = en_G2p()
+# 在 init() 中加载
+_g2p = None
+
+
+def init():
+    """
+    加载 CMU 字典、姓名字典及 g2p_en 模型。首次推理时自动调用, 重复调用无副作用。
+    """
+    global _g2p
+    if _g2p is None:
+        _g2p = en_G2p()
+
+
+def prefetch(texts):
+    """
+    对一批文本(如同一请求的全部分句)提前收集未登录词, 一次批量预测并写入缓存。
+    """
+    if _g2p is None:
+        init()
+    words = []
+    for text in texts:
+        words.extend(word_tokenize(text_normalize(text)))
+    _g2p.predict_batch(_g2p.collect_oov(words))
 
 
 def g2p(text):
+    if _g2p is None:
+        init()
     # g2p_en 整段推理，剔除不存在的arpa返回
     phone_list = _g2p(text)
     phones = [ph if ph != "<unk>" else "UNK" for ph in phone_list if ph not in [" ", "<pad>", "UW", "</s>", "<s>"]]
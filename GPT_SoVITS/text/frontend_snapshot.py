@@ -0,0 +1,227 @@
+"""
+文本前端预热快照
+
+各语种前端在初始化时需要解析大量文本资源(jieba 词典、CMU 字典及热词、g2pw 标签表、
+opencpop 拼音映射等), 每个新进程都要重复这项工作。此模块把解析后的结果按分区序列化
+到快照目录下, 前端初始化时直接加载。
+
+每个分区文件依次包含两个 pickle: 文件头 {"version", "sources"} 与数据本身。
+sources 记录生成快照时所用源文件的 sha1, 加载时重新计算, 不一致(或版本号不一致)
+即视为过期, 前端回退到从源文件解析。
+
+生成快照(在项目根目录执行):
+    python GPT_SoVITS/text/frontend_snapshot.py
+    python GPT_SoVITS/text/frontend_snapshot.py -s cmudict namedict -o /path/to/snapshot
+
+pyopenjtalk 的用户词典已由 japanese.init() 编译为二进制并按 md5 校验, 不再重复存储。
+"""
+import hashlib
+import os
+import pickle
+from typing import Callable, Dict, List
+
+current_file_path = os.path.dirname(__file__)
+
+SNAPSHOT_VERSION = 1
+SNAPSHOT_DIR = os.environ.get("frontend_snapshot_dir", os.path.join(current_file_path, "frontend_snapshot"))
+
+SECTIONS: Dict[str, Dict[str, Callable]] = dict()
+
+
+def register_section(name: str, sources: Callable[[], List[str]]):
+    """
+    注册一个快照分区。sources 返回该分区依赖的源文件列表, 被装饰的函数负责构建数据。
+    """
+    def decorator(func):
+        SECTIONS[name] = {"sources": sources, "build": func}
+        return func
+    return decorator
+
+
+def get_section_names() -> list:
+    return list(SECTIONS.keys())
+
+
+def hash_sources(paths: List[str]) -> list:
+    hashes = []
+    for path in paths:
+        sha1 = hashlib.sha1()
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                sha1.update(chunk)
+        hashes.append((os.path.basename(path), sha1.hexdigest()))
+    return hashes
+
+
+def _section_path(name: str, snapshot_dir: str = None) -> str:
+    return os.path.join(snapshot_dir or SNAPSHOT_DIR, f"{name}.pickle")
+
+
+def load_section(name: str, snapshot_dir: str = None):
+    """
+    加载快照分区, 快照不存在、版本不符或源文件已改变时返回 None。
+    """
+    path = _section_path(name, snapshot_dir)
+    if name not in SECTIONS or not os.path.exists(path):
+        return None
+    try:
+        with open(path, "rb") as f:
+            header = pickle.load(f)
+            if header.get("version") != SNAPSHOT_VERSION:
+                print(f"frontend snapshot {name} has version {header.get('version')}, expected {SNAPSHOT_VERSION}, ignored")
+                return None
+            if header.get("sources") != hash_sources(SECTIONS[name]["sources"]()):
+                print(f"frontend snapshot {name} is out of date, ignored")
+                return None
+            return pickle.load(f)
+    except Exception as e:
+        print(f"failed to load frontend snapshot {name}: {e}")
+        return None
+
+
+def build_section(name: str, snapshot_dir: str = None) -> str:
+    """
+    构建并写入快照分区, 返回写入的文件路径。
+    """
+    section = SECTIONS[name]
+    sources = section["sources"]()
+    data = section["build"]()
+    path = _section_path(name, snapshot_dir)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        pickle.dump({"version": SNAPSHOT_VERSION, "sources": hash_sources(sources)}, f, protocol=pickle.HIGHEST_PROTOCOL)
+        pickle.dump(data, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp_path, path)
+    return path
+
+
+def build_snapshot(names: List[str] = None, snapshot_dir: str = None) -> Dict[str, str]:
+    """
+    构建多个快照分区(默认全部)。返回 {分区名: 文件路径或失败原因}。
+    """
+    results = {}
+    for name in names or get_section_names():
+        try:
+            results[name] = build_section(name, snapshot_dir)
+        except Exception as e:
+            results[name] = f"failed: {e}"
+    return results
+
+
+#################### 分区定义 ####################
+
+def _jieba_dict_path() -> str:
+    import jieba_fast
+    if jieba_fast.dt.dictionary is not None:
+        return jieba_fast.dt.dictionary
+    return os.path.join(os.path.dirname(os.path.abspath(jieba_fast.__file__)), "dict.txt")
+
+
+def _g2pw_model_dir() -> str:
+    from text.chinese2 import G2PW_MODEL_DIR
+    return G2PW_MODEL_DIR
+
+
+@register_section("jieba", lambda: [_jieba_dict_path()])
+def _build_jieba():
+    import jieba_fast
+    jieba_fast.initialize()
+    return jieba_fast.dt.FREQ, jieba_fast.dt.total
+
+
+def restore_jieba() -> bool:
+    """
+    用快照中的词频表初始化 jieba 默认分词器, 没有可用快照时返回 False。
+    """
+    import jieba_fast
+    dt = jieba_fast.dt
+    if dt.initialized:
+        return True
+    data = load_section("jieba")
+    if data is None:
+        return False
+    with dt.lock:
+        if not dt.initialized:
+            dt.FREQ, dt.total = data
+            dt.initialized = True
+    return True
+
+
+@register_section("opencpop", lambda: [os.path.join(current_file_path, "opencpop-strict.txt")])
+def _build_opencpop():
+    from text.chinese2 import read_pinyin_to_symbol_map
+    return read_pinyin_to_symbol_map()
+
+
+def _cmudict_sources():
+    from text import english
+    return english.cmudict_sources()
+
+
+@register_section("cmudict", _cmudict_sources)
+def _build_cmudict():
+    from text import english
+    return english._get_dict()
+
+
+def _namedict_sources():
+    from text import english
+    return english.namedict_sources()
+
+
+@register_section("namedict", _namedict_sources)
+def _build_namedict():
+    from text import english
+    return english._get_namedict()
+
+
+def _g2pw_polyphonic_sources():
+    from text.g2pw import g2pw
+    if os.path.exists(g2pw.CACHE_PATH):
+        return [g2pw.CACHE_PATH]
+    return [g2pw.PP_DICT_PATH, g2pw.PP_FIX_DICT_PATH]
+
+
+@register_section("g2pw_polyphonic", _g2pw_polyphonic_sources)
+def _build_g2pw_polyphonic():
+    from text.g2pw import g2pw
+    return g2pw._get_dict()
+
+
+def _g2pw_tables_sources():
+    model_dir = _g2pw_model_dir()
+    return [os.path.join(model_dir, name) for name in [
+        "config.py",
+        "POLYPHONIC_CHARS.txt",
+        "MONOPHONIC_CHARS.txt",
+        "bopomofo_to_pinyin_wo_tune_dict.json",
+        "char_bopomofo_dict.json",
+    ]]
+
+
+@register_section("g2pw_tables", _g2pw_tables_sources)
+def _build_g2pw_tables():
+    from text.g2pw.onnx_api import load_tables
+    from text.g2pw.utils import load_config
+    model_dir = _g2pw_model_dir()
+    config = load_config(config_path=os.path.join(model_dir, "config.py"), use_default=True)
+    return load_tables(model_dir, config.use_char_phoneme)
+
+
+if __name__ == "__main__":
+    import argparse
+    import sys
+
+    now_dir = os.getcwd()
+    sys.path.append(now_dir)
+    sys.path.append("%s/GPT_SoVITS" % (now_dir))
+
+    parser = argparse.ArgumentParser(description="build text frontend snapshot")
+    parser.add_argument("-o", "--output_dir", type=str, default=SNAPSHOT_DIR, help="快照目录")
+    parser.add_argument("-s", "--sections", type=str, nargs="*", default=None,
+                        help=f"要构建的分区, 默认全部: {get_section_names()}")
+    args = parser.parse_args()
+
+    for name, result in build_snapshot(args.sections, args.output_dir).items():
+        print(f"{name.ljust(20)}: {result}")
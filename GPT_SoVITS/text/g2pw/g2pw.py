@@ -19,12 +19,14 @@ PP_FIX_DICT_PATH = os.path.join(current_file_path, "polyphonic-fix.rep")
 class G2PWPinyin(Pinyin):
     def __init__(self, model_dir='G2PWModel/', model_source=None,
                  enable_non_tradional_chinese=True,
-                 v_to_u=False, neutral_tone_with_five=False, tone_sandhi=False, **kwargs):
+                 v_to_u=False, neutral_tone_with_five=False, tone_sandhi=False,
+                 tables=None, **kwargs):
         self._g2pw = G2PWOnnxConverter(
             model_dir=model_dir,
             style='pinyin',
             model_source=model_source,
             enable_non_tradional_chinese=enable_non_tradional_chinese,
+            tables=tables,
         )
         self._converter = Converter(
             self._g2pw, v_to_u=v_to_u,
@@ -115,6 +117,14 @@ def cache_dict(polyphonic_dict, file_path):
 
 
 def get_dict():
+    from text import frontend_snapshot
+    polyphonic_dict = frontend_snapshot.load_section("g2pw_polyphonic")
+    if polyphonic_dict is None:
+        polyphonic_dict = _get_dict()
+    return polyphonic_dict
+
+
+def _get_dict():
     if os.path.exists(CACHE_PATH):
         with open(CACHE_PATH, "rb") as pickle_file:
             polyphonic_dict = pickle.load(pickle_file)
@@ -74,12 +74,87 @@ def download_and_decompress(model_dir: str='G2PWModel/'):
 
     return model_dir
 
+def load_tables(uncompress_path: str, use_char_phoneme: bool) -> Dict[str, Any]:
+    """Build the character/label lookup tables of a G2PW model directory.
+
+    The result only depends on the files in the model directory, so it can
+    be cached (see text/frontend_snapshot.py) and passed back to
+    G2PWOnnxConverter through its `tables` argument.
+    """
+    polyphonic_chars_path = os.path.join(uncompress_path,
+                                         'POLYPHONIC_CHARS.txt')
+    monophonic_chars_path = os.path.join(uncompress_path,
+                                         'MONOPHONIC_CHARS.txt')
+    polyphonic_chars = [
+        line.split('\t')
+        for line in open(polyphonic_chars_path, encoding='utf-8').read()
+        .strip().split('\n')
+    ]
+    non_polyphonic = {
+        '一', '不', '和', '咋', '嗲', '剖', '差', '攢', '倒', '難', '奔', '勁', '拗',
+        '肖', '瘙', '誒', '泊', '听', '噢'
+    }
+    non_monophonic = {'似', '攢'}
+    monophonic_chars = [
+        line.split('\t')
+        for line in open(monophonic_chars_path, encoding='utf-8').read()
+        .strip().split('\n')
+    ]
+    labels, char2phonemes = get_char_phoneme_labels(
+        polyphonic_chars=polyphonic_chars
+    ) if use_char_phoneme else get_phoneme_labels(
+        polyphonic_chars=polyphonic_chars)
+
+    chars = sorted(list(char2phonemes.keys()))
+
+    polyphonic_chars_new = set(chars)
+    for char in non_polyphonic:
+        if char in polyphonic_chars_new:
+            polyphonic_chars_new.remove(char)
+
+    monophonic_chars_dict = {
+        char: phoneme
+        for char, phoneme in monophonic_chars
+    }
+    for char in non_monophonic:
+        if char in monophonic_chars_dict:
+            monophonic_chars_dict.pop(char)
+
+    with open(
+            os.path.join(uncompress_path,
+                         'bopomofo_to_pinyin_wo_tune_dict.json'),
+            'r',
+            encoding='utf-8') as fr:
+        bopomofo_convert_dict = json.load(fr)
+
+    with open(
+            os.path.join(uncompress_path, 'char_bopomofo_dict.json'),
+            'r',
+            encoding='utf-8') as fr:
+        char_bopomofo_dict = json.load(fr)
+
+    return {
+        'polyphonic_chars': polyphonic_chars,
+        'non_polyphonic': non_polyphonic,
+        'non_monophonic': non_monophonic,
+        'monophonic_chars': monophonic_chars,
+        'labels': labels,
+        'char2phonemes': char2phonemes,
+        'chars': chars,
+        'polyphonic_chars_new': polyphonic_chars_new,
+        'monophonic_chars_dict': monophonic_chars_dict,
+        'bopomofo_convert_dict': bopomofo_convert_dict,
+        'char_bopomofo_dict': char_bopomofo_dict,
+    }
+
+
 class G2PWOnnxConverter:
     def __init__(self,
                  model_dir: str='G2PWModel/',
                  style: str='bopomofo',
                  model_source: str=None,
-                 enable_non_tradional_chinese: bool=False):
+                 enable_non_tradional_chinese: bool=False,
+                 tables: Dict[str, Any]=None):
         uncompress_path = download_and_decompress(model_dir)
 
         sess_options = onnxruntime.SessionOptions()
@@ -99,66 +174,20 @@ class G2PWOnnxConverter:
 
         self.tokenizer = AutoTokenizer.from_pretrained(self.model_source)
 
-        polyphonic_chars_path = os.path.join(uncompress_path,
-                                             'POLYPHONIC_CHARS.txt')
-        monophonic_chars_path = os.path.join(uncompress_path,
-                                             'MONOPHONIC_CHARS.txt')
-        self.polyphonic_chars = [
-            line.split('\t')
-            for line in open(polyphonic_chars_path, encoding='utf-8').read()
-            .strip().split('\n')
-        ]
-        self.non_polyphonic = {
-            '一', '不', '和', '咋', '嗲', '剖', '差', '攢', '倒', '難', '奔', '勁', '拗',
-            '肖', '瘙', '誒', '泊', '听', '噢'
-        }
-        self.non_monophonic = {'似', '攢'}
-        self.monophonic_chars = [
-            line.split('\t')
-            for line in open(monophonic_chars_path, encoding='utf-8').read()
-            .strip().split('\n')
-        ]
-        self.labels, self.char2phonemes = get_char_phoneme_labels(
-            polyphonic_chars=self.polyphonic_chars
-        ) if self.config.use_char_phoneme else get_phoneme_labels(
-            polyphonic_chars=self.polyphonic_chars)
-
-        self.chars = sorted(list(self.char2phonemes.keys()))
-
-        self.polyphonic_chars_new = set(self.chars)
-        for char in self.non_polyphonic:
-            if char in self.polyphonic_chars_new:
-                self.polyphonic_chars_new.remove(char)
-
-        self.monophonic_chars_dict = {
-            char: phoneme
-            for char, phoneme in self.monophonic_chars
-        }
-        for char in self.non_monophonic:
-            if char in self.monophonic_chars_dict:
-                self.monophonic_chars_dict.pop(char)
+        if tables is None:
+            tables = load_tables(uncompress_path, self.config.use_char_phoneme)
+        for name, value in tables.items():
+            setattr(self, name, value)
 
         self.pos_tags = [
             'UNK', 'A', 'C', 'D', 'I', 'N', 'P', 'T', 'V', 'DE', 'SHI'
         ]
 
-        with open(
-                os.path.join(uncompress_path,
-                             'bopomofo_to_pinyin_wo_tune_dict.json'),
-                'r',
-                encoding='utf-8') as fr:
-            self.bopomofo_convert_dict = json.load(fr)
         self.style_convert_func = {
             'bopomofo': lambda x: x,
             'pinyin': self._convert_bopomofo_to_pinyin,
         }[style]
 
-        with open(
-                os.path.join(uncompress_path, 'char_bopomofo_dict.json'),
-                'r',
-                encoding='utf-8') as fr:
-            self.char_bopomofo_dict = json.load(fr)
-
         if self.enable_opencc:
             self.cc = OpenCC('s2tw')
 
@@ -223,8 +223,22 @@ def korean_to_lazy_ipa(text):
         text = re.sub(regex, replacement, text)
     return text
 
-_g2p=G2p()
+# 在 init() 中加载
+_g2p = None
+
+
+def init():
+    """
+    加载 g2pk2 模型。首次推理时自动调用, 重复调用无副作用。
+    """
+    global _g2p
+    if _g2p is None:
+        _g2p = G2p()
+
+
 def korean_to_ipa(text):
+    if _g2p is None:
+        init()
     text = latin_to_hangul(text)
     text = number_to_hangul(text)
     text = _g2p(text)
@@ -255,6 +269,8 @@ def post_replace_ph(ph):
     return ph
 
 def g2p(text):
+    if _g2p is None:
+        init()
     text = latin_to_hangul(text)
     text = _g2p(text)
     text = divide_hangul(text)
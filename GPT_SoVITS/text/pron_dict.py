@@ -0,0 +1,184 @@
+"""
+紧凑只读发音词典
+
+把 {word: [[phone, ...], ...]} 形式的发音词典(只保留每个词的首个读音)写成一个二进制文件,
+以 mmap 只读方式打开。多个进程打开同一文件时共享操作系统的页缓存, 不再各自持有
+数十万个 Python 小对象。
+
+文件布局(小端):
+    MAGIC                       8 bytes
+    header_len                  uint32
+    header                      json: {"meta", "symbols", "n_words", "n_phones"}
+    word_offsets                uint32[n_words + 1]   words 中第 i 个词的起止位置
+    pron_offsets                uint32[n_words + 1]   pron_ids 中第 i 个词读音的起止位置
+    pron_ids                    uint16[n_phones]      音素在 symbols 中的下标
+    words                       bytes                 按 utf-8 字节序排序后拼接的词
+各数组按 8 字节对齐。
+"""
+import json
+import mmap
+import os
+from bisect import bisect_left
+from typing import Dict, Iterable, List, Optional
+
+import numpy as np
+
+MAGIC = b"GSVPD\x00\x00\x01"
+_ALIGN = 8
+
+
+def _pad(n: int) -> int:
+    return (-n) % _ALIGN
+
+
+def write_pron_dict(path: str, pron_dict: Dict[str, List[List[str]]], meta: dict = None) -> None:
+    """
+    将发音词典写为紧凑格式(先写临时文件再替换, 读者不会看到写了一半的文件)。
+    meta 会原样保存在文件头, 可用于校验来源。
+    """
+    words = sorted((word.encode("utf-8"), prons[0]) for word, prons in pron_dict.items() if prons)
+    symbols = sorted({ph for _, pron in words for ph in pron})
+    symbol_to_id = {s: i for i, s in enumerate(symbols)}
+
+    word_offsets = np.zeros(len(words) + 1, dtype="<u4")
+    pron_offsets = np.zeros(len(words) + 1, dtype="<u4")
+    pron_ids = []
+    blob = bytearray()
+    for i, (word, pron) in enumerate(words):
+        blob += word
+        pron_ids.extend(symbol_to_id[ph] for ph in pron)
+        word_offsets[i + 1] = len(blob)
+        pron_offsets[i + 1] = len(pron_ids)
+    pron_ids = np.asarray(pron_ids, dtype="<u2")
+
+    header = json.dumps({
+        "meta": meta or {},
+        "symbols": symbols,
+        "n_words": len(words),
+        "n_phones": int(pron_ids.shape[0]),
+    }, ensure_ascii=False).encode("utf-8")
+
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(MAGIC)
+        f.write(np.uint32(len(header)).astype("<u4").tobytes())
+        f.write(header)
+        f.write(b"\0" * _pad(f.tell()))
+        for array in (word_offsets, pron_offsets, pron_ids):
+            f.write(array.tobytes())
+            f.write(b"\0" * _pad(f.tell()))
+        f.write(bytes(blob))
+    os.replace(tmp_path, path)
+
+
+def read_meta(path: str) -> Optional[dict]:
+    """
+    只读取文件头中的 meta, 文件不存在或格式不符时返回 None。
+    """
+    if not os.path.exists(path):
+        return None
+    with open(path, "rb") as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            return None
+        header_len = int(np.frombuffer(f.read(4), dtype="<u4")[0])
+        return json.loads(f.read(header_len).decode("utf-8"))["meta"]
+
+
+class _WordTable:
+    # 供 bisect 使用的只读序列视图
+    def __init__(self, blob, offsets):
+        self.blob = blob
+        self.offsets = offsets
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i):
+        return bytes(self.blob[self.offsets[i]:self.offsets[i + 1]])
+
+
+class PronDict:
+    """
+    mmap 打开的只读发音词典。
+
+    兼容 en_G2p 中对普通字典的用法: `word in d` 与 `d[word][0]`。
+    """
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, "rb") as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        buf = memoryview(self._mm)
+        if bytes(buf[:len(MAGIC)]) != MAGIC:
+            raise ValueError(f"{path} is not a pronunciation dictionary file")
+        pos = len(MAGIC)
+        header_len = int(np.frombuffer(buf[pos:pos + 4], dtype="<u4")[0])
+        pos += 4
+        header = json.loads(bytes(buf[pos:pos + header_len]).decode("utf-8"))
+        pos += header_len
+        pos += _pad(pos)
+
+        self.meta: dict = header["meta"]
+        self.symbols: List[str] = header["symbols"]
+        n_words = header["n_words"]
+        n_phones = header["n_phones"]
+
+        self._word_offsets = np.frombuffer(buf, dtype="<u4", count=n_words + 1, offset=pos)
+        pos += self._word_offsets.nbytes
+        pos += _pad(pos)
+        self._pron_offsets = np.frombuffer(buf, dtype="<u4", count=n_words + 1, offset=pos)
+        pos += self._pron_offsets.nbytes
+        pos += _pad(pos)
+        self._pron_ids = np.frombuffer(buf, dtype="<u2", count=n_phones, offset=pos)
+        pos += self._pron_ids.nbytes
+        pos += _pad(pos)
+        self._words = _WordTable(buf[pos:], self._word_offsets)
+
+    def __len__(self):
+        return len(self._words)
+
+    def _index(self, word: str, lo: int = 0) -> int:
+        key = word.encode("utf-8")
+        i = bisect_left(self._words, key, lo)
+        if i < len(self._words) and self._words[i] == key:
+            return i
+        return -1
+
+    def _pron(self, i: int) -> List[str]:
+        start, end = self._pron_offsets[i], self._pron_offsets[i + 1]
+        return [self.symbols[ph] for ph in self._pron_ids[start:end]]
+
+    def lookup(self, word: str) -> Optional[List[str]]:
+        """
+        返回 word 的读音(新建的列表, 可随意修改), 不存在时返回 None。
+        """
+        i = self._index(word)
+        return self._pron(i) if i >= 0 else None
+
+    def lookup_batch(self, words: Iterable[str]) -> List[Optional[List[str]]]:
+        """
+        批量查询, 结果与输入一一对应。查询词排序后依次二分, 每次查找从上一个命中位置开始。
+        """
+        words = list(words)
+        results: List[Optional[List[str]]] = [None] * len(words)
+        order = sorted(range(len(words)), key=lambda k: words[k].encode("utf-8"))
+        lo = 0
+        for k in order:
+            key = words[k].encode("utf-8")
+            i = bisect_left(self._words, key, lo)
+            lo = i
+            if i < len(self._words) and self._words[i] == key:
+                results[k] = self._pron(i)
+        return results
+
+    def __contains__(self, word: str) -> bool:
+        return self._index(word) >= 0
+
+    def __getitem__(self, word: str) -> List[List[str]]:
+        pron = self.lookup(word)
+        if pron is None:
+            raise KeyError(word)
+        return [pron]
+
+    def get(self, word: str, default=None):
+        pron = self.lookup(word)
+        return [pron] if pron is not None else default
@@ -0,0 +1,166 @@
+"""
+中文文本正则化的一致性检查与吞吐基准
+
+检查 TextNormalizer.normalize_sentence(扫描一次后按需执行规则)与逐条替换的参考实现
+normalize_sentence_cascade 输出一致, 并分别测量两者每秒处理的字符数。
+
+用法(在项目根目录执行):
+    python GPT_SoVITS/text/zh_normalization/benchmark.py
+    python GPT_SoVITS/text/zh_normalization/benchmark.py -c /path/to/train.list -r 5
+    python GPT_SoVITS/text/zh_normalization/benchmark.py --update_golden
+
+golden_corpus.jsonl 每行为 {"text": 原文, "sentences": normalize 的结果}, 由参考实现生成。
+-c 可额外指定语料文件, 每行一条文本; 按 "|" 分隔且不少于 4 段的行(数据集标注格式)取第 4 段。
+"""
+import json
+import os
+import random
+import sys
+import time
+from typing import Callable, List
+
+current_file_path = os.path.dirname(__file__)
+GOLDEN_PATH = os.path.join(current_file_path, "golden_corpus.jsonl")
+
+# 随机用例的字符集: 各规则的触发字符、数字、单位、量词与普通汉字
+FUZZ_ALPHABET = list(
+    "0123456789" "0123456789" "0123456789"
+    "年月日号:~-/.%+×÷= °℃度摄氏"
+    "⁰¹²³ⁿ" "cmdkgsl" "abcxyAB"
+    "个人元块米分秒多余几万千百"
+    "，。、；：？！" "“”《》（）()【】#@_"
+    "①αβΣπ" "０１２ＡＢ" "電腦們" "的是在了我他"
+)
+
+
+def _normalizer():
+    from text.zh_normalization.text_normlization import TextNormalizer
+    return TextNormalizer()
+
+
+def read_golden(path: str = GOLDEN_PATH) -> List[dict]:
+    with open(path, "r", encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def write_golden(texts: List[str], path: str = GOLDEN_PATH) -> None:
+    tx = _normalizer()
+    with open(path, "w", encoding="utf-8") as f:
+        for text in texts:
+            sentences = [tx.normalize_sentence_cascade(sentence) for sentence in tx._split(text)]
+            f.write(json.dumps({"text": text, "sentences": sentences}, ensure_ascii=False) + "\n")
+
+
+def read_corpus(path: str) -> List[str]:
+    texts = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip("\n")
+            parts = line.split("|")
+            text = parts[3] if len(parts) >= 4 else line
+            if text.strip():
+                texts.append(text)
+    return texts
+
+
+def check_golden(golden: List[dict]) -> List[dict]:
+    """
+    返回 normalize 结果与 golden 不一致的条目。
+    """
+    tx = _normalizer()
+    mismatches = []
+    for item in golden:
+        sentences = tx.normalize(item["text"])
+        if sentences != item["sentences"]:
+            mismatches.append({"text": item["text"], "expected": item["sentences"], "got": sentences})
+    return mismatches
+
+
+def check_cascade(sentences: List[str]) -> List[dict]:
+    """
+    逐句对比 normalize_sentence 与 normalize_sentence_cascade, 返回不一致的句子。
+    """
+    tx = _normalizer()
+    mismatches = []
+    for sentence in sentences:
+        expected = tx.normalize_sentence_cascade(sentence)
+        got = tx.normalize_sentence(sentence)
+        if got != expected:
+            mismatches.append({"text": sentence, "expected": expected, "got": got})
+    return mismatches
+
+
+def fuzz_sentences(n: int, seed: int = 0, max_len: int = 24) -> List[str]:
+    rng = random.Random(seed)
+    return ["".join(rng.choices(FUZZ_ALPHABET, k=rng.randint(1, max_len))) for _ in range(n)]
+
+
+def measure(normalize: Callable[[str], str], sentences: List[str], repeat: int) -> float:
+    """
+    返回每秒处理的字符数(取 repeat 次中最快的一次)。
+    """
+    n_chars = sum(len(sentence) for sentence in sentences)
+    best = float("inf")
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        for sentence in sentences:
+            normalize(sentence)
+        best = min(best, time.perf_counter() - t0)
+    return n_chars / best if best > 0 else float("inf")
+
+
+def _print_mismatches(name: str, mismatches: List[dict], limit: int = 10) -> None:
+    print(f"{name}: {len(mismatches)} mismatch(es)")
+    for item in mismatches[:limit]:
+        print(f"  text    : {item['text']}")
+        print(f"  expected: {item['expected']}")
+        print(f"  got     : {item['got']}")
+
+
+if __name__ == "__main__":
+    import argparse
+
+    now_dir = os.getcwd()
+    sys.path.append(now_dir)
+    sys.path.append("%s/GPT_SoVITS" % (now_dir))
+
+    parser = argparse.ArgumentParser(description="zh text normalization consistency check and benchmark")
+    parser.add_argument("-c", "--corpus", type=str, nargs="*", default=[], help="额外的语料文件")
+    parser.add_argument("-r", "--repeat", type=int, default=3, help="基准测试重复次数")
+    parser.add_argument("-f", "--fuzz", type=int, default=20000, help="随机用例数量, 0 为不做随机对比")
+    parser.add_argument("--update_golden", action="store_true", help="用参考实现重新生成 golden_corpus.jsonl")
+    args = parser.parse_args()
+
+    golden = read_golden()
+    if args.update_golden:
+        write_golden([item["text"] for item in golden])
+        golden = read_golden()
+        print(f"golden corpus updated: {GOLDEN_PATH}")
+
+    failed = False
+    mismatches = check_golden(golden)
+    _print_mismatches("golden corpus", mismatches)
+    failed |= bool(mismatches)
+
+    tx = _normalizer()
+    texts = [item["text"] for item in golden]
+    for path in args.corpus:
+        texts.extend(read_corpus(path))
+    sentences = [sentence for text in texts for sentence in tx._split(text)]
+    mismatches = check_cascade(sentences)
+    _print_mismatches("corpus vs cascade", mismatches)
+    failed |= bool(mismatches)
+
+    if args.fuzz > 0:
+        mismatches = check_cascade(fuzz_sentences(args.fuzz))
+        _print_mismatches("fuzz vs cascade", mismatches)
+        failed |= bool(mismatches)
+
+    n_chars = sum(len(sentence) for sentence in sentences)
+    print(f"benchmark: {len(sentences)} sentences, {n_chars} chars, best of {args.repeat}")
+    cascade_speed = measure(tx.normalize_sentence_cascade, sentences, args.repeat)
+    speed = measure(tx.normalize_sentence, sentences, args.repeat)
+    print(f"  cascade : {cascade_speed:,.0f} chars/s")
+    print(f"  compiled: {speed:,.0f} chars/s ({speed / cascade_speed:.2f}x)")
+
+    sys.exit(1 if failed else 0)
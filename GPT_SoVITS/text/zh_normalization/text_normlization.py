@@ -14,6 +14,7 @@
 import re
 from typing import List
 
+from .char_convert import t2s_dict
 from .char_convert import tranditional_to_simplified
 from .chronology import RE_DATE
 from .chronology import RE_DATE2
@@ -56,6 +57,89 @@ from .quantifier import replace_measure
 from .quantifier import replace_temperature
 
 
+def _compose_char_table() -> dict:
+    # 繁转简 + 全角字母 + 全角数字 合成一张转换表, translate 一次完成
+    # (F2H_SPACE 的键不是码位, 原先的 translate(F2H_SPACE) 不生效, 这里同样不处理)
+    table = {}
+    for code in set(map(ord, t2s_dict)) | set(F2H_ASCII_LETTERS) | set(F2H_DIGITS):
+        char = t2s_dict.get(chr(code), chr(code))
+        char = chr(F2H_ASCII_LETTERS.get(ord(char), ord(char)))
+        char = chr(F2H_DIGITS.get(ord(char), ord(char)))
+        if char != chr(code):
+            table[code] = char
+    return table
+
+
+CHAR_TABLE = _compose_char_table()
+
+# _post_replace 中的逐字替换与特殊字符过滤, 合成一张转换表
+POST_REPLACE_MAP = {
+    '/': '每',
+    '①': '一', '②': '二', '③': '三', '④': '四', '⑤': '五',
+    '⑥': '六', '⑦': '七', '⑧': '八', '⑨': '九', '⑩': '十',
+    'α': '阿尔法', 'β': '贝塔', 'γ': '伽玛', 'Γ': '伽玛',
+    'δ': '德尔塔', 'Δ': '德尔塔', 'ε': '艾普西龙', 'ζ': '捷塔',
+    'η': '依塔', 'θ': '西塔', 'Θ': '西塔', 'ι': '艾欧塔',
+    'κ': '喀帕', 'λ': '拉姆达', 'Λ': '拉姆达', 'μ': '缪',
+    'ν': '拗', 'ξ': '克西', 'Ξ': '克西', 'ο': '欧米克伦',
+    'π': '派', 'Π': '派', 'ρ': '肉', 'ς': '西格玛',
+    'Σ': '西格玛', 'σ': '西格玛', 'τ': '套', 'υ': '宇普西龙',
+    'φ': '服艾', 'Φ': '服艾', 'χ': '器', 'ψ': '普赛',
+    'Ψ': '普赛', 'ω': '欧米伽', 'Ω': '欧米伽',
+    '+': '加', '-': '减', '×': '乘', '÷': '除', '=': '等',
+}
+POST_REMOVE_CHARS = '-—《》【】<=>{}()（）#&@“”^_|\\'
+POST_TABLE = str.maketrans({
+    **{char: None for char in POST_REMOVE_CHARS},
+    **POST_REPLACE_MAP,
+})
+
+RE_SPECIAL_CHARS = re.compile(r'[——《》【】<>{}()（）#&@“”^_|\\]')
+RE_NEWLINES = re.compile(r'\n+')
+
+# 各条规则的触发条件: (是否需要数字, 至少包含其中一个字符)
+# 句中不满足触发条件的规则不可能匹配, 扫描一遍句子后只执行可能命中的规则, 顺序与逐条替换一致
+DIGIT = True
+RULES = [
+    (DIGIT, '年', lambda s: RE_DATE.sub(replace_date, s)),
+    (DIGIT, '- /.', lambda s: RE_DATE2.sub(replace_date2, s)),
+    # range first
+    (DIGIT, ':', lambda s: RE_TIME_RANGE.sub(replace_time, s)),
+    (DIGIT, ':', lambda s: RE_TIME.sub(replace_time, s)),
+    # 处理~波浪号作为至的替换
+    (DIGIT, '~', lambda s: RE_TO_RANGE.sub(replace_to_range, s)),
+    (DIGIT, '°℃度', lambda s: RE_TEMPERATURE.sub(replace_temperature, s)),
+    # measure_dict 中每个单位都含 m/d/k/s 之一
+    (False, 'mdks', replace_measure),
+]
+# 处理数学运算与次方, 次方会引入新的数字, 单独处理
+ASMD_CHARS = '+-×÷='
+POWER_CHARS = '⁰¹²³⁴⁵⁶⁷⁸⁹ˣʸⁿ'
+NUMBER_RULES = [
+    (DIGIT, '/', lambda s: RE_FRAC.sub(replace_frac, s)),
+    (DIGIT, '%', lambda s: RE_PERCENTAGE.sub(replace_percentage, s)),
+    (DIGIT, None, lambda s: RE_MOBILE_PHONE.sub(replace_mobile, s)),
+    (DIGIT, None, lambda s: RE_TELEPHONE.sub(replace_phone, s)),
+    (DIGIT, None, lambda s: RE_NATIONAL_UNIFORM_NUMBER.sub(replace_phone, s)),
+    (DIGIT, '-~', lambda s: RE_RANGE.sub(replace_range, s)),
+    (DIGIT, '-', lambda s: RE_INTEGER.sub(replace_negative_num, s)),
+    (DIGIT, '.', lambda s: RE_DECIMAL_NUM.sub(replace_number, s)),
+    (DIGIT, None, lambda s: RE_POSITIVE_QUANTIFIERS.sub(replace_positive_quantifier, s)),
+    (DIGIT, None, lambda s: RE_DEFAULT_NUM.sub(replace_default_num, s)),
+    (DIGIT, None, lambda s: RE_NUMBER.sub(replace_number, s)),
+]
+
+
+def _apply_rules(rules, sentence: str, chars: set, has_digit: bool) -> str:
+    for need_digit, triggers, rule in rules:
+        if need_digit and not has_digit:
+            continue
+        if triggers is not None and chars.isdisjoint(triggers):
+            continue
+        sentence = rule(sentence)
+    return sentence
+
+
 class TextNormalizer():
     def __init__(self):
         self.SENTENCE_SPLITOR = re.compile(r'([：、，；。？！,;?!][”’]?)')
@@ -71,10 +155,10 @@ class TextNormalizer():
         if lang == "zh":
             text = text.replace(" ", "")
             # 过滤掉特殊字符
-            text = re.sub(r'[——《》【】<>{}()（）#&@“”^_|\\]', '', text)
+            text = RE_SPECIAL_CHARS.sub('', text)
         text = self.SENTENCE_SPLITOR.sub(r'\1\n', text)
         text = text.strip()
-        sentences = [sentence.strip() for sentence in re.split(r'\n+', text)]
+        sentences = [sentence.strip() for sentence in RE_NEWLINES.split(text)]
         return sentences
 
     def _post_replace(self, sentence: str) -> str:
@@ -127,6 +211,30 @@ class TextNormalizer():
         return sentence
 
     def normalize_sentence(self, sentence: str) -> str:
+        # basic character conversions
+        sentence = sentence.translate(CHAR_TABLE)
+
+        # 扫描一次句子, 只执行可能命中的规则
+        chars = set(sentence)
+        has_digit = any(char.isdecimal() for char in chars)
+
+        # number related NSW verbalization
+        sentence = _apply_rules(RULES, sentence, chars, has_digit)
+
+        if not chars.isdisjoint(ASMD_CHARS):
+            while RE_ASMD.search(sentence):
+                sentence = RE_ASMD.sub(replace_asmd, sentence)
+        if not chars.isdisjoint(POWER_CHARS):
+            sentence = RE_POWER.sub(replace_power, sentence)
+            has_digit = True
+
+        sentence = _apply_rules(NUMBER_RULES, sentence, chars, has_digit)
+        return sentence.translate(POST_TABLE)
+
+    def normalize_sentence_cascade(self, sentence: str) -> str:
+        """
+        逐条 re.sub 的参考实现, 与 normalize_sentence 输出一致, 用于对照测试与性能基准。
+        """
         # basic character conversions
         sentence = tranditional_to_simplified(sentence)
         sentence = sentence.translate(F2H_ASCII_LETTERS).translate(
@@ -25,6 +25,8 @@
 
 `-hb` - `cnhubert路径`
 `-b` - `bert路径`
+`-mq` - `最多排队的请求数, 超出返回503, 默认0(不限制)`
+`--cpu_affinity` - `推理线程绑定的CPU, 如"0-7", 默认不绑定`
 
 ## 调用:
 
@@ -168,6 +170,7 @@ from text import cleaned_text_to_sequence
 from text.cleaner import clean_text
 from module.mel_processing import spectrogram_torch
 from tools.my_utils import load_audio
+from TTS_infer_pack.request_scheduler import QueueFullError, TTSRequestScheduler, parse_cpu_list
 import config as global_config
 import logging
 import subprocess
@@ -707,7 +710,11 @@ def handle(refer_wav_path, prompt_text, prompt_language, text, text_language, cu
     else:
         text = cut_text(text,cut_punc)
 
-    return StreamingResponse(get_tts_wav(refer_wav_path, prompt_text, prompt_language, text, text_language, top_k, top_p, temperature, speed, inp_refs), media_type="audio/"+media_type)
+    try:
+        audio = tts_worker.stream_async(get_tts_wav, refer_wav_path, prompt_text, prompt_language, text, text_language, top_k, top_p, temperature, speed, inp_refs)
+    except QueueFullError as e:
+        return JSONResponse({"code": 503, "message": str(e)}, status_code=503)
+    return StreamingResponse(audio, media_type="audio/"+media_type)
 
 
 
@@ -768,6 +775,8 @@ parser.add_argument("-st", "--sub_type", type=str, default="int16", help="音频
 parser.add_argument("-cp", "--cut_punc", type=str, default="", help="文本切分符号设定, 符号范围,.;?!、，。？！；：…")
 # 切割常用分句符为 `python ./api.py -cp ".?!。？！"`
 parser.add_argument("-hb", "--hubert_path", type=str, default=g_config.cnhubert_path, help="覆盖config.cnhubert_path")
+parser.add_argument("-mq", "--max_queue", type=int, default=0, help="最多排队的请求数, 超出返回503, 0 为不限制")
+parser.add_argument("--cpu_affinity", type=str, default="", help="推理线程绑定的CPU, 如 0-7")
 parser.add_argument("-b", "--bert_path", type=str, default=g_config.bert_path, help="覆盖config.bert_path")
 
 args = parser.parse_args()
@@ -847,6 +856,8 @@ else:
     ssl_model = ssl_model.to(device)
 change_gpt_sovits_weights(gpt_path = gpt_path, sovits_path = sovits_path)
 
+# 推理与切换模型都在同一个工作线程中依次执行, 不阻塞事件循环
+tts_worker = TTSRequestScheduler(max_queue=args.max_queue, cpu_affinity=parse_cpu_list(args.cpu_affinity), name="tts-worker")
 
 
 # --------------------------------
@@ -857,8 +868,9 @@ app = FastAPI()
 @app.post("/set_model")
 async def set_model(request: Request):
     json_post_raw = await request.json()
-    return change_gpt_sovits_weights(
-        gpt_path = json_post_raw.get("gpt_model_path"), 
+    return await tts_worker.call_async(
+        change_gpt_sovits_weights,
+        gpt_path = json_post_raw.get("gpt_model_path"),
         sovits_path = json_post_raw.get("sovits_model_path")
     )
 
@@ -868,7 +880,7 @@ async def set_model(
         gpt_model_path: str = None,
         sovits_model_path: str = None,
 ):
-    return change_gpt_sovits_weights(gpt_path = gpt_model_path, sovits_path = sovits_model_path)
+    return await tts_worker.call_async(change_gpt_sovits_weights, gpt_path = gpt_model_path, sovits_path = sovits_model_path)
 
 
 @app.post("/control")
@@ -7,6 +7,20 @@
     `-a` - `绑定地址, 默认"127.0.0.1"`
     `-p` - `绑定端口, 默认9880`
     `-c` - `TTS配置文件路径, 默认"GPT_SoVITS/configs/tts_infer.yaml"`
+    `--max_batch_requests` - `最多合并推理的并发请求数, 默认8, 1为不合并`
+    `--batch_wait_ms` - `等待可合并请求的时间(毫秒), 默认20`
+    `--devices` - `推理设备列表, 如"cuda:0,cuda:1", 每个设备一个推理线程, 默认使用配置文件中的设备`
+    `--max_queue` - `每个推理线程最多排队的请求数, 超出返回503, 默认0(不限制)`
+    `--cpu_affinity` - `推理线程绑定的CPU, 如"0-7", 多个推理线程用";"分隔, 如"0-7;8-15"`
+    `--response_cache_mb` - `固定 seed 的非流式请求的响应缓存内存上限(MB), 默认0(不启用)`
+    `--response_cache_dir` - `响应缓存的磁盘目录, 默认为空(不启用)`
+    `--response_cache_disk_mb` - `响应缓存的磁盘上限(MB), 默认1024`
+    `--trace_file` - `每个请求的追踪 span (分句, T2S, VITS, 后处理等) 以 JSON 行写入该文件, 默认为空(不写)`
+    `--trace_otel` - `通过 OpenTelemetry 导出追踪 span, 需安装 opentelemetry-sdk 并配置导出器`
+    `--profile_dir` - `/profile 采集的 torch.profiler 结果的输出目录, 默认为空(不开放 /profile)`
+    `--warmup` - `启动后先在每个推理线程上预热 (各语言前端, 参考音频, 各批大小的 T2S/VITS), 完成前 /ready 返回503; 也可在配置文件中设置 warmup: true`
+
+每个 /tts 响应的 X-Request-ID 头为该请求的 id, 与追踪 span 中的 request_id 对应
 
 ## 调用:
 
@@ -94,25 +108,70 @@ RESP:
 成功: 返回"success", http code 200
 失败: 返回包含错误信息的 json, http code 400
 
+
+### 性能采集
+
+endpoint: `/profile`
+
+在推理线程上开启 torch.profiler (CPU, 有 CUDA 时包括 CUDA), 采集接下来 requests 个请求或 seconds 秒 (先到为准),
+结束后在 --profile_dir 中写入 Chrome trace (.trace.json), 按算子 (.ops.txt) 与按调用栈 (.stacks.txt, .folded) 汇总的耗时;
+不带 requests/seconds 时返回当前/最近一次采集的状态与文件路径
+worker: 推理线程序号, 默认0 (对应 --devices 中的设备)
+
+GET:
+```
+http://127.0.0.1:9880/profile?requests=20&worker=0
+```
+
+RESP: 采集状态, 未设置 --profile_dir 时 http code 403
+
+
+### 就绪探针
+
+endpoint: `/ready`
+
+开启预热 (--warmup 或配置文件中 warmup: true) 时, 所有推理线程预热完成前返回 http code 503, 之后返回 200;
+预热的语言/批大小/参考音频等见配置文件中的 warmup_* 项
+
+GET:
+```
+http://127.0.0.1:9880/ready
+```
+
+RESP: {"ready": bool, "workers": [{"name": 推理线程, "warmup": 预热报告 (各阶段耗时与错误), 未预热为 null}]}
+
+
+### 监控指标
+
+endpoint: `/metrics`
+
+GET:
+```
+http://127.0.0.1:9880/metrics
+```
+
+RESP: Prometheus 文本格式的指标, 包括各阶段耗时直方图 (tts_stage_seconds: 前端 G2P/BERT, 参考音频处理, T2S prefill/逐 token 解码, VITS, 编码),
+批大小, T2S 每秒解码 token 数, 实时率, 首段延迟, 队列深度, 各缓存命中率与显存占用
+
 """
 
 import os
 import sys
 import traceback
-from typing import Generator, Optional, Union
+from typing import AsyncIterator, Optional, Union
 
 now_dir = os.getcwd()
 sys.path.append(now_dir)
 sys.path.append("%s/GPT_SoVITS" % (now_dir))
 import json
 import argparse
+import asyncio
 import signal
-import subprocess
-import wave
+import uuid
 from io import BytesIO
+from time import time as ttime
 import glob
 import numpy as np
-import soundfile as sf
 import uvicorn
 from fastapi import FastAPI, File, Form, HTTPException, Response, UploadFile, Query
 from fastapi.responses import JSONResponse, StreamingResponse
@@ -123,6 +182,16 @@ from GPT_SoVITS.TTS_infer_pack.text_segmentation_method import (
     get_method_names as get_cut_method_names,
 )
 from GPT_SoVITS.TTS_infer_pack.TTS import TTS, TTS_Config
+from GPT_SoVITS.TTS_infer_pack.stream_encoder import MEDIA_TYPES, content_type, encode_audio, open_stream_encoder
+from GPT_SoVITS.TTS_infer_pack.response_cache import ResponseCache
+from GPT_SoVITS.TTS_infer_pack import metrics, tracing
+from GPT_SoVITS.TTS_infer_pack.profiler_capture import ProfilerCapture
+from GPT_SoVITS.TTS_infer_pack.request_scheduler import (
+    QueueFullError,
+    SchedulerPool,
+    TTSRequestScheduler,
+    parse_cpu_list,
+)
 from tools.i18n.i18n import I18nAuto
 
 # print(sys.path)
@@ -135,7 +204,24 @@ parser.add_argument("-c", "--tts_config", type=str, default="GPT_SoVITS/configs/
 parser.add_argument("-a", "--bind_addr", type=str, default="0.0.0.0", help="default: 0.0.0.0")
 
 parser.add_argument("-p", "--port", type=int, default="9880", help="default: 9880")
+parser.add_argument("--max_batch_requests", type=int, default=8, help="最多合并推理的并发请求数, 1 为不合并")
+parser.add_argument("--batch_wait_ms", type=float, default=20, help="等待可合并请求的时间(毫秒)")
+parser.add_argument("--devices", type=str, default="", help="推理设备列表, 如 cuda:0,cuda:1, 每个设备一个推理线程; 默认使用配置文件中的设备")
+parser.add_argument("--max_queue", type=int, default=0, help="每个推理线程最多排队的请求数, 超出返回503, 0 为不限制")
+parser.add_argument("--cpu_affinity", type=str, default="", help="推理线程绑定的CPU, 如 0-7; 多个推理线程用 ; 分隔, 如 0-7;8-15")
+parser.add_argument("--response_cache_mb", type=float, default=0, help="固定 seed 请求的响应缓存内存上限(MB), 0 为不启用内存缓存")
+parser.add_argument("--response_cache_dir", type=str, default="", help="响应缓存的磁盘目录, 为空不启用磁盘缓存")
+parser.add_argument("--response_cache_disk_mb", type=float, default=1024, help="响应缓存的磁盘上限(MB)")
+parser.add_argument("--trace_file", type=str, default="", help="每个请求的追踪 span 以 JSON 行写入该文件, 为空不写")
+parser.add_argument("--trace_otel", action="store_true", default=False, help="通过 OpenTelemetry 导出追踪 span (需安装 opentelemetry-sdk 并配置导出器)")
+parser.add_argument("--profile_dir", type=str, default="", help="profiler 采集结果的输出目录, 为空不开放 /profile")
+parser.add_argument("--warmup", action="store_true", default=False, help="启动后先在每个推理线程上预热, 完成前 /ready 返回503")
 args = parser.parse_args()
+tracing.configure(args.trace_file, args.trace_otel)
+
+# 固定 seed 的请求结果可复现, 按全部推理输入与模型权重的内容哈希缓存编码后的音频
+response_cache = ResponseCache(args.response_cache_mb, args.response_cache_dir, args.response_cache_disk_mb) \
+    if args.response_cache_mb > 0 or args.response_cache_dir else None
 config_path = args.tts_config
 # device = args.device
 port = args.port
@@ -146,9 +232,46 @@ argv = sys.argv
 if config_path in [None, ""]:
     config_path = "GPT-SoVITS/configs/tts_infer.yaml"
 
-tts_config = TTS_Config(config_path)
-print(tts_config)
-tts_pipeline = TTS(tts_config)
+# 推理在每个设备各自的工作线程中执行, 不阻塞事件循环; 参考音频与参数相同的非流式请求合并成一批推理
+devices = [device.strip() for device in args.devices.split(",") if device.strip()] or [None]
+cpu_affinities = args.cpu_affinity.split(";")
+tts_schedulers = []
+for i, device in enumerate(devices):
+    tts_config = TTS_Config(config_path)
+    if device is not None:
+        # 指定的设备只用于本推理线程, 不写回配置文件
+        tts_config.persisted_device = str(tts_config.device)
+        tts_config.device = device
+    # 各推理线程共用同一配置文件, 只由第一个写入(如切换权重后)
+    tts_config.persist = i == 0
+    print(tts_config)
+    affinity = parse_cpu_list(cpu_affinities[i] if len(cpu_affinities) == len(devices) else args.cpu_affinity.replace(";", ","))
+    tts_schedulers.append(TTSRequestScheduler(TTS(tts_config),
+                                              args.max_batch_requests,
+                                              args.batch_wait_ms,
+                                              max_queue=args.max_queue,
+                                              cpu_affinity=affinity,
+                                              name=f"tts-worker-{i}"))
+tts_pool = SchedulerPool(tts_schedulers)
+tts_pipeline = tts_schedulers[0].tts
+
+# 预热作为每个推理线程的第一个任务, 预热期间到达的请求排在其后; 全部完成前 /ready 返回 503
+warmup_futures = [scheduler.call(scheduler.tts.warmup) for scheduler in tts_schedulers
+                  if args.warmup or scheduler.tts.configs.warmup]
+
+# /metrics 抓取时才读取的指标: 队列深度, 各缓存命中率, 显存
+metrics.REGISTRY.add_collector(metrics.scheduler_collector(lambda: tts_schedulers))
+metrics.REGISTRY.add_collector(metrics.cache_collector("prompt", lambda: [s.tts.get_prompt_cache_report() for s in tts_schedulers]))
+metrics.REGISTRY.add_collector(metrics.cache_collector("semantic", lambda: [s.tts.get_semantic_cache_report() for s in tts_schedulers]))
+if response_cache is not None:
+    metrics.REGISTRY.add_collector(metrics.cache_collector("response", lambda: [response_cache.report()]))
+metrics.REGISTRY.add_collector(metrics.device_memory_collector)
+
+
+async def run_on_all_workers(fn_name: str, *args):
+    # 切换权重/参考音频时所有推理线程的模型都要更新
+    futures = tts_pool.broadcast(lambda scheduler: scheduler.call(getattr(scheduler.tts, fn_name), *args))
+    await asyncio.gather(*[asyncio.wrap_future(future) for future in futures])
 
 
 APP = FastAPI(servers=[{"url": "https://cloud-gateway.ces.myfiinet.com/ai-audio/tts"}, {"url": "http://10.20.216.222:6616"}])
@@ -248,80 +371,18 @@ class TTS_Request(BaseModel):
 
 
 ### modify from https://github.com/RVC-Boss/GPT-SoVITS/pull/894/files
-def pack_ogg(io_buffer: BytesIO, data: np.ndarray, rate: int):
-    with sf.SoundFile(io_buffer, mode="w", samplerate=rate, channels=1, format="ogg") as audio_file:
-        audio_file.write(data)
-    return io_buffer
-
-
-def pack_raw(io_buffer: BytesIO, data: np.ndarray, rate: int):
-    io_buffer.write(data.tobytes())
-    return io_buffer
-
-
-def pack_wav(io_buffer: BytesIO, data: np.ndarray, rate: int):
-    io_buffer = BytesIO()
-    sf.write(io_buffer, data, rate, format="wav")
-    return io_buffer
-
-
-def pack_aac(io_buffer: BytesIO, data: np.ndarray, rate: int):
-    process = subprocess.Popen(
-        [
-            "ffmpeg",
-            "-f",
-            "s16le",  # 输入16位有符号小端整数PCM
-            "-ar",
-            str(rate),  # 设置采样率
-            "-ac",
-            "1",  # 单声道
-            "-i",
-            "pipe:0",  # 从管道读取输入
-            "-c:a",
-            "aac",  # 音频编码器为AAC
-            "-b:a",
-            "192k",  # 比特率
-            "-vn",  # 不包含视频
-            "-f",
-            "adts",  # 输出AAC数据流格式
-            "pipe:1",  # 将输出写入管道
-        ],
-        stdin=subprocess.PIPE,
-        stdout=subprocess.PIPE,
-        stderr=subprocess.PIPE,
-    )
-    out, _ = process.communicate(input=data.tobytes())
-    io_buffer.write(out)
-    return io_buffer
-
-
 def pack_audio(io_buffer: BytesIO, data: np.ndarray, rate: int, media_type: str):
-    if media_type == "ogg":
-        io_buffer = pack_ogg(io_buffer, data, rate)
-    elif media_type == "aac":
-        io_buffer = pack_aac(io_buffer, data, rate)
-    elif media_type == "wav":
-        io_buffer = pack_wav(io_buffer, data, rate)
-    else:
-        io_buffer = pack_raw(io_buffer, data, rate)
+    # 整段音频编码, 流式输出见 tts_handle 中的 streaming_generator
+    with metrics.stage_timer("pack"):
+        io_buffer.write(encode_audio(data, rate, media_type))
     io_buffer.seek(0)
     return io_buffer
 
 
-# from https://huggingface.co/spaces/coqui/voice-chat-with-mistral/blob/main/app.py
-def wave_header_chunk(frame_input=b"", channels=1, sample_width=2, sample_rate=32000):
-    # This will create a wave header then append the frame input
-    # It should be first on a streaming wav file
-    # Other frames better should not have it (else you will hear some artifacts each chunk start)
-    wav_buf = BytesIO()
-    with wave.open(wav_buf, "wb") as vfout:
-        vfout.setnchannels(channels)
-        vfout.setsampwidth(sample_width)
-        vfout.setframerate(sample_rate)
-        vfout.writeframes(frame_input)
-
-    wav_buf.seek(0)
-    return wav_buf.read()
+def pack_chunk(fn, *args):
+    # 流式响应每个分段的编码 (encoder.encode / encoder.close)
+    with metrics.stage_timer("pack"):
+        return fn(*args)
 
 
 def handle_control(command: str):
@@ -336,7 +397,6 @@ def check_params(req: dict):
     text: str = req.get("text", "")
     text_lang: str = req.get("text_lang", "")
     ref_audio_path: str = req.get("ref_audio_path", "")
-    streaming_mode: bool = req.get("streaming_mode", False)
     media_type: str = req.get("media_type", "wav")
     prompt_lang: str = req.get("prompt_lang", "")
     text_split_method: str = req.get("text_split_method", "cut5")
@@ -353,10 +413,8 @@ def check_params(req: dict):
         return JSONResponse(status_code=400, content={"message": "prompt_lang is required"})
     elif prompt_lang.lower() not in tts_config.languages:
         return JSONResponse(status_code=400, content={"message": f"prompt_lang: {prompt_lang} is not supported in version {tts_config.version}"})
-    if media_type not in ["wav", "raw", "ogg", "aac"]:
+    if media_type not in MEDIA_TYPES:
         return JSONResponse(status_code=400, content={"message": f"media_type: {media_type} is not supported"})
-    elif media_type == "ogg" and not streaming_mode:
-        return JSONResponse(status_code=400, content={"message": "ogg format is not supported in non-streaming mode"})
 
     if text_split_method not in cut_method_names:
         return JSONResponse(status_code=400, content={"message": f"text_split_method:{text_split_method} is not supported"})
@@ -387,7 +445,7 @@ async def tts_handle(req: dict):
                 "speed_factor":1.0,           # float. control the speed of the synthesized audio.
                 "fragment_interval":0.3,      # float. to control the interval of the audio fragment.
                 "seed": -1,                   # int. random seed for reproducibility.
-                "media_type": "wav",          # str. media type of the output audio, support "wav", "raw", "ogg", "aac".
+                "media_type": "wav",          # str. media type of the output audio, support "wav", "raw", "ogg", "opus", "mp3", "aac".
                 "streaming_mode": False,      # bool. whether to return a streaming response.
                 "parallel_infer": True,       # bool.(optional) whether to use parallel inference.
                 "repetition_penalty": 1.35    # float.(optional) repetition penalty for T2S model.
@@ -395,7 +453,19 @@ async def tts_handle(req: dict):
     returns:
         StreamingResponse: audio stream response.
     """
-
+    # 每个请求一个 id, 在 API 与推理线程中的 span 都带上它, 并通过 X-Request-ID 返回给客户端
+    request_id = uuid.uuid4().hex
+    req["request_id"] = request_id
+    with tracing.span("api.tts", scope={"request_id": request_id},
+                      streaming=bool(req.get("streaming_mode", False)), media_type=req.get("media_type", "wav")) as api_span:
+        req["trace_context"] = api_span.context()
+        response = await _tts_handle(req)
+        api_span.set_attribute("status_code", response.status_code)
+    response.headers["X-Request-ID"] = request_id
+    return response
+
+
+async def _tts_handle(req: dict):
     streaming_mode = req.get("streaming_mode", False)
     return_fragment = req.get("return_fragment", False)
     media_type = req.get("media_type", "wav")
@@ -408,16 +478,35 @@ async def tts_handle(req: dict):
         req["return_fragment"] = True
 
     try:
-        tts_generator = tts_pipeline.run(req)
-
+        tts_scheduler = tts_pool.pick()
         if streaming_mode:
-
-            def streaming_generator(tts_generator: Generator, media_type: str):
-                if media_type == "wav":
-                    yield wave_header_chunk()
-                    media_type = "raw"
-                for sr, chunk in tts_generator:
-                    yield pack_audio(BytesIO(), chunk, sr, media_type).getvalue()
+            tts_generator = tts_scheduler.submit_stream_async(req)
+
+            async def streaming_generator(tts_generator: AsyncIterator, media_type: str):
+                # 整个响应共用一个编码器, 输出一条连续的码流
+                encoder = None
+                t_stream = ttime()
+                chunks, size = 0, 0
+                try:
+                    async for sr, chunk in tts_generator:
+                        if encoder is None:
+                            encoder = await asyncio.to_thread(open_stream_encoder, media_type, sr)
+                        data = await asyncio.to_thread(pack_chunk, encoder.encode, chunk)
+                        chunks += 1
+                        if data:
+                            size += len(data)
+                            yield data
+                    if encoder is not None:
+                        data = await asyncio.to_thread(pack_chunk, encoder.close)
+                        if data:
+                            size += len(data)
+                            yield data
+                finally:
+                    if encoder is not None:
+                        encoder.abort()
+                    # 流式响应在 api.tts 返回后才发送, 单独记录整个发送过程
+                    tracing.record("api.stream", t_stream, parent=req["trace_context"],
+                                   scope={"request_id": req["request_id"]}, chunks=chunks, bytes=size)
 
             # _media_type = f"audio/{media_type}" if not (streaming_mode and media_type in ["wav", "raw"]) else f"audio/x-{media_type}"
             return StreamingResponse(
@@ -425,17 +514,64 @@ async def tts_handle(req: dict):
                     tts_generator,
                     media_type,
                 ),
-                media_type=f"audio/{media_type}",
+                media_type=content_type(media_type),
             )
 
         else:
-            sr, audio_data = next(tts_generator)
-            audio_data = pack_audio(BytesIO(), audio_data, sr, media_type).getvalue()
-            return Response(audio_data, media_type=f"audio/{media_type}")
+            cache_key = None
+            if response_cache is not None:
+                cache_key = await asyncio.to_thread(tts_scheduler.tts.response_fingerprint, req)
+                audio_data = await asyncio.to_thread(response_cache.get, cache_key, media_type)
+                if audio_data is not None:
+                    tracing.set_attributes(response_cache="hit")
+                    return Response(audio_data, media_type=content_type(media_type))
+            sr, audio_data = await tts_scheduler.run_async(req)
+            with tracing.span("api.pack", samples=len(audio_data)):
+                audio_data = (await asyncio.to_thread(pack_audio, BytesIO(), audio_data, sr, media_type)).getvalue()
+            # 推理期间换了权重则指纹改变, 不缓存
+            if cache_key is not None and cache_key == await asyncio.to_thread(tts_scheduler.tts.response_fingerprint, req):
+                await asyncio.to_thread(response_cache.put, cache_key, media_type, audio_data)
+            return Response(audio_data, media_type=content_type(media_type))
+    except QueueFullError as e:
+        return JSONResponse(status_code=503, content={"message": "server busy", "Exception": str(e)})
     except Exception as e:
         return JSONResponse(status_code=400, content={"message": "tts failed", "Exception": str(e)})
 
 
+@APP.get("/metrics")
+async def get_metrics():
+    # Prometheus 文本格式
+    content = await asyncio.to_thread(metrics.REGISTRY.render)
+    return Response(content, media_type="text/plain; version=0.0.4; charset=utf-8")
+
+
+@APP.get("/ready")
+async def ready():
+    # 就绪探针: 预热完成(成功或失败)后就绪, 预热报告中带各阶段耗时与错误
+    is_ready = all(future.done() for future in warmup_futures)
+    workers = [{"name": scheduler.name, "warmup": scheduler.tts.warmup_report} for scheduler in tts_schedulers]
+    return JSONResponse(status_code=200 if is_ready else 503, content={"ready": is_ready, "workers": workers})
+
+
+@APP.get("/profile")
+async def profile(requests: int = 0, seconds: float = 0, worker: int = 0,
+                  with_stack: bool = True, record_shapes: bool = False):
+    # 在推理线程上开启 torch.profiler, 采集接下来 requests 个请求或 seconds 秒; 不带 requests/seconds 时返回采集状态
+    if args.profile_dir in [None, ""]:
+        return JSONResponse(status_code=403, content={"message": "profiling is disabled, start the server with --profile_dir"})
+    if not 0 <= worker < len(tts_schedulers):
+        return JSONResponse(status_code=400, content={"message": f"worker must be in [0, {len(tts_schedulers)})"})
+    scheduler = tts_schedulers[worker]
+    if requests <= 0 and seconds <= 0:
+        return JSONResponse(status_code=200, content=scheduler.capture.report() if scheduler.capture is not None else {"state": "idle"})
+    try:
+        capture = ProfilerCapture(args.profile_dir, scheduler.name, requests, seconds, with_stack, record_shapes)
+        await asyncio.wrap_future(scheduler.start_capture(capture))
+    except Exception as e:
+        return JSONResponse(status_code=400, content={"message": "start profiler failed", "Exception": str(e)})
+    return JSONResponse(status_code=200, content=capture.report())
+
+
 @APP.get("/control")
 async def control(command: str = None):
     if command is None:
@@ -540,7 +676,7 @@ async def get_speakers():
 @APP.get("/set_refer_audio")
 async def set_refer_aduio(refer_audio_path: str = None):
     try:
-        tts_pipeline.set_ref_audio(refer_audio_path)
+        await run_on_all_workers("set_ref_audio", refer_audio_path)
     except Exception as e:
         return JSONResponse(status_code=400, content={"message": "set refer audio failed", "Exception": str(e)})
     return JSONResponse(status_code=200, content={"message": "success"})
@@ -570,7 +706,10 @@ async def set_gpt_weights(weights_path: str = None):
     try:
         if weights_path in ["", None]:
             return JSONResponse(status_code=400, content={"message": "gpt weight path is required"})
-        tts_pipeline.init_t2s_weights(weights_path)
+        await run_on_all_workers("init_t2s_weights", weights_path)
+        if response_cache is not None:
+            # 旧权重的条目不会再命中, 释放内存; 磁盘条目按内容寻址, 换回旧权重时仍然有效
+            response_cache.clear_memory()
     except Exception as e:
         return JSONResponse(status_code=400, content={"message": "change gpt weight failed", "Exception": str(e)})
 
@@ -582,7 +721,10 @@ async def set_sovits_weights(weights_path: str = None):
     try:
         if weights_path in ["", None]:
             return JSONResponse(status_code=400, content={"message": "sovits weight path is required"})
-        tts_pipeline.init_vits_weights(weights_path)
+        await run_on_all_workers("init_vits_weights", weights_path)
+        if response_cache is not None:
+            # 旧权重的条目不会再命中, 释放内存; 磁盘条目按内容寻址, 换回旧权重时仍然有效
+            response_cache.clear_memory()
     except Exception as e:
         return JSONResponse(status_code=400, content={"message": "change sovits weight failed", "Exception": str(e)})
     return JSONResponse(status_code=200, content={"message": "success"})
@@ -7,6 +7,18 @@
     `-a` - `绑定地址, 默认"127.0.0.1"`
     `-p` - `绑定端口, 默认9880`
     `-c` - `TTS配置文件路径, 默认"GPT_SoVITS/configs/tts_infer.yaml"`
+    `--max_queue` - `每个推理线程最多排队的请求数, 超出返回503, 默认0(不限制)`
+    `--cpu_affinity` - `推理线程绑定的CPU, 如"0-7", 默认不绑定`
+    `--voice_vram_mb` - `常驻显存的声音(GPT+SoVITS权重)总预算(MB), 超出时最久未用的声音移到内存, 默认2048, 0 为不限制`
+    `--response_cache_mb` - `固定 seed 的非流式请求的响应缓存内存上限(MB), 默认0(不启用)`
+    `--response_cache_dir` - `响应缓存的磁盘目录, 默认为空(不启用)`
+    `--response_cache_disk_mb` - `响应缓存的磁盘上限(MB), 默认1024`
+    `--trace_file` - `每个请求的追踪 span (分句, T2S, VITS, 后处理等) 以 JSON 行写入该文件, 默认为空(不写)`
+    `--trace_otel` - `通过 OpenTelemetry 导出追踪 span, 需安装 opentelemetry-sdk 并配置导出器`
+    `--profile_dir` - `/profile 采集的 torch.profiler 结果的输出目录, 默认为空(不开放 /profile)`
+    `--warmup_voices` - `启动时加载并预热的声音 (tts_infer yaml 路径, 逗号分隔), 完成前 /ready 返回503; 默认为空`
+
+每个 /tts 响应的 X-Request-ID 头为该请求的 id, 与追踪 span 中的 request_id 对应
 
 ## 调用:
 
@@ -36,7 +48,7 @@ POST:
     "speed_factor":1.0,                                         # float.(optional) control the speed of the synthesized audio.
     "fragment_interval":0.3,                                    # float.(optional) to control the interval of the audio fragment.
     "seed": -1,                                                 # int.(optional) random seed for reproducibility.
-    "media_type": "wav",                                        # str.(optional) media type of the output audio, support "wav", "raw", "ogg", "aac".
+    "media_type": "wav",                                        # str.(optional) media type of the output audio, support "wav", "raw", "ogg", "opus", "mp3", "aac".
     "streaming_mode": false,                                    # bool.(optional) whether to return a streaming response.
     "parallel_infer": True,                                     # bool.(optional) whether to use parallel inference.
     "repetition_penalty": 1.35,                                 # float.(optional) repetition penalty for T2S model.
@@ -96,31 +108,75 @@ RESP:
 成功: 返回"success", http code 200
 失败: 返回包含错误信息的 json, http code 400
 
+
+### 性能采集
+
+endpoint: `/profile`
+
+在推理线程上开启 torch.profiler (CPU, 有 CUDA 时包括 CUDA), 采集接下来 requests 个请求或 seconds 秒 (先到为准),
+结束后在 --profile_dir 中写入 Chrome trace (.trace.json), 按算子 (.ops.txt) 与按调用栈 (.stacks.txt, .folded) 汇总的耗时;
+不带 requests/seconds 时返回当前/最近一次采集的状态与文件路径
+tts_infer_yaml_path: 采集哪个声音的推理线程, 默认 GPT_SoVITS/configs/tts_infer.yaml
+
+GET:
+```
+http://127.0.0.1:9880/profile?requests=20
+```
+
+RESP: 采集状态, 未设置 --profile_dir 时 http code 403
+
+
+### 就绪探针
+
+endpoint: `/ready`
+
+--warmup_voices 中的声音, 以及 yaml 中设置了 warmup: true 的声音 (在其推理线程建立时) 会先预热 (各语言前端, 参考音频, 各批大小的 T2S/VITS);
+预热完成前返回 http code 503, 之后返回 200. 预热的语言/批大小/参考音频等见 yaml 中的 warmup_* 项
+
+GET:
+```
+http://127.0.0.1:9880/ready
+```
+
+RESP: {"ready": bool, "voices": {tts_infer yaml 路径: 预热报告 (各阶段耗时与错误)}}
+
+
+### 监控指标
+
+endpoint: `/metrics`
+
+GET:
+```
+http://127.0.0.1:9880/metrics
+```
+
+RESP: Prometheus 文本格式的指标, 包括各阶段耗时直方图 (tts_stage_seconds: 前端 G2P/BERT, 参考音频处理, T2S prefill/逐 token 解码, VITS, 编码),
+批大小, T2S 每秒解码 token 数, 实时率, 首段延迟, 队列深度, 各缓存命中率与显存占用
+
 """
 
 import os
 import sys
 import traceback
-from typing import Generator
-
-import torch
+from typing import AsyncIterator
 
 now_dir = os.getcwd()
 sys.path.append(now_dir)
 sys.path.append("%s/GPT_SoVITS" % (now_dir))
 
 import argparse
+import asyncio
 import glob
 import json
 import signal
-import subprocess
-import wave
-from functools import lru_cache
+import uuid
+import threading
+from collections import OrderedDict
 from io import BytesIO
+from time import time as ttime
 from typing import Optional, Union
 
 import numpy as np
-import soundfile as sf
 import uvicorn
 from fastapi import FastAPI, File, Form, HTTPException, Response, UploadFile
 from fastapi.responses import JSONResponse, StreamingResponse
@@ -131,20 +187,41 @@ from GPT_SoVITS.TTS_infer_pack.text_segmentation_method import (
     get_method_names as get_cut_method_names,
 )
 from GPT_SoVITS.TTS_infer_pack.TTS import TTS, TTS_Config
+from GPT_SoVITS.TTS_infer_pack.model_residency import VoiceResidencyManager
+from GPT_SoVITS.TTS_infer_pack.stream_encoder import MEDIA_TYPES, content_type, encode_audio, open_stream_encoder
+from GPT_SoVITS.TTS_infer_pack.response_cache import ResponseCache
+from GPT_SoVITS.TTS_infer_pack import metrics, tracing
+from GPT_SoVITS.TTS_infer_pack.profiler_capture import ProfilerCapture
+from GPT_SoVITS.TTS_infer_pack.request_scheduler import QueueFullError, TTSRequestScheduler, parse_cpu_list
 
 cut_method_names = get_cut_method_names()
 
 parser = argparse.ArgumentParser(description="GPT-SoVITS api")
 parser.add_argument("-a", "--bind_addr", type=str, default="0.0.0.0", help="default: 0.0.0.0")
 parser.add_argument("-p", "--port", type=int, default="9880", help="default: 9880")
+parser.add_argument("--max_queue", type=int, default=0, help="每个推理线程最多排队的请求数, 超出返回503, 0 为不限制")
+parser.add_argument("--cpu_affinity", type=str, default="", help="推理线程绑定的CPU, 如 0-7")
+parser.add_argument("--voice_vram_mb", type=float, default=2048, help="常驻显存的声音(GPT+SoVITS权重)总预算(MB), 超出时最久未用的声音移到内存, 0 为不限制")
+parser.add_argument("--response_cache_mb", type=float, default=0, help="固定 seed 请求的响应缓存内存上限(MB), 0 为不启用内存缓存")
+parser.add_argument("--response_cache_dir", type=str, default="", help="响应缓存的磁盘目录, 为空不启用磁盘缓存")
+parser.add_argument("--response_cache_disk_mb", type=float, default=1024, help="响应缓存的磁盘上限(MB)")
+parser.add_argument("--trace_file", type=str, default="", help="每个请求的追踪 span 以 JSON 行写入该文件, 为空不写")
+parser.add_argument("--trace_otel", action="store_true", default=False, help="通过 OpenTelemetry 导出追踪 span (需安装 opentelemetry-sdk 并配置导出器)")
+parser.add_argument("--profile_dir", type=str, default="", help="profiler 采集结果的输出目录, 为空不开放 /profile")
+parser.add_argument("--warmup_voices", type=str, default="", help="启动时加载并预热的声音 (tts_infer yaml 路径, 逗号分隔)")
 args = parser.parse_args()
+tracing.configure(args.trace_file, args.trace_otel)
+
+# 固定 seed 的请求结果可复现, 按全部推理输入与模型权重的内容哈希缓存编码后的音频
+response_cache = ResponseCache(args.response_cache_mb, args.response_cache_dir, args.response_cache_disk_mb) \
+    if args.response_cache_mb > 0 or args.response_cache_dir else None
 port = args.port
 host = args.bind_addr
 argv = sys.argv
 
 APP = FastAPI(servers=[{"url": "https://cloud-gateway.ces.myfiinet.com/ai-audio/tts"}, {"url": "http://10.20.216.222:6616"}])
 
-SPEAKER_HOME_DIR = "/workspace/reference"  # 會放audio, 還有一個對應speaker的json
+SPEAKER_HOME_DIR = "/workspace/reference"  # 會放audio, 還有一個對應speaker的json, 以及預先計算的參考特徵{name}.{模型版本}.pt
 
 speakers: dict[str, "Speaker"] = {}
 
@@ -158,6 +235,32 @@ class Speaker(BaseModel):
     def audio_path(self):
         return os.path.join(SPEAKER_HOME_DIR, f"{self.name}.wav")
 
+    def artifact_path(self, version: str):
+        return os.path.join(SPEAKER_HOME_DIR, f"{self.name}.{version}.pt")
+
+    def remove_artifacts(self, keep: str = None):
+        for path in glob.glob(os.path.join(SPEAKER_HOME_DIR, f"{self.name}.*.pt")):
+            if path != keep:
+                os.remove(path)
+
+    def prepare(self, tts: TTS):
+        """
+        確保speaker的參考特徵(prompt semantic, 參考頻譜, 參考文本的phones/BERT, 音色向量)已在tts的prompt cache中,
+        依序: prompt cache -> 對應目前模型權重的預計算檔 -> 重新計算並保存(同時刪除其他模型版本的舊檔)
+        """
+        prompt_lang = (self.prompt_lang or "").lower()
+        prompt_text = tts.normalize_prompt_text(self.prompt_text, prompt_lang) if self.prompt_text else None
+        if tts.has_prompt_entry(self.audio_path, prompt_text, prompt_lang):
+            return
+        path = self.artifact_path(tts.get_prompt_artifact_version())
+        if tts.load_prompt_artifact(path, self.audio_path, prompt_text, prompt_lang) is not None:
+            print(f"speaker {self.name}: loaded precomputed reference features from {path}")
+            return
+        entry = tts.get_prompt_entry(self.audio_path, None, prompt_text, prompt_lang)
+        tts.save_prompt_artifact(entry, path)
+        self.remove_artifacts(keep=path)
+        print(f"speaker {self.name}: saved precomputed reference features to {path}")
+
     @classmethod
     def get_by_name(cls, name: str):
         if name in speakers:
@@ -190,6 +293,8 @@ class Speaker(BaseModel):
             self.prompt_lang = prompt_lang
         if prompt_text is not None:
             self.prompt_text = prompt_text
+        # 音檔或參考文本變了, 預計算的參考特徵作廢
+        self.remove_artifacts()
         # 更新json
         speaker_json_path = os.path.join(SPEAKER_HOME_DIR, f"{self.name}.json")
         with open(speaker_json_path, "w") as f:
@@ -239,89 +344,104 @@ class TTS_Request(BaseModel):
     """推理时需要加载的声音模型的yaml配置文件路径，如：GPT_SoVITS/configs/tts_infer.yaml"""
 
 
-@lru_cache(maxsize=10)
-def get_tts_instance(tts_config: TTS_Config) -> TTS:
-    # 此方法使用config path當作key, 維持tts instance, 故假設我限制只使用同一位置之config path
+_tts_worker_lock = threading.Lock()
+
+# 最近使用的声音的 GPT/SoVITS 权重留在显存, 超出预算时最久未用的声音在后台移到 pinned 内存, 用到时再搬回
+voice_residency = VoiceResidencyManager(args.voice_vram_mb)
+
+
+def run_with_voice(tts_config: TTS_Config, tts_instance: TTS, fn, *args):
+    # 在推理線程中執行, 確保聲音權重在顯存中
+    with voice_residency.use(tts_config.configs_path, tts_instance):
+        return fn(*args)
+
+
+# 已建立的推理線程, 以config path當作key, 每個線程持有該聲音的tts instance, 按最近使用排序, 也供 /metrics 讀取
+tts_workers: OrderedDict[str, TTSRequestScheduler] = OrderedDict()
+MAX_TTS_WORKERS = 10
+# 各聲音的預熱任務, 全部完成前 /ready 返回 503
+warmup_futures: dict = {}
+
+
+def start_warmup(tts_config: TTS_Config, worker: TTSRequestScheduler):
+    # 預熱作為推理線程的任務執行, 之後到達的請求排在其後
+    warmup_futures[tts_config.configs_path] = worker.call(run_with_voice, tts_config, worker.tts, worker.tts.warmup)
+
+
+def _get_tts_worker(tts_config: TTS_Config) -> TTSRequestScheduler:
+    # 此方法使用config path當作key, 維持tts instance與其推理線程, 故假設我限制只使用同一位置之config path
     # 則speaker為singleton
+    worker = tts_workers.get(tts_config.configs_path)
+    if worker is not None:
+        tts_workers.move_to_end(tts_config.configs_path)
+        return worker
     print(f"load tts config from {tts_config.configs_path}")
-    return TTS(tts_config)
+    worker = TTSRequestScheduler(
+        TTS(tts_config),
+        max_queue=args.max_queue,
+        cpu_affinity=parse_cpu_list(args.cpu_affinity),
+        name=f"tts-worker-{os.path.basename(tts_config.configs_path)}",
+    )
+    tts_workers[tts_config.configs_path] = worker
+    if tts_config.warmup:
+        start_warmup(tts_config, worker)
+    while len(tts_workers) > MAX_TTS_WORKERS:
+        _close_tts_worker(next(iter(tts_workers)))
+    return worker
 
 
-def pack_ogg(io_buffer: BytesIO, data: np.ndarray, rate: int):
-    """modify from https://github.com/RVC-Boss/GPT-SoVITS/pull/894/files"""
-    with sf.SoundFile(io_buffer, mode="w", samplerate=rate, channels=1, format="ogg") as audio_file:
-        audio_file.write(data)
-    return io_buffer
+def _close_tts_worker(configs_path: str):
+    # 超出數量時關閉最久未用的聲音: 線程執行完已排隊的請求後釋放權重與共享模型並退出, 之後的請求重新載入
+    worker = tts_workers.pop(configs_path)
+    warmup_futures.pop(configs_path, None)
 
+    def release():
+        voice_residency.remove(configs_path, worker.tts)
+        worker.tts.release_shared_models()
 
-def pack_raw(io_buffer: BytesIO, data: np.ndarray, rate: int):
-    io_buffer.write(data.tobytes())
-    return io_buffer
+    worker.stop(release)
+    print(f"closed tts worker of {configs_path}")
 
 
-def pack_wav(io_buffer: BytesIO, data: np.ndarray, rate: int):
-    io_buffer = BytesIO()
-    sf.write(io_buffer, data, rate, format="wav")
-    return io_buffer
+# /metrics 抓取时才读取的指标: 队列深度, 各缓存命中率, 显存
+metrics.REGISTRY.add_collector(metrics.scheduler_collector(lambda: list(tts_workers.values())))
+metrics.REGISTRY.add_collector(metrics.cache_collector("prompt", lambda: [w.tts.get_prompt_cache_report() for w in list(tts_workers.values())]))
+metrics.REGISTRY.add_collector(metrics.cache_collector("semantic", lambda: [w.tts.get_semantic_cache_report() for w in list(tts_workers.values())]))
+if response_cache is not None:
+    metrics.REGISTRY.add_collector(metrics.cache_collector("response", lambda: [response_cache.report()]))
+metrics.REGISTRY.add_collector(metrics.device_memory_collector)
 
 
-def pack_aac(io_buffer: BytesIO, data: np.ndarray, rate: int):
-    process = subprocess.Popen(
-        [
-            "ffmpeg",
-            "-f",
-            "s16le",  # 输入16位有符号小端整数PCM
-            "-ar",
-            str(rate),  # 设置采样率
-            "-ac",
-            "1",  # 单声道
-            "-i",
-            "pipe:0",  # 从管道读取输入
-            "-c:a",
-            "aac",  # 音频编码器为AAC
-            "-b:a",
-            "192k",  # 比特率
-            "-vn",  # 不包含视频
-            "-f",
-            "adts",  # 输出AAC数据流格式
-            "pipe:1",  # 将输出写入管道
-        ],
-        stdin=subprocess.PIPE,
-        stdout=subprocess.PIPE,
-        stderr=subprocess.PIPE,
-    )
-    out, _ = process.communicate(input=data.tobytes())
-    io_buffer.write(out)
-    return io_buffer
+async def get_tts_worker(tts_config: TTS_Config) -> TTSRequestScheduler:
+    # 每個tts instance一個推理線程, 同一instance的請求依序執行, 推理與載入模型都不阻塞事件循環
+    def load():
+        with _tts_worker_lock:
+            return _get_tts_worker(tts_config)
+
+    return await asyncio.to_thread(load)
+
+
+# 啟動時載入並預熱的聲音
+for warmup_voice in [path.strip() for path in args.warmup_voices.split(",") if path.strip()]:
+    warmup_config = TTS_Config(warmup_voice)
+    with _tts_worker_lock:
+        warmup_worker = _get_tts_worker(warmup_config)
+    if warmup_config.configs_path not in warmup_futures:
+        start_warmup(warmup_config, warmup_worker)
 
 
 def pack_audio(io_buffer: BytesIO, data: np.ndarray, rate: int, media_type: str):
-    if media_type == "ogg":
-        io_buffer = pack_ogg(io_buffer, data, rate)
-    elif media_type == "aac":
-        io_buffer = pack_aac(io_buffer, data, rate)
-    elif media_type == "wav":
-        io_buffer = pack_wav(io_buffer, data, rate)
-    else:
-        io_buffer = pack_raw(io_buffer, data, rate)
+    # 整段音频编码, 流式输出见 tts_handle 中的 streaming_generator
+    with metrics.stage_timer("pack"):
+        io_buffer.write(encode_audio(data, rate, media_type))
     io_buffer.seek(0)
     return io_buffer
 
 
-# from https://huggingface.co/spaces/coqui/voice-chat-with-mistral/blob/main/app.py
-def wave_header_chunk(frame_input=b"", channels=1, sample_width=2, sample_rate=32000):
-    # This will create a wave header then append the frame input
-    # It should be first on a streaming wav file
-    # Other frames better should not have it (else you will hear some artifacts each chunk start)
-    wav_buf = BytesIO()
-    with wave.open(wav_buf, "wb") as vfout:
-        vfout.setnchannels(channels)
-        vfout.setsampwidth(sample_width)
-        vfout.setframerate(sample_rate)
-        vfout.writeframes(frame_input)
-
-    wav_buf.seek(0)
-    return wav_buf.read()
+def pack_chunk(fn, *args):
+    # 流式响应每个分段的编码 (encoder.encode / encoder.close)
+    with metrics.stage_timer("pack"):
+        return fn(*args)
 
 
 def handle_control(command: str):
@@ -336,7 +456,6 @@ def check_params(req: dict, tts_config: TTS_Config):
     text: str = req.get("text", "")
     text_lang: str = req.get("text_lang", "")
     ref_audio_path: str = req.get("ref_audio_path", "")
-    streaming_mode: bool = req.get("streaming_mode", False)
     media_type: str = req.get("media_type", "wav")
     prompt_lang: str = req.get("prompt_lang", "")
     text_split_method: str = req.get("text_split_method", "cut5")
@@ -353,10 +472,8 @@ def check_params(req: dict, tts_config: TTS_Config):
         return JSONResponse(status_code=400, content={"message": "prompt_lang is required"})
     elif prompt_lang.lower() not in tts_config.languages:
         return JSONResponse(status_code=400, content={"message": "prompt_lang is not supported"})
-    if media_type not in ["wav", "raw", "ogg", "aac"]:
+    if media_type not in MEDIA_TYPES:
         return JSONResponse(status_code=400, content={"message": "media_type is not supported"})
-    elif media_type == "ogg" and not streaming_mode:
-        return JSONResponse(status_code=400, content={"message": "ogg format is not supported in non-streaming mode"})
 
     if text_split_method not in cut_method_names:
         return JSONResponse(status_code=400, content={"message": f"text_split_method:{text_split_method} is not supported"})
@@ -364,7 +481,7 @@ def check_params(req: dict, tts_config: TTS_Config):
     return None
 
 
-async def tts_handle(req: dict):
+async def tts_handle(req: dict, speaker: "Speaker" = None):
     """
     Text to speech handler.
 
@@ -386,15 +503,28 @@ async def tts_handle(req: dict):
                 "speed_factor":1.0,           # float. control the speed of the synthesized audio.
                 "fragment_interval":0.3,      # float. to control the interval of the audio fragment.
                 "seed": -1,                   # int. random seed for reproducibility.
-                "media_type": "wav",          # str. media type of the output audio, support "wav", "raw", "ogg", "aac".
+                "media_type": "wav",          # str. media type of the output audio, support "wav", "raw", "ogg", "opus", "mp3", "aac".
                 "streaming_mode": False,      # bool. whether to return a streaming response.
                 "parallel_infer": True,       # bool.(optional) whether to use parallel inference.
                 "repetition_penalty": 1.35    # float.(optional) repetition penalty for T2S model.
             }
+        speaker (Speaker): the registered speaker of ref_audio_path/prompt_text/prompt_lang, if any.
     returns:
         StreamingResponse: audio stream response.
     """
-
+    # 每个请求一个 id, 在 API 与推理线程中的 span 都带上它, 并通过 X-Request-ID 返回给客户端
+    request_id = uuid.uuid4().hex
+    req["request_id"] = request_id
+    with tracing.span("api.tts", scope={"request_id": request_id},
+                      streaming=bool(req.get("streaming_mode", False)), media_type=req.get("media_type", "wav")) as api_span:
+        req["trace_context"] = api_span.context()
+        response = await _tts_handle(req, speaker)
+        api_span.set_attribute("status_code", response.status_code)
+    response.headers["X-Request-ID"] = request_id
+    return response
+
+
+async def _tts_handle(req: dict, speaker: "Speaker" = None):
     streaming_mode = req.get("streaming_mode", False)
     media_type = req.get("media_type", "wav")
 
@@ -409,21 +539,47 @@ async def tts_handle(req: dict):
         req["return_fragment"] = True
 
     try:
-        tts_instance = get_tts_instance(tts_config)
-
-        move_to_original(tts_instance, tts_config)
-
-        tts_generator = tts_instance.run(req)
+        tts_worker = await get_tts_worker(tts_config)
+        tts_instance = tts_worker.tts
+        # 排隊時就開始把權重搬到顯存
+        voice_residency.prefetch(tts_config.configs_path, tts_instance)
 
         if streaming_mode:
 
-            def streaming_generator(tts_generator: Generator, media_type: str):
-                if media_type == "wav":
-                    yield wave_header_chunk()
-                    media_type = "raw"
-                for sr, chunk in tts_generator:
-                    yield pack_audio(BytesIO(), chunk, sr, media_type).getvalue()
-                # move_to_cpu(tts_instance)
+            def synthesize_stream(req: dict):
+                # 在推理線程中執行
+                with voice_residency.use(tts_config.configs_path, tts_instance):
+                    if speaker is not None:
+                        speaker.prepare(tts_instance)
+                    yield from tts_instance.run(req)
+
+            tts_generator = tts_worker.stream_async(synthesize_stream, req)
+
+            async def streaming_generator(tts_generator: AsyncIterator, media_type: str):
+                # 整个响应共用一个编码器, 输出一条连续的码流
+                encoder = None
+                t_stream = ttime()
+                chunks, size = 0, 0
+                try:
+                    async for sr, chunk in tts_generator:
+                        if encoder is None:
+                            encoder = await asyncio.to_thread(open_stream_encoder, media_type, sr)
+                        data = await asyncio.to_thread(pack_chunk, encoder.encode, chunk)
+                        chunks += 1
+                        if data:
+                            size += len(data)
+                            yield data
+                    if encoder is not None:
+                        data = await asyncio.to_thread(pack_chunk, encoder.close)
+                        if data:
+                            size += len(data)
+                            yield data
+                finally:
+                    if encoder is not None:
+                        encoder.abort()
+                    # 流式响应在 api.tts 返回后才发送, 单独记录整个发送过程
+                    tracing.record("api.stream", t_stream, parent=req["trace_context"],
+                                   scope={"request_id": req["request_id"]}, chunks=chunks, bytes=size)
 
             # _media_type = f"audio/{media_type}" if not (streaming_mode and media_type in ["wav", "raw"]) else f"audio/x-{media_type}"
             return StreamingResponse(
@@ -431,29 +587,69 @@ async def tts_handle(req: dict):
                     tts_generator,
                     media_type,
                 ),
-                media_type=f"audio/{media_type}",
+                media_type=content_type(media_type),
             )
 
         else:
-            sr, audio_data = next(tts_generator)
-            audio_data = pack_audio(BytesIO(), audio_data, sr, media_type).getvalue()
-            move_to_cpu(tts_instance)
-            return Response(audio_data, media_type=f"audio/{media_type}")
+            cache_key = None
+            if response_cache is not None:
+                cache_key = await asyncio.to_thread(tts_instance.response_fingerprint, req)
+                audio_data = await asyncio.to_thread(response_cache.get, cache_key, media_type)
+                if audio_data is not None:
+                    tracing.set_attributes(response_cache="hit")
+                    return Response(audio_data, media_type=content_type(media_type))
+
+            def synthesize(req: dict):
+                if speaker is not None:
+                    speaker.prepare(tts_instance)
+                return next(tts_instance.run(req))
+
+            sr, audio_data = await tts_worker.call_async(run_with_voice, tts_config, tts_instance, synthesize, req)
+            with tracing.span("api.pack", samples=len(audio_data)):
+                audio_data = (await asyncio.to_thread(pack_audio, BytesIO(), audio_data, sr, media_type)).getvalue()
+            # 推理期间换了权重则指纹改变, 不缓存
+            if cache_key is not None and cache_key == await asyncio.to_thread(tts_instance.response_fingerprint, req):
+                await asyncio.to_thread(response_cache.put, cache_key, media_type, audio_data)
+            return Response(audio_data, media_type=content_type(media_type))
+    except QueueFullError as e:
+        return JSONResponse(status_code=503, content={"message": "server busy", "Exception": str(e)})
     except Exception as e:
         return JSONResponse(status_code=400, content={"message": "tts failed", "Exception": str(e)})
 
 
-def move_to_cpu(tts):
-    cpu_device = torch.device("cpu")
-    tts.set_device(cpu_device, False)
-    tts.enable_half_precision(False, False)
-    print("Moved TTS models to CPU to save GPU memory.")
+@APP.get("/metrics")
+async def get_metrics():
+    # Prometheus 文本格式
+    content = await asyncio.to_thread(metrics.REGISTRY.render)
+    return Response(content, media_type="text/plain; version=0.0.4; charset=utf-8")
 
 
-def move_to_original(tts: TTS, tts_config: TTS_Config):
-    tts.set_device(tts_config.device, False)
-    tts.enable_half_precision(tts_config.is_half, False)
-    print("Moved TTS models back to original device for performance.")
+@APP.get("/ready")
+async def ready():
+    # 就緒探針: 已開始的預熱都完成(成功或失敗)後就緒
+    is_ready = all(future.done() for future in list(warmup_futures.values()))
+    voices = {path: worker.tts.warmup_report for path, worker in list(tts_workers.items())}
+    return JSONResponse(status_code=200 if is_ready else 503, content={"ready": is_ready, "voices": voices})
+
+
+@APP.get("/profile")
+async def profile(requests: int = 0, seconds: float = 0, tts_infer_yaml_path: str = "GPT_SoVITS/configs/tts_infer.yaml",
+                  with_stack: bool = True, record_shapes: bool = False):
+    # 在該聲音的推理線程上開啟 torch.profiler, 採集接下來 requests 個請求或 seconds 秒; 不帶 requests/seconds 時返回採集狀態
+    if args.profile_dir in [None, ""]:
+        return JSONResponse(status_code=403, content={"message": "profiling is disabled, start the server with --profile_dir"})
+    try:
+        tts_config = TTS_Config(tts_infer_yaml_path)
+        if requests <= 0 and seconds <= 0:
+            tts_worker = tts_workers.get(tts_config.configs_path)
+            return JSONResponse(status_code=200, content=tts_worker.capture.report() \
+                if tts_worker is not None and tts_worker.capture is not None else {"state": "idle"})
+        tts_worker = await get_tts_worker(tts_config)
+        capture = ProfilerCapture(args.profile_dir, tts_worker.name, requests, seconds, with_stack, record_shapes)
+        await asyncio.wrap_future(tts_worker.start_capture(capture))
+    except Exception as e:
+        return JSONResponse(status_code=400, content={"message": "start profiler failed", "Exception": str(e)})
+    return JSONResponse(status_code=200, content=capture.report())
 
 
 @APP.get("/control")
@@ -488,6 +684,7 @@ async def tts_get_endpoint(
     tts_infer_yaml_path: str = "GPT_SoVITS/configs/tts_infer.yaml",
 ):
     # 如果speaker有給, 則忽略ref_audio_path, prompt_lang, prompt_text
+    speaker_obj = None
     if speaker is not None:
         speaker_obj = Speaker.get_by_name(speaker)
         if speaker_obj is None:
@@ -523,7 +720,7 @@ async def tts_get_endpoint(
         "tts_infer_yaml_path": tts_infer_yaml_path,
     }
 
-    return await tts_handle(req)
+    return await tts_handle(req, speaker_obj)
 
 
 @APP.post("/tts")
@@ -539,14 +736,28 @@ async def upload_speaker(
     prompt_text: Optional[str] = Form(None),
     file: UploadFile = File(...),
     # file_url: str = Form(default=None),
+    tts_infer_yaml_path: str = Form("GPT_SoVITS/configs/tts_infer.yaml"),
 ):
     speaker = Speaker.get_by_name(name)
     if speaker is None:
         speaker = Speaker(name=name)
     speaker.update(file, prompt_lang, prompt_text)
+    # 註冊時就算好參考特徵並保存, 合成時直接載入
+    try:
+        tts_config = TTS_Config(tts_infer_yaml_path)
+        tts_worker = await get_tts_worker(tts_config)
+        await tts_worker.call_async(run_with_voice, tts_config, tts_worker.tts, speaker.prepare, tts_worker.tts)
+    except Exception as e:
+        return JSONResponse(status_code=400, content={"message": f"speaker {name} updated, but precomputing reference features failed", "Exception": str(e)})
     return JSONResponse(status_code=200, content={"message": f"speaker {name} updated"})
 
 
+@APP.get("/residency")
+async def get_residency():
+    # 各聲音權重的駐留狀態與搬移耗時
+    return JSONResponse(status_code=200, content=voice_residency.report())
+
+
 @APP.get("/speakers")
 async def get_speakers():
     # 檢查SPEAKER_HOME_DIR, 找所有json, 然後嘗試Speaker.get_by_name for all json
@@ -563,8 +774,8 @@ async def get_speakers():
 async def set_refer_audio(refer_audio_path: str = None, tts_infer_yaml_path: str = "GPT_SoVITS/configs/tts_infer.yaml"):
     try:
         tts_config = TTS_Config(tts_infer_yaml_path)
-        tts_instance = get_tts_instance(tts_config)
-        tts_instance.set_ref_audio(refer_audio_path)
+        tts_worker = await get_tts_worker(tts_config)
+        await tts_worker.call_async(run_with_voice, tts_config, tts_worker.tts, tts_worker.tts.set_ref_audio, refer_audio_path)
     except Exception as e:
         return JSONResponse(status_code=400, content={"message": "set refer audio failed", "Exception": str(e)})
     return JSONResponse(status_code=200, content={"message": "success"})
@@ -577,8 +788,11 @@ async def set_gpt_weights(weights_path: str = None, tts_infer_yaml_path: str = "
             return JSONResponse(status_code=400, content={"message": "gpt weight path is required"})
 
         tts_config = TTS_Config(tts_infer_yaml_path)
-        tts_instance = get_tts_instance(tts_config)
-        tts_instance.init_t2s_weights(weights_path)
+        tts_worker = await get_tts_worker(tts_config)
+        await tts_worker.call_async(run_with_voice, tts_config, tts_worker.tts, tts_worker.tts.init_t2s_weights, weights_path)
+        if response_cache is not None:
+            # 旧权重的条目不会再命中, 释放内存; 磁盘条目按内容寻址, 换回旧权重时仍然有效
+            response_cache.clear_memory()
     except Exception as e:
         return JSONResponse(status_code=400, content={"message": "change gpt weight failed", "Exception": str(e)})
 
@@ -592,8 +806,11 @@ async def set_sovits_weights(weights_path: str = None, tts_infer_yaml_path: str
             return JSONResponse(status_code=400, content={"message": "sovits weight path is required"})
 
         tts_config = TTS_Config(tts_infer_yaml_path)
-        tts_instance = get_tts_instance(tts_config)
-        tts_instance.init_vits_weights(weights_path)
+        tts_worker = await get_tts_worker(tts_config)
+        await tts_worker.call_async(run_with_voice, tts_config, tts_worker.tts, tts_worker.tts.init_vits_weights, weights_path)
+        if response_cache is not None:
+            # 旧权重的条目不会再命中, 释放内存; 磁盘条目按内容寻址, 换回旧权重时仍然有效
+            response_cache.clear_memory()
     except Exception as e:
         return JSONResponse(status_code=400, content={"message": "change sovits weight failed", "Exception": str(e)})
     return JSONResponse(status_code=200, content={"message": "success"})
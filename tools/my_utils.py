@@ -6,27 +6,61 @@ from tools.i18n.i18n import I18nAuto
 import pandas as pd
 i18n = I18nAuto(language=os.environ.get('language','Auto'))
 
-def load_audio(file, sr):
+try:
+    import soundfile as sf
+    from scipy.signal import resample_poly
+except ImportError:
+    sf = None
+
+# 这些格式优先在进程内用 libsndfile 解码(mp3 需要 libsndfile>=1.1), 其余格式或解码失败时使用 ffmpeg
+INPROCESS_AUDIO_EXTS = {".wav", ".flac", ".ogg", ".oga", ".opus", ".mp3", ".aiff", ".aif"}
+
+
+def _load_audio_soundfile(file, sr):
+    audio, file_sr = sf.read(file, dtype="float32", always_2d=True)
+    audio = audio.mean(axis=1)
+    if file_sr != sr:
+        gcd = np.gcd(int(file_sr), int(sr))
+        audio = resample_poly(audio, int(sr) // gcd, int(file_sr) // gcd)
+    return np.ascontiguousarray(audio, dtype=np.float32)
+
+
+def _load_audio_ffmpeg(file, sr):
+    # https://github.com/openai/whisper/blob/main/whisper/audio.py#L26
+    # This launches a subprocess to decode audio while down-mixing and resampling as necessary.
+    # Requires the ffmpeg CLI and `ffmpeg-python` package to be installed.
+    out, _ = (
+        ffmpeg.input(file, threads=0)
+        .output("-", format="f32le", acodec="pcm_f32le", ac=1, ar=sr)
+        .run(cmd=["ffmpeg", "-nostdin"], capture_stdout=True, capture_stderr=True)
+    )
+    return np.frombuffer(out, np.float32).flatten()
+
+
+def load_audio(file, sr, backend="auto"):
+    """
+    读取音频为单声道 float32, 并重采样到 sr。
+    backend: auto(常见格式进程内解码, 失败时回退到 ffmpeg) | soundfile | ffmpeg
+    """
     try:
-        # https://github.com/openai/whisper/blob/main/whisper/audio.py#L26
-        # This launches a subprocess to decode audio while down-mixing and resampling as necessary.
-        # Requires the ffmpeg CLI and `ffmpeg-python` package to be installed.
         file = clean_path(file)  # 防止小白拷路径头尾带了空格和"和回车
         if os.path.exists(file) == False:
             raise RuntimeError(
                 "You input a wrong audio path that does not exists, please fix it!"
             )
-        out, _ = (
-            ffmpeg.input(file, threads=0)
-            .output("-", format="f32le", acodec="pcm_f32le", ac=1, ar=sr)
-            .run(cmd=["ffmpeg", "-nostdin"], capture_stdout=True, capture_stderr=True)
-        )
+        if backend == "soundfile" or (
+            backend == "auto" and sf is not None and os.path.splitext(file)[1].lower() in INPROCESS_AUDIO_EXTS
+        ):
+            try:
+                return _load_audio_soundfile(file, sr)
+            except Exception:
+                if backend == "soundfile":
+                    raise
+        return _load_audio_ffmpeg(file, sr)
     except Exception as e:
         traceback.print_exc()
         raise RuntimeError(i18n("音频加载失败"))
 
-    return np.frombuffer(out, np.float32).flatten()
-
 
 def clean_path(path_str:str):
     if path_str.endswith(('\\','/')):